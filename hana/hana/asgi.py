@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hana.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Same as get_asgi_application(), with a handler that streams the live
+# utilization views without blocking the event loop (see swarman/asgi.py)
+from swarman.asgi import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
@@ -58,6 +58,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'swarman.middleware.ProfilingMiddleware',
+    'swarman.middleware.DeadlineMiddleware',
 ]
 
 ROOT_URLCONF = 'hana.urls'
@@ -93,6 +95,16 @@ DATABASES = {
 }
 
 
+# Cache
+# The collect_stats command and the web process share utilization samples
+# through the cache, so the default backend must be visible to both.
+
+CACHES = {
+    'default': env.cache('CACHE_URL',
+                         default=f'filecache://{BASE_DIR / ".cache"}'),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -137,3 +149,177 @@ STATIC_ROOT = BASE_DIR / 'static'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+
+
+# Swarman
+# Container stats are collected concurrently; these bound how many containers
+# are polled at once per node (or per swarm wide poll) and how long a single container's stats call
+# may take (in seconds) before it is reported as an error.
+
+SWARMAN_STATS_MAX_WORKERS = env.int('SWARMAN_STATS_MAX_WORKERS', default=8)
+
+SWARMAN_STATS_TIMEOUT = env.int('SWARMAN_STATS_TIMEOUT', default=10)
+
+# Read container stats with one-shot calls (Engine API 1.41+), which answer
+# straight away instead of waiting about a second for a second sample. CPU
+# usage is diffed against the container's previous reading, kept in the cache
+# for SWARMAN_STATS_ONE_SHOT_MAX_AGE seconds; containers without one are read
+# the two sample way.
+
+SWARMAN_STATS_ONE_SHOT = env.bool('SWARMAN_STATS_ONE_SHOT', default=False)
+
+SWARMAN_STATS_ONE_SHOT_MAX_AGE = env.int('SWARMAN_STATS_ONE_SHOT_MAX_AGE',
+                                         default=300)
+
+# Seconds a swarm wide utilization poll waits for its nodes before marking
+# the remaining ones as timed out, and how many of its nodes are polled at
+# once. Their container stats share one pool of SWARMAN_STATS_MAX_WORKERS.
+
+SWARMAN_SWARM_UTILIZATION_DEADLINE = env.int(
+    'SWARMAN_SWARM_UTILIZATION_DEADLINE', default=15)
+
+SWARMAN_SWARM_UTILIZATION_MAX_WORKERS = env.int(
+    'SWARMAN_SWARM_UTILIZATION_MAX_WORKERS', default=4)
+
+# Docker clients are shared per endpoint (see swarman/clients.py). Clients
+# idle for SWARMAN_DOCKER_IDLE_TIMEOUT seconds are dropped, clients idle for
+# SWARMAN_DOCKER_HEALTH_CHECK_INTERVAL seconds are pinged before reuse and
+# SWARMAN_DOCKER_POOL_SIZE keep-alive connections are kept per endpoint.
+
+SWARMAN_DOCKER_MAX_CLIENTS = env.int('SWARMAN_DOCKER_MAX_CLIENTS', default=32)
+
+SWARMAN_DOCKER_IDLE_TIMEOUT = env.int('SWARMAN_DOCKER_IDLE_TIMEOUT',
+                                      default=300)
+
+SWARMAN_DOCKER_HEALTH_CHECK_INTERVAL = env.int(
+    'SWARMAN_DOCKER_HEALTH_CHECK_INTERVAL', default=30)
+
+SWARMAN_DOCKER_POOL_SIZE = env.int('SWARMAN_DOCKER_POOL_SIZE',
+                                   default=max(10, SWARMAN_STATS_MAX_WORKERS))
+
+SWARMAN_DOCKER_TIMEOUT = env.int('SWARMAN_DOCKER_TIMEOUT', default=60)
+
+# Seconds every request may spend on Docker calls, by URL name, with
+# SWARMAN_REQUEST_DEADLINE for the rest. Each call may use at most
+# SWARMAN_DEADLINE_CALL_SHARE of the time left; once it is spent pages show
+# the remaining nodes as Unknown.
+
+SWARMAN_REQUEST_DEADLINE = env.int('SWARMAN_REQUEST_DEADLINE', default=30)
+
+SWARMAN_REQUEST_DEADLINES = {
+    'swarm-dashboard': env.int('SWARMAN_DASHBOARD_DEADLINE', default=10),
+    'node-detail': env.int('SWARMAN_NODE_DETAIL_DEADLINE', default=10),
+    'service-detail': env.int('SWARMAN_SERVICE_DETAIL_DEADLINE', default=10),
+    'api-node-utilization': env.int('SWARMAN_NODE_UTILIZATION_DEADLINE',
+                                    default=15),
+    # Leaves time to answer after the swarm wide poll gives up on nodes
+    'api-swarm-utilization': SWARMAN_SWARM_UTILIZATION_DEADLINE + 5,
+}
+
+SWARMAN_DEADLINE_CALL_SHARE = env.float('SWARMAN_DEADLINE_CALL_SHARE',
+                                        default=0.5)
+
+# A manager that fails SWARMAN_MANAGER_FAILURE_THRESHOLD requests in a row is
+# tried last for SWARMAN_MANAGER_RETRY_INTERVAL seconds, then probed again.
+
+SWARMAN_MANAGER_FAILURE_THRESHOLD = env.int(
+    'SWARMAN_MANAGER_FAILURE_THRESHOLD', default=3)
+
+SWARMAN_MANAGER_RETRY_INTERVAL = env.int('SWARMAN_MANAGER_RETRY_INTERVAL',
+                                         default=30)
+
+# Seconds a Node reuses the result of inspecting it on a manager, so the
+# status/availability lookups made while rendering a page share one call.
+
+SWARMAN_NODE_INFO_TTL = env.int('SWARMAN_NODE_INFO_TTL', default=5)
+
+# Background stats collector (manage.py collect_stats). Samples older than
+# SWARMAN_STATS_MAX_AGE seconds are ignored and utilization is sampled on
+# demand instead.
+
+SWARMAN_STATS_MAX_AGE = env.int('SWARMAN_STATS_MAX_AGE', default=15)
+
+SWARMAN_COLLECTOR_REFRESH_INTERVAL = env.int(
+    'SWARMAN_COLLECTOR_REFRESH_INTERVAL', default=10)
+
+SWARMAN_COLLECTOR_FLUSH_INTERVAL = env.int('SWARMAN_COLLECTOR_FLUSH_INTERVAL',
+                                           default=2)
+
+SWARMAN_COLLECTOR_POOL_SIZE = env.int('SWARMAN_COLLECTOR_POOL_SIZE',
+                                      default=64)
+
+# Seconds the Service table is used by the dashboard before it is synced
+# from the swarm again (see also manage.py sync_services)
+
+SWARMAN_SERVICES_MAX_AGE = env.int('SWARMAN_SERVICES_MAX_AGE', default=30)
+
+# Docker event listener (manage.py listen_events). Swarm node and service
+# listings are cached while the listener for the swarm has sent a heartbeat
+# in the last SWARMAN_EVENTS_HEARTBEAT_TIMEOUT seconds. The Swarm and Node
+# tables are re-read every SWARMAN_EVENTS_REFRESH_INTERVAL seconds.
+
+SWARMAN_EVENTS_HEARTBEAT_TIMEOUT = env.int('SWARMAN_EVENTS_HEARTBEAT_TIMEOUT',
+                                           default=30)
+
+SWARMAN_EVENTS_REFRESH_INTERVAL = env.int('SWARMAN_EVENTS_REFRESH_INTERVAL',
+                                          default=30)
+
+# Live utilization streams (swarman/streams.py). A node or swarm with open
+# streams is sampled every SWARMAN_STREAM_INTERVAL seconds, streams send a
+# keepalive after SWARMAN_STREAM_KEEPALIVE idle seconds and are closed (the
+# browser reconnects) after SWARMAN_STREAM_MAX_AGE seconds. Under WSGI each
+# open stream holds a worker thread, so a process serves at most
+# SWARMAN_STREAM_MAX_CLIENTS of them (0 for no limit) and pages beyond that
+# poll instead. Keep it below the server's thread count. Async streams
+# (SWARMAN_ASYNC_VIEWS) hold no thread and are not limited.
+
+SWARMAN_STREAM_INTERVAL = env.int('SWARMAN_STREAM_INTERVAL', default=5)
+
+SWARMAN_STREAM_KEEPALIVE = env.int('SWARMAN_STREAM_KEEPALIVE', default=15)
+
+SWARMAN_STREAM_MAX_AGE = env.int('SWARMAN_STREAM_MAX_AGE', default=300)
+
+SWARMAN_STREAM_MAX_CLIENTS = env.int('SWARMAN_STREAM_MAX_CLIENTS', default=8)
+
+# Record the Docker calls and queries of every request, reported in
+# Server-Timing headers and summarised for the last SWARMAN_PROFILING_HISTORY
+# requests at api/docker/profile (swarman/profiling.py)
+
+SWARMAN_PROFILING = env.bool('SWARMAN_PROFILING', default=False)
+
+SWARMAN_PROFILING_HISTORY = env.int('SWARMAN_PROFILING_HISTORY', default=500)
+
+# Seconds a swarm's node listing is reused by /metrics scrapes when no event
+# listener keeps it cached (swarman/metrics.py)
+
+SWARMAN_METRICS_MAX_AGE = env.int('SWARMAN_METRICS_MAX_AGE', default=15)
+
+# Utilization history. The collector records node totals every
+# SWARMAN_HISTORY_INTERVAL seconds, rolls them up into 1 minute and 1 hour
+# averages and keeps each resolution for the number of seconds below.
+
+SWARMAN_HISTORY_INTERVAL = env.int('SWARMAN_HISTORY_INTERVAL', default=10)
+
+SWARMAN_HISTORY_RETENTION = {
+    'raw': env.int('SWARMAN_HISTORY_RAW_RETENTION', default=24 * 3600),
+    'minute': env.int('SWARMAN_HISTORY_MINUTE_RETENTION',
+                      default=7 * 24 * 3600),
+    'hour': env.int('SWARMAN_HISTORY_HOUR_RETENTION',
+                    default=365 * 24 * 3600),
+}
+
+# Serve the Docker heavy views (dashboard, node and service detail, node
+# utilization and sync) with their async versions. Only useful when running
+# under an ASGI server such as uvicorn or daphne (hana.asgi:application).
+
+SWARMAN_ASYNC_VIEWS = env.bool('SWARMAN_ASYNC_VIEWS', default=False)
+
+# Docker Engine API version used by the async client (swarman/aio_docker.py)
+
+SWARMAN_DOCKER_API_VERSION = env.str('SWARMAN_DOCKER_API_VERSION',
+                                     default='1.41')
+
+# Rows per page of the REST API lists (swarms and nodes) when a client asks
+# for pages. Lists are only paginated when ?cursor= or ?page_size= is given.
+
+SWARMAN_API_PAGE_SIZE = env.int('SWARMAN_API_PAGE_SIZE', default=100)
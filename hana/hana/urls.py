@@ -19,6 +19,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from swarman.views import prometheus_metrics
+
 from . import views
 
 
@@ -37,5 +39,6 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('admin/', admin.site.urls),
     path('swarman/', include(('swarman.urls', 'swarman'), namespace='swarman')),
+    path('metrics', prometheus_metrics, name='metrics'),
     path('docs/api', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
 ]
@@ -1,5 +1,7 @@
 """
 Script to test the ammount of time it takes to collect resource usage stats on a node
+
+Run from the hana directory with: python manage.py shell < node_resource_time_test.py
 """
 
 import time
@@ -7,16 +9,20 @@ import sys
 import docker
 
 from swarman.models import Node
+from swarman import utils
 
 # Setup
 
 # Get list of nodes with services running to test
 nodes = Node.objects.all()
 test_nodes = []
+container_count = 0
 for node in nodes:
     client = docker.DockerClient(base_url=f'tcp://{node.ip_address}:{node.api_port}')
-    if client.containers.list():
+    containers = client.containers.list()
+    if containers:
         test_nodes.append(node)
+        container_count += len(containers)
     client.close()
 
 
@@ -44,6 +50,28 @@ end = time.time()
 new_time_total = end - start
 new_time_node_average = new_time_total / len(test_nodes)
 
+# Test per container stats polled one container at a time
+start = time.time()
+sequential_errors = 0
+for node in test_nodes:
+    for sample in node.utilization_per_container(max_workers=1):
+        sequential_errors += 'error' in sample
+
+end = time.time()
+sequential_time_total = end - start
+sequential_time_node_average = sequential_time_total / len(test_nodes)
+
+# Test per container stats polled concurrently
+start = time.time()
+parallel_errors = 0
+for node in test_nodes:
+    for sample in node.utilization_per_container():
+        parallel_errors += 'error' in sample
+
+end = time.time()
+parallel_time_total = end - start
+parallel_time_node_average = parallel_time_total / len(test_nodes)
+
 print('**********RUN REPORT**********')
 print('\n')
 print('Split Functions:')
@@ -52,4 +80,13 @@ print(f'Average Time: {old_time_node_average}s / Node')
 print('\n')
 print('Combined Function:')
 print(f'Total Time for {len(test_nodes)} Nodes: {new_time_total}s')
-print(f'Average Time: {new_time_node_average}s / Node')
\ No newline at end of file
+print(f'Average Time: {new_time_node_average}s / Node')
+print('\n')
+print(f'Per Container Stats ({container_count} Containers):')
+print(f'Sequential Total Time: {sequential_time_total}s '
+      f'({sequential_time_node_average}s / Node, {sequential_errors} Errors)')
+print(f'Parallel Total Time ({utils.stats_max_workers()} Workers): '
+      f'{parallel_time_total}s '
+      f'({parallel_time_node_average}s / Node, {parallel_errors} Errors)')
+if parallel_time_total > 0:
+    print(f'Speedup: {sequential_time_total / parallel_time_total:.2f}x')
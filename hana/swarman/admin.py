@@ -4,5 +4,20 @@ from .models import Swarm, Node
 
 
 # Register your models here.
-admin.site.register(Swarm)
-admin.site.register(Node)
\ No newline at end of file
+@admin.register(Swarm)
+class SwarmAdmin(admin.ModelAdmin):
+    list_display = ('swarm_name', 'node_count', 'manager_count')
+
+    def get_queryset(self, request):
+        # Counts nodes in the changelist query instead of once per row
+        return super().get_queryset(request).with_counts()
+
+
+@admin.register(Node)
+class NodeAdmin(admin.ModelAdmin):
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # Swarm choices are labelled with their node count
+        if db_field.name == 'swarm':
+            kwargs['queryset'] = Swarm.objects.with_counts()
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
@@ -0,0 +1,150 @@
+"""
+Minimal asyncio client for the Docker Engine HTTP API, used by the async
+views in async_views.py and api/v1_0/async_api_views.py.
+
+The docker SDK is blocking, so every call it makes holds a worker thread for
+the full round trip. Under ASGI these clients let one process wait on many
+Docker daemons at once. Clients are shared per event loop and endpoint and
+keep their connections alive between requests.
+
+Usage:
+    from swarman import aio_docker
+
+    client = aio_docker.get_client(f'tcp://{address}')
+    nodes = await client.get_json('/nodes')
+"""
+import asyncio
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+
+from . import (
+    clients,
+    deadlines,
+    health,
+    metrics,
+    profiling,
+)
+
+
+class AsyncDockerError(Exception):
+    '''Raised when the Docker Engine API answers with an error status'''
+
+    def __init__(self, status_code, message):
+        super().__init__(f'{status_code}: {message}')
+        self.status_code = status_code
+
+
+class AsyncDockerClient:
+    '''
+    Async client for one Docker Engine endpoint (ex: tcp://10.0.0.2:2375)
+    '''
+
+    def __init__(self, base_url, version=None, timeout=None, pool_size=None):
+        if version is None:
+            version = getattr(settings, 'SWARMAN_DOCKER_API_VERSION', '1.41')
+        if timeout is None:
+            timeout = getattr(settings, 'SWARMAN_DOCKER_TIMEOUT', 60)
+        if pool_size is None:
+            pool_size = getattr(settings, 'SWARMAN_DOCKER_POOL_SIZE', 10)
+
+        self.base_url = base_url
+        self.timeout = timeout
+        self._http = httpx.AsyncClient(
+            base_url=f"{base_url.replace('tcp://', 'http://', 1)}/v{version}",
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size))
+
+    async def request(self, method, path, params=None, json=None):
+        '''
+        Sends a request to the Engine API and returns the decoded JSON body
+        (or None for empty responses). Raises AsyncDockerError on error
+        statuses.
+        '''
+        timeout = clients.current_request_timeout()
+        if timeout is None:
+            timeout = self.timeout
+        timeout = deadlines.call_timeout(timeout)
+
+        start = time.monotonic()
+        try:
+            response = await self._http.request(method, path, params=params,
+                                                json=json, timeout=timeout)
+        except httpx.TransportError as err:
+            elapsed = time.monotonic() - start
+            metrics.observe_call(self.base_url, elapsed, error=True)
+            profiling.record_call(self.base_url, method, path, elapsed,
+                                  error=type(err).__name__)
+            if not (isinstance(err, httpx.TimeoutException) and
+                    deadlines.exceeded()):
+                health.record_failure(self.base_url, err)
+            raise
+
+        elapsed = time.monotonic() - start
+        metrics.observe_call(self.base_url, elapsed,
+                             error=response.status_code >= 400)
+        profiling.record_call(
+            self.base_url, method, path, elapsed, len(response.content),
+            response.status_code if response.status_code >= 400 else None)
+        if response.status_code == 503:
+            health.record_failure(self.base_url, response.reason_phrase)
+        else:
+            health.record_success(self.base_url, elapsed)
+
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('message', response.text)
+            except ValueError:
+                message = response.text
+            raise AsyncDockerError(response.status_code, message)
+
+        if not response.content:
+            return None
+        return response.json()
+
+    async def get_json(self, path, params=None):
+        return await self.request('GET', path, params=params)
+
+    async def post_json(self, path, params=None, json=None):
+        return await self.request('POST', path, params=params, json=json)
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+# Connections belong to the event loop that opened them, so clients are
+# kept per loop and dropped together with it
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def get_client(base_url):
+    '''
+    Returns the shared async client for base_url in the running event loop
+    '''
+    loop = asyncio.get_running_loop()
+    loop_clients = _loop_clients.setdefault(loop, {})
+    client = loop_clients.get(base_url)
+    if client is None:
+        client = AsyncDockerClient(base_url)
+        loop_clients[base_url] = client
+
+    return client
+
+
+async def first_manager(addresses, method, path, params=None, json=None):
+    '''
+    Sends a request to each manager address in turn and returns the first
+    successful response. Raises the last error if every manager fails.
+    '''
+    error = AsyncDockerError(503, 'No managers available')
+    for address in addresses:
+        try:
+            return await get_client(f'tcp://{address}').request(
+                method, path, params=params, json=json)
+        except Exception as err:
+            error = err
+
+    raise error
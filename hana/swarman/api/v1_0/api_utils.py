@@ -1,42 +1,170 @@
+import hashlib
+from calendar import timegm
 from tempfile import TemporaryFile
 from tkinter import N
-import docker
+from django.db.models import (
+    Count,
+    Max,
+)
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import (
+    http_date,
+    quote_etag,
+)
+from rest_framework.exceptions import ValidationError
+
+from swarman import (
+    clients,
+    snapshots,
+)
+
+
+def parse_node_listing(node_list):
+    """
+    Returns the fields shown when adding an existing swarm for every node in
+    a manager's node listing
+    """
+    nodes = []
+    for node in snapshots.nodes(node_list):
+        nodes.append({
+            'hostname': node.hostname,
+            'docker_version_index': node.version_index,
+            'node_architecture': node.architecture,
+            'role': node.role.capitalize(),
+            'node_id': node.id,
+            'ip_address': node.address,
+        })
+
+    return nodes
 
 
 def get_existing_node_info(swarm_ip):
 
     try:
-        client = docker.DockerClient(base_url=f'tcp://{swarm_ip}')
+        client = clients.get_client(f'tcp://{swarm_ip}')
+
+        return {'nodes': parse_node_listing(client.api.nodes())}
+    except:
+        return {'error': f'Error connecting to {swarm_ip}'}
+
+
+def get_existing_swarm_info(swarm_ip):
+    """
+    Fetches the node listing and join tokens of a swarm from one manager,
+    both over the same pooled connection. Returns a dictionary with the raw
+    node listing and the join tokens, or with an error.
+    """
+    try:
+        client = clients.get_client(f'tcp://{swarm_ip}')
 
-        parsed_nodes_json = {
-            'nodes': [],
+        return {
+            'nodes': client.api.nodes(),
+            'tokens': client.api.inspect_swarm()['JoinTokens'],
         }
-        for node in client.nodes.list():
-            node_data = {
-                'hostname': node.attrs['Description']['Hostname'],
-                'docker_version_index': node.attrs['Version']['Index'],
-                'node_architecture': node.attrs['Description']['Platform']['Architecture'],
-                'role': node.attrs['Spec']['Role'].capitalize(),
-                'node_id': node.attrs['ID']
-            }
-            if node.attrs['Status']['Addr'] == '0.0.0.0':
-                node_data['ip_address'] = node.attrs['ManagerStatus']['Addr'].split(':')[
-                    0]
-            else:
-                node_data['ip_address'] = node.attrs['Status']['Addr']
-            parsed_nodes_json['nodes'].append(node_data)
-
-        client.close()
-
-        return parsed_nodes_json
     except:
         return {'error': f'Error connecting to {swarm_ip}'}
 
 
-def get_swarm_tokens(swarm_ip):
+def parse_query_datetime(value, default):
+    """
+    Parses an ISO 8601 datetime from a URL parameter. Naive datetimes are
+    treated as UTC. Returns default when value is empty and raises ValueError
+    when it cannot be parsed.
+    """
+    if not value:
+        return default
+
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'Invalid datetime: {value}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.utc)
+
+    return parsed
+
+
+def requested_fields(request, serializer_class):
+    """
+    Returns the fields listed in the fields= query parameter (ex:
+    fields=id,hostname), or None when it is not given. Raises a
+    ValidationError for fields the serializer does not have.
+    """
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = set(fields) - set(serializer_class().fields)
+    if unknown:
+        raise ValidationError(
+            {'fields': f'Unknown fields: {", ".join(sorted(unknown))}'})
+
+    return fields
+
+
+def only_fields(queryset, fields, required=()):
+    """
+    Narrows a queryset to the model fields in fields plus required, so rows
+    are read with only the columns a projection needs. The primary key is
+    always read. Returns the queryset unchanged when fields is None.
+    """
+    if fields is None:
+        return queryset
+
+    concrete = {field.name for field in queryset.model._meta.concrete_fields}
+    return queryset.only(*[field for field in {'id', *fields, *required}
+                           if field in concrete])
+
+
+class RowVersion:
+    """
+    ETag and Last-Modified of a response built from the rows of a queryset,
+    derived from their count and latest updated_at with one query. The ETag
+    also covers the request's path, query string and Accept header, so every
+    page and projection has its own.
+
+    Usage:
+        version = RowVersion(request, queryset)
+        not_modified = version.conditional_response()
+        if not_modified is not None:
+            return not_modified
+        return version.apply(Response(data))
+    """
+
+    def __init__(self, request, queryset, last_modified=True):
+        self.request = request
+        versions = queryset.order_by().aggregate(
+            count=Count('id'), latest=Max('updated_at'))
+        latest = versions['latest']
+
+        key = '|'.join([
+            str(versions['count']),
+            latest.isoformat() if latest else '',
+            request.get_full_path(),
+            request.META.get('HTTP_ACCEPT', ''),
+        ])
+        self.etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        # A deleted row does not move the latest updated_at, so only
+        # responses for a single row get a Last-Modified
+        self.last_modified = timegm(latest.utctimetuple()) \
+            if last_modified and latest else None
 
-    client = docker.DockerClient(base_url=f'tcp://{swarm_ip}')
-    join_tokens = client.swarm.attrs['JoinTokens']
-    client.close()
+    def conditional_response(self):
+        """
+        Returns a 304 Not Modified (or 412) response when the request's
+        conditional headers match, otherwise None
+        """
+        response = get_conditional_response(
+            self.request, etag=self.etag, last_modified=self.last_modified)
+        if response is not None:
+            self.apply(response)
+        return response
 
-    return join_tokens
+    def apply(self, response):
+        """Adds the ETag and Last-Modified headers to a response"""
+        response['ETag'] = self.etag
+        if self.last_modified is not None:
+            response['Last-Modified'] = http_date(self.last_modified)
+        return response
@@ -11,27 +11,74 @@ from rest_framework.response import Response
 from rest_framework.parsers import JSONParser
 
 import json
-import docker
+from datetime import timedelta
 
+from django.utils import timezone
+
+from swarman import (
+    clients,
+    deadlines,
+    health,
+    history,
+    profiling,
+)
+from swarman.snapshots import NodeSnapshot
 from swarman.models import (
     Swarm,
     Node,
+    NodeConflict,
     Service,
 )
 from .serializers import (
     SwarmSerializer,
     NodeSerializer,
+    NodeStateSerializer,
     NodeUpdateSerializer,
 )
 from . import api_utils
+from .pagination import RowCursorPagination
 
 
 class SwarmViewSet(viewsets.ModelViewSet):
     """
     List all Swarms, create a new Swarm Entry, or view Swarm Details
+    Lists are cursor paginated when cursor or page_size is given. Optional
+    URL parameter: fields=id,swarm_name
+    to return only those fields. Responses carry an ETag (and, for a single
+    Swarm, a Last-Modified) so unchanged polls get 304 Not Modified.
     """
     queryset = Swarm.objects.all()
     serializer_class = SwarmSerializer
+    pagination_class = RowCursorPagination
+
+    def get_queryset(self):
+        return api_utils.only_fields(
+            super().get_queryset(),
+            api_utils.requested_fields(self.request, self.serializer_class))
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == 'GET':
+            kwargs.setdefault('fields', api_utils.requested_fields(
+                self.request, self.serializer_class))
+        return super().get_serializer(*args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        version = api_utils.RowVersion(request, self.get_queryset(),
+                                       last_modified=False)
+        not_modified = version.conditional_response()
+        if not_modified is not None:
+            return not_modified
+        return version.apply(super().list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        # Only an existing Swarm has a version, others get a 404
+        instance = self.get_object()
+        version = api_utils.RowVersion(
+            request, self.get_queryset().filter(pk=instance.pk))
+        not_modified = version.conditional_response()
+        if not_modified is not None:
+            return not_modified
+        return version.apply(Response(self.get_serializer(instance).data))
 
     def perform_create(self, serializer):
         serializer.save()
@@ -39,16 +86,48 @@ class SwarmViewSet(viewsets.ModelViewSet):
 
 class NodeList(APIView):
     """
-    List all Nodes belonging to a swarm
+    List all Nodes belonging to a swarm, cursor paginated when cursor or
+    page_size is given
+    Optional URL parameters: state=true to include the status and availability
+    of each node, fetched from the swarm in a single node listing, and
+    fields=id,hostname to return only those fields. Without state=true
+    responses carry an ETag so unchanged polls get 304 Not Modified.
     """
 
     def get(self, request, swarm_id, format=None):
 
-        swarm = Swarm.objects.filter(id=swarm_id).first()
-        nodes = swarm.nodes.all()
-
-        serializer = NodeSerializer(nodes, many=True)
-        return Response(serializer.data)
+        swarm = get_object_or_404(Swarm, id=swarm_id)
+        with_state = request.query_params.get('state', '').lower() == 'true'
+        serializer_class = NodeStateSerializer if with_state \
+            else NodeSerializer
+        fields = api_utils.requested_fields(request, serializer_class)
+        # nodes_with_state matches nodes to the listing by id and hostname
+        nodes = api_utils.only_fields(
+            swarm.nodes.all(), fields,
+            required=('node_id', 'hostname') if with_state else ())
+
+        # Live state is not versioned by the rows
+        version = None
+        if not with_state:
+            version = api_utils.RowVersion(request, nodes,
+                                           last_modified=False)
+            not_modified = version.conditional_response()
+            if not_modified is not None:
+                return not_modified
+
+        paginator = RowCursorPagination()
+        page = paginator.paginate_queryset(nodes, request, view=self)
+        rows = nodes if page is None else page
+        if with_state:
+            rows = swarm.nodes_with_state(rows)
+        serializer = serializer_class(rows, many=True, fields=fields)
+        if page is None:
+            response = Response(serializer.data)
+        else:
+            response = paginator.get_paginated_response(serializer.data)
+        if version is not None:
+            version.apply(response)
+        return response
 
 
 @api_view(['POST'])
@@ -95,29 +174,21 @@ def add_existing_swarm_nodes(request):
                     url = request.data['swarm_address'].split('//')[-1]
                     url = url.split('/')[0]
 
-                    # Attempt fetch node info from swarm_address
-
-                    node_data = api_utils.get_existing_node_info(url)
-                    if 'error' in node_data.keys():
-                        return Response(json.dumps(node_data), status=status.HTTP_400_BAD_REQUEST)
-
-                    # Add Nodes to Swarm
-                    swarm = Swarm.objects.filter(
-                        id=request.data['swarm_id']).first()
-                    tokens = api_utils.get_swarm_tokens(url)
-                    swarm.manager_join_token = tokens['Manager']
-                    swarm.worker_join_token = tokens['Worker']
-                    swarm.save()
-
-                    for node in node_data['nodes']:
-                        Node.objects.create(hostname=node['hostname'],
-                                            ip_address=node['ip_address'],
-                                            api_port=2375,
-                                            role=node['role'],
-                                            swarm=swarm,
-                                            docker_version_index=node['docker_version_index'],
-                                            node_architecture=node['node_architecture'],
-                                            node_id=node['node_id'])
+                    # Attempt fetch node list and join tokens from
+                    # swarm_address
+                    swarm_info = api_utils.get_existing_swarm_info(url)
+                    if 'error' in swarm_info.keys():
+                        return Response(json.dumps(swarm_info), status=status.HTTP_400_BAD_REQUEST)
+
+                    # Add Nodes to Swarm, updating nodes already tracked
+                    swarm = get_object_or_404(Swarm,
+                                              id=request.data['swarm_id'])
+                    try:
+                        swarm.import_nodes(swarm_info['nodes'],
+                                           swarm_info['tokens'])
+                    except NodeConflict as err:
+                        return Response({'error': str(err)},
+                                        status=status.HTTP_409_CONFLICT)
 
                     return Response({'success': 'All Nodes Added Successfully'}, status=status.HTTP_201_CREATED)
 
@@ -173,12 +244,73 @@ def node_utilization(request, node_id):
     """
     Polls a Node and gets the resource utilization of each container running 
     on the node. Returns a Dictionary with Container Name, CPU Utilization, and 
-    Memory Utilization
+    Memory Utilization. Uses the latest samples from the collect_stats
+    background collector when it is running.
     """
 
     node = get_object_or_404(Node, id=node_id)
 
-    return Response(node.utilization_per_container(), status=status.HTTP_200_OK)
+    utilization = node.latest_utilization()
+    if utilization is None:
+        utilization = node.utilization_per_container()
+
+    return Response(utilization, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def node_history(request, node_id):
+    """
+    Returns the recorded utilization history of a Node, averaged on the
+    server into at most the requested number of points.
+    Optional URL parameters:
+        start: ISO 8601 datetime (default: 1 hour before end)
+        end: ISO 8601 datetime (default: now)
+        points: number of points to return (default: 200, max: 2000)
+    """
+    node = get_object_or_404(Node, id=node_id)
+
+    try:
+        end = api_utils.parse_query_datetime(request.query_params.get('end'),
+                                             timezone.now())
+        start = api_utils.parse_query_datetime(
+            request.query_params.get('start'), end - timedelta(hours=1))
+        points = int(request.query_params.get('points', 200))
+    except ValueError:
+        return Response({"Error": "Invalid start, end or points parameter"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    if start >= end or not 0 < points <= 2000:
+        return Response({"Error": "start must be before end and points "
+                                  "between 1 and 2000"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(history.query(node, start, end, points),
+                    status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def swarm_utilization(request, swarm_id):
+    """
+    Polls every Node in a Swarm at the same time and gets the resource
+    utilization of each container running on them. Nodes that do not respond
+    before the deadline are returned with a status of 'timeout', nodes that
+    cannot be reached with a status of 'unreachable'.
+    Optional URL parameter: deadline (seconds)
+    """
+    swarm = get_object_or_404(Swarm, id=swarm_id)
+
+    deadline = request.query_params.get('deadline', None)
+    if deadline is not None:
+        try:
+            deadline = float(deadline)
+        except ValueError:
+            deadline = 0
+
+        if deadline <= 0:
+            return Response({"Error": "deadline must be a number of seconds"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(swarm.utilization(deadline), status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
@@ -200,8 +332,7 @@ def update_node_availability(request, node_id):
 
                 try:
                     for address in node.swarm.manager_ip_list():
-                        client = docker.DockerClient(
-                            base_url=f"tcp://{address}")
+                        client = clients.get_client(f"tcp://{address}")
                         update_package = {
                             'Availability': request.data['Availability'],
                             'Role': node.role
@@ -237,27 +368,11 @@ def sync_node_data(request, node_id):
     node = get_object_or_404(Node, id=node_id)
     try:
         for address in node.swarm.manager_ip_list():
-            client = docker.DockerClient(
-                base_url=f"tcp://{address}")
-            node_data = client.nodes.get(node.hostname).attrs
-
-            # role
-            node.role = node_data['Spec']['Role'].title()
-            # node_architecture
-            node.node_architecture = node_data['Description']['Platform']['Architecture']
-            # node_id
-            node.node_id = node_data['ID']
-            # total_memory
-            node.total_memory = node_data['Description']['Resources']['MemoryBytes']/(
-                10**9)
-            # cpu_count
-            node.cpu_count = node_data['Description']['Resources']['NanoCPUs']/(
-                10**9)
-            # os
-            node.os = node_data['Description']['Platform']['OS']
-            # docker_engine
-            node.docker_engine = node_data['Description']['Engine']['EngineVersion']
+            client = clients.get_client(f"tcp://{address}")
+            node_data = NodeSnapshot.from_api(
+                client.nodes.get(node.hostname).attrs)
 
+            node.apply_node_data(node_data)
             node.save()
 
             return Response({'Success': 'Node entry synced'},
@@ -268,6 +383,26 @@ def sync_node_data(request, node_id):
                         status=status.HTTP_504_GATEWAY_TIMEOUT)
 
 
+@api_view(['GET'])
+def sync_swarm_nodes(request, swarm_id):
+    """
+    Syncs every Node entry of a swarm from a single node listing pulled from
+    one of its managers. Nodes that joined the swarm are added and nodes
+    that left are removed. Returns the created, updated (with the fields
+    that changed) and removed nodes.
+    """
+    swarm = get_object_or_404(Swarm, id=swarm_id)
+    try:
+        report = swarm.sync_nodes()
+    except NodeConflict as err:
+        return Response({"Error": str(err)}, status=status.HTTP_409_CONFLICT)
+    if report == "Error":
+        return Response({"Error": "Error connecting to swarm managers"},
+                        status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+    return Response(report, status=status.HTTP_200_OK)
+
+
 @api_view(['POST'])
 def service_scale(request):
     """
@@ -285,15 +420,58 @@ def service_scale(request):
 
         for address in swarm.manager_ip_list():
             try:
-                client = docker.DockerClient(base_url=f'tcp://{address}')
+                client = clients.get_client(f'tcp://{address}')
                 service = client.services.get(request.data['service_id'])
                 
                 if service.scale(int(request.data['replicas'])):
-                    client.close()
                     return Response({"Success": f"Scaled service to {request.data['replicas']}"},
                                     status=status.HTTP_200_OK)
             except:
-                client.close()
+                pass
 
         return Response({'Error': 'Error Connecting to Swarm'},
                         status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+
+@api_view(['GET'])
+def docker_pool_stats(request):
+    """
+    Returns usage statistics for the shared Docker client registry. Each
+    endpoint lists the number of HTTP connections opened and requests sent,
+    more requests than connections means connections are being reused.
+    """
+    return Response(clients.pool_stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def docker_endpoint_health(request):
+    """
+    Returns the health of every Docker endpoint requests were made to: circuit
+    state (closed, open or half-open), average latency in seconds and request
+    success and failure counts. Swarm managers are tried in this order.
+    """
+    return Response(health.endpoint_stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def docker_deadline_stats(request):
+    """
+    Returns, per endpoint, the number of requests served under a Docker call
+    deadline, how many ran out of time and how many Docker calls were skipped
+    because of it
+    """
+    return Response(deadlines.stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def docker_profile(request):
+    """
+    Summarises the Docker calls and queries of recent requests, per URL name
+    and per Docker endpoint, when SWARMAN_PROFILING is enabled
+    """
+    if not profiling.enabled():
+        return Response({"Error": "Profiling is disabled, set "
+                                  "SWARMAN_PROFILING to enable it"},
+                        status=status.HTTP_404_NOT_FOUND)
+
+    return Response(profiling.summary(), status=status.HTTP_200_OK)
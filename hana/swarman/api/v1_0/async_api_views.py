@@ -0,0 +1,139 @@
+"""
+Async versions of the Docker heavy API endpoints in api_views.py and of the
+utilization streams in stream_views.py, used when SWARMAN_ASYNC_VIEWS is
+enabled under ASGI. Django REST framework views are synchronous, so these
+return plain JsonResponses in the same format.
+"""
+from asgiref.sync import sync_to_async
+from django.http import (
+    HttpResponseNotAllowed,
+    JsonResponse,
+)
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+
+from swarman import (
+    aio_docker,
+    clients,
+    stats_store,
+    streams,
+    utilization,
+    utils,
+)
+from swarman.asgi import AsyncStreamingResponse
+from swarman.async_views import gather_limited
+from swarman.models import (
+    Node,
+    Swarm,
+)
+from swarman.snapshots import NodeSnapshot
+from .stream_views import (
+    node_stream_sample,
+    set_event_stream_headers,
+)
+
+
+async def _container_stats(client, container, timeout, previous=None):
+    '''
+    Async version of utils._container_stats, with the same request and
+    result handling. Returns a Tuple: (stats, error)
+    '''
+    path, params = utils.stats_request(container['Id'], previous)
+    try:
+        with clients.request_timeout(timeout):
+            stats = await client.get_json(path, params=params)
+    except Exception as err:
+        return None, f'{type(err).__name__}: {err}'
+
+    return utils.stats_result(stats, previous), None
+
+
+async def node_utilization(request, node_id):
+    """
+    Polls a Node and gets the resource utilization of each container running
+    on the node. Returns a Dictionary with Container Name, CPU Utilization, and
+    Memory Utilization. Uses the latest samples from the collect_stats
+    background collector when it is running.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    node = await sync_to_async(get_object_or_404)(Node, id=node_id)
+
+    samples = await sync_to_async(node.latest_utilization)()
+    if samples is None:
+        client = aio_docker.get_client(
+            f'tcp://{node.ip_address}:{node.api_port}')
+        timeout = utils.stats_timeout()
+        with clients.request_timeout(timeout):
+            container_list = await client.get_json('/containers/json')
+        container_ids = [container['Id'] for container in container_list]
+        previous = {}
+        if utils.stats_one_shot():
+            previous = await sync_to_async(stats_store.previous_cpu_stats)(
+                container_ids)
+        stats_list = await gather_limited(
+            _container_stats(client, container, timeout,
+                             previous.get(container['Id']))
+            for container in container_list)
+        if utils.stats_one_shot():
+            await sync_to_async(utils.save_previous_stats)(
+                container_ids, stats_list, node.id)
+        samples = utilization.rounded(utils.container_samples(
+            [utils.container_name(container) for container in container_list],
+            stats_list))
+
+    return JsonResponse(samples, safe=False, status=status.HTTP_200_OK)
+
+
+async def sync_node_data(request, node_id):
+    """
+    Syncs the Node entry in the database to the information pulled from the
+    docker API
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    node = await sync_to_async(get_object_or_404)(
+        Node.objects.select_related('swarm'), id=node_id)
+    try:
+        addresses = await sync_to_async(node.swarm.manager_ip_list)()
+        node_data = await aio_docker.first_manager(
+            addresses, 'GET', f'/nodes/{node.hostname}')
+
+        node.apply_node_data(NodeSnapshot.from_api(node_data))
+        await sync_to_async(node.save)()
+
+        return JsonResponse({'Success': 'Node entry synced'},
+                            status=status.HTTP_200_OK)
+
+    except Exception:
+        return JsonResponse({"Error": "Error connecting to node"},
+                            status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+
+def _event_stream_response(key, sample):
+    response = AsyncStreamingResponse(streams.async_event_stream(key, sample),
+                                      content_type='text/event-stream')
+    set_event_stream_headers(response)
+    return response
+
+
+async def node_utilization_stream(request, node_id):
+    """
+    Streams the per container utilization of a Node as 'utilization' events,
+    without holding a thread per client. Needs hana.asgi:application.
+    """
+    node = await sync_to_async(get_object_or_404)(Node, id=node_id)
+
+    return _event_stream_response(f'node-{node.id}', node_stream_sample(node))
+
+
+async def swarm_utilization_stream(request, swarm_id):
+    """
+    Streams the utilization of every Node in a Swarm as 'utilization' events,
+    without holding a thread per client. Needs hana.asgi:application.
+    """
+    swarm = await sync_to_async(get_object_or_404)(Swarm, id=swarm_id)
+
+    return _event_stream_response(f'swarm-{swarm.id}', swarm.utilization)
@@ -0,0 +1,24 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class RowCursorPagination(CursorPagination):
+    '''
+    Opt-in cursor pagination in primary key order: lists stay bare arrays
+    unless ?cursor= or ?page_size= is given. Cursors stay valid while rows
+    are added or removed, so polling clients neither skip nor repeat rows.
+    The page size defaults to SWARMAN_API_PAGE_SIZE and can be lowered with
+    ?page_size=.
+    '''
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'SWARMAN_API_PAGE_SIZE', 100)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and \
+                self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
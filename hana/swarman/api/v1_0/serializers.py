@@ -6,14 +6,30 @@ from swarman.models import (
 )
 
 
-class SwarmSerializer(serializers.ModelSerializer):
+class FieldSelectionMixin:
+    '''
+    Serializes only the fields passed in the fields keyword argument (all of
+    them when it is None), for the fields= parameter of list endpoints
+    '''
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class SwarmSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     '''
     Serializer for handling Swarm Actions
     '''
 
     class Meta:
         model = Swarm
-        fields = '__all__'
+        # services_synced_at is sync bookkeeping written with update(),
+        # which does not move the row version (updated_at), so it is left
+        # out rather than served stale after a 304
+        exclude = ('services_synced_at',)
 
         read_only_fields = (
             'manager_join_token',
@@ -21,7 +37,7 @@ class SwarmSerializer(serializers.ModelSerializer):
         )
 
 
-class NodeSerializer(serializers.ModelSerializer):
+class NodeSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     '''
     Serializer for handling Node Actions
     '''
@@ -30,6 +46,16 @@ class NodeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class NodeStateSerializer(NodeSerializer):
+    '''
+    Serializer for Nodes that includes the live status and availability
+    reported by the swarm
+    '''
+    status = serializers.CharField(source='get_status', read_only=True)
+    availability = serializers.CharField(source='get_availability',
+                                         read_only=True)
+
+
 class NodeUpdateSerializer(serializers.Serializer):
     """
     Serializer for sending Updates to a Node in a swarm
@@ -0,0 +1,92 @@
+"""
+Server-Sent Event streams of live utilization (see swarman/streams.py).
+
+These are plain Django views: the browser's EventSource asks for
+text/event-stream, which Django REST framework's content negotiation would
+refuse. The streams here are iterated synchronously and hold a worker thread
+while open, so serve them from a threaded WSGI server; at most
+SWARMAN_STREAM_MAX_CLIENTS are open at once and further clients get a 503
+(the node detail page then polls). Under ASGI (SWARMAN_ASYNC_VIEWS) the async
+versions in async_api_views.py are used instead.
+"""
+from django.http import (
+    HttpResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404
+
+from swarman import streams
+from swarman.models import (
+    Node,
+    Swarm,
+)
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    '''
+    A Server-Sent Event stream. on_close is called once when the server
+    closes the response, even if the stream was never iterated.
+    '''
+
+    def __init__(self, events, on_close=None):
+        super().__init__(events, content_type='text/event-stream')
+        set_event_stream_headers(self)
+        self._on_close = on_close
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+def set_event_stream_headers(response):
+    '''Sets the caching headers of a Server-Sent Event stream'''
+    response['Cache-Control'] = 'no-cache'
+    # Keeps nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+
+
+def node_stream_sample(node):
+    '''Returns the function a node stream's broadcaster samples with'''
+    def sample():
+        utilization = node.latest_utilization()
+        if utilization is None:
+            utilization = node.utilization_per_container()
+        return utilization
+
+    return sample
+
+
+def _event_stream_response(key, sample):
+    if not streams.stream_slots.acquire():
+        response = HttpResponse('Too many open streams, poll instead',
+                                status=503, content_type='text/plain')
+        response['Retry-After'] = str(streams.stream_max_age())
+        return response
+
+    return EventStreamResponse(streams.event_stream(key, sample),
+                               on_close=streams.stream_slots.release)
+
+
+def node_utilization_stream(request, node_id):
+    """
+    Streams the per container utilization of a Node, in the format of the
+    node utilization endpoint, as 'utilization' events. The node is sampled
+    once per interval however many clients are subscribed.
+    """
+    node = get_object_or_404(Node, id=node_id)
+
+    return _event_stream_response(f'node-{node.id}', node_stream_sample(node))
+
+
+def swarm_utilization_stream(request, swarm_id):
+    """
+    Streams the utilization of every Node in a Swarm, in the format of the
+    swarm utilization endpoint, as 'utilization' events
+    """
+    swarm = get_object_or_404(Swarm, id=swarm_id)
+
+    return _event_stream_response(f'swarm-{swarm.id}', swarm.utilization)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from .api_views import (
@@ -10,10 +11,30 @@ from .api_views import (
     promote_node,
     demote_node,
     node_utilization,
+    node_history,
+    swarm_utilization,
     sync_node_data,
+    sync_swarm_nodes,
     service_scale,
+    docker_pool_stats,
+    docker_endpoint_health,
+    docker_deadline_stats,
+    docker_profile,
 )
 
+from .stream_views import (
+    node_utilization_stream,
+    swarm_utilization_stream,
+)
+
+if getattr(settings, 'SWARMAN_ASYNC_VIEWS', False):
+    from .async_api_views import (
+        node_utilization,
+        node_utilization_stream,
+        swarm_utilization_stream,
+        sync_node_data,
+    )
+
 
 swarm_list = SwarmViewSet.as_view({
     'get': 'list',
@@ -30,6 +51,12 @@ urlpatterns = [
     path('swarms/<int:pk>', swarm_detail, name='api-swarm-detail'),
     path('swarms/<int:swarm_id>/nodes', NodeList.as_view(),
          name='api-node-list'),
+    path('swarms/<int:swarm_id>/utilization', swarm_utilization,
+         name='api-swarm-utilization'),
+    path('swarms/<int:swarm_id>/utilization/stream', swarm_utilization_stream,
+         name='api-swarm-utilization-stream'),
+    path('swarms/<int:swarm_id>/sync', sync_swarm_nodes,
+         name='api-sync-swarm'),
     path('swarms/existing_swarm_nodes', get_existing_swarm_nodes,
          name="api-existing-swarm-nodes"),
     path('swarms/add_existing_swarm_nodes',
@@ -40,9 +67,19 @@ urlpatterns = [
     path('nodes/<int:node_id>/demote', demote_node, name='api-node-demote'),
     path('nodes/<int:node_id>/utilization',
          node_utilization, name='api-node-utilization'),
+    path('nodes/<int:node_id>/utilization/stream', node_utilization_stream,
+         name='api-node-utilization-stream'),
+    path('nodes/<int:node_id>/history', node_history,
+         name='api-node-history'),
     path('nodes/<int:node_id>/update', update_node_availability,
          name='api-update-node'),
     path('nodes/<int:node_id>/sync', sync_node_data, name='api-sync-node'),
 
     path('service/scale', service_scale, name='api-service-scale'),
+
+    path('docker/pool', docker_pool_stats, name='api-docker-pool'),
+    path('docker/health', docker_endpoint_health, name='api-docker-health'),
+    path('docker/deadlines', docker_deadline_stats,
+         name='api-docker-deadlines'),
+    path('docker/profile', docker_profile, name='api-docker-profile'),
 ]
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SwarmanConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'swarman'
+
+    def ready(self):
+        # Connects the cache invalidation receivers
+        from . import signals  # noqa: F401
@@ -0,0 +1,112 @@
+"""
+ASGI handler that can stream from async iterators.
+
+Django 4.0's ASGIHandler sends a StreamingHttpResponse by iterating it
+synchronously on the event loop, so a Server-Sent Event stream waiting for
+its next frame would stall every other request. Views return an
+AsyncStreamingResponse instead, which StreamingASGIHandler sends from its
+async iterator, stopping as soon as the client disconnects. Every other
+response is sent by Django as usual.
+
+Used by hana/asgi.py:
+    application = StreamingASGIHandler()
+"""
+import asyncio
+import contextvars
+from contextlib import suppress
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+
+
+_receive = contextvars.ContextVar('swarman_asgi_receive', default=None)
+
+
+class AsyncStreamingResponse(StreamingHttpResponse):
+    '''
+    A streaming response whose content comes from an async iterator of str
+    or bytes. Only StreamingASGIHandler can send it, iterating it
+    synchronously yields nothing.
+    '''
+
+    def __init__(self, async_content, *args, **kwargs):
+        super().__init__((), *args, **kwargs)
+        self.async_streaming_content = async_content
+
+
+class StreamingASGIHandler(ASGIHandler):
+    '''ASGIHandler that sends AsyncStreamingResponses from their iterator'''
+
+    async def handle(self, scope, receive, send):
+        # Every request is handled in its own task (and context), the
+        # response is sent with the same receive channel
+        _receive.set(receive)
+        await super().handle(scope, receive, send)
+
+    async def send_response(self, response, send):
+        if not isinstance(response, AsyncStreamingResponse):
+            await super().send_response(response, send)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self._headers(response),
+        })
+
+        disconnected = asyncio.ensure_future(
+            self._disconnected(_receive.get()))
+        iterator = response.async_streaming_content.__aiter__()
+        try:
+            while True:
+                part = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait({part, disconnected},
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not part.done():
+                    # The client went away while waiting for the next part
+                    part.cancel()
+                    with suppress(asyncio.CancelledError,
+                                  StopAsyncIteration):
+                        await part
+                    break
+                try:
+                    chunk = part.result()
+                except StopAsyncIteration:
+                    break
+                await send({
+                    'type': 'http.response.body',
+                    'body': response.make_bytes(chunk),
+                    'more_body': True,
+                })
+        finally:
+            disconnected.cancel()
+            if hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    @staticmethod
+    async def _disconnected(receive):
+        '''Returns once the client has disconnected'''
+        if receive is None:
+            await asyncio.Event().wait()
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    def _headers(response):
+        '''Encodes the headers and cookies of a response, as Django does'''
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie',
+                            cookie.output(header='').encode('ascii').strip()))
+
+        return headers
@@ -0,0 +1,197 @@
+"""
+Async versions of the Docker heavy page views in views.py.
+
+These are used in place of the synchronous views when SWARMAN_ASYNC_VIEWS is
+enabled and the site is served by an ASGI server (see hana/asgi.py). Docker
+calls go through aio_docker, so a slow node only holds a coroutine rather than
+a worker thread and independent calls are made at the same time.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import (
+    render,
+    get_object_or_404,
+)
+
+from . import (
+    aio_docker,
+    deadlines,
+    snapshots,
+    swarm_cache,
+    utils,
+)
+from .models import (
+    Swarm,
+    Node,
+    index_node_states,
+)
+from .snapshots import (
+    NodeSnapshot,
+    ServiceSnapshot,
+)
+from .views import service_detail_context
+
+
+async def gather_limited(coroutines, limit=None):
+    '''
+    Runs coroutines at most limit at a time and returns their results in
+    order. Exceptions are returned in place of results.
+    '''
+    if limit is None:
+        limit = utils.stats_max_workers()
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines),
+                                return_exceptions=True)
+
+
+async def cached_listing(swarm_id, kind, addresses, path, build,
+                         params=None):
+    '''
+    Returns a swarm listing from swarm_cache, or fetches it from the first
+    manager that answers and caches it. build turns the listing into
+    snapshots (ex: snapshots.nodes).
+    '''
+    listing = await sync_to_async(swarm_cache.get)(swarm_id, kind)
+    if listing is not None:
+        return build(listing)
+    generation = await sync_to_async(swarm_cache.generation)(swarm_id, kind)
+
+    listing = build(await aio_docker.first_manager(addresses, 'GET', path,
+                                                   params=params))
+    await sync_to_async(swarm_cache.save)(swarm_id, kind, listing, generation)
+
+    return listing
+
+
+async def node_info(node, addresses):
+    '''
+    Async version of Node.get_node_info: reads the node from the swarm's
+    cached node listing, or inspects it on the first manager that answers.
+    Returns a NodeSnapshot, or 'Unknown' / 'Error' like get_node_info.
+    '''
+    node_list = await sync_to_async(swarm_cache.get)(node.swarm_id,
+                                                     swarm_cache.NODES)
+    if node_list is not None:
+        states = index_node_states(node_list)
+        node_data = states.get(node.node_id) or states.get(node.hostname)
+        if node_data is not None:
+            return node_data
+
+    try:
+        return NodeSnapshot.from_api(await aio_docker.first_manager(
+            addresses, 'GET', f'/nodes/{node.hostname}'))
+    except Exception:
+        return 'Unknown' if deadlines.exceeded() else 'Error'
+
+
+async def swarm_dashboard(request, swarm_id):
+    """
+    Display information about a swarm. Includes node and service status
+    """
+    swarm = await sync_to_async(get_object_or_404)(
+        Swarm.objects.with_counts(), id=swarm_id)
+    addresses = await sync_to_async(swarm.manager_ip_list)()
+    nodes = await sync_to_async(list)(swarm.nodes.order_by('hostname'))
+
+    # The service and node listings are independent, so both managers calls
+    # are in flight at the same time. Listings kept fresh by the event
+    # listener are used as they are and the service listing is only needed
+    # when the Service table is stale.
+    listings = [cached_listing(swarm.id, swarm_cache.NODES, addresses,
+                               '/nodes', snapshots.nodes)]
+    if swarm.services_stale:
+        listings.append(cached_listing(swarm.id, swarm_cache.SERVICES,
+                                       addresses, '/services',
+                                       snapshots.services,
+                                       params={'status': 'true'}))
+    node_list, *service_list = await asyncio.gather(*listings,
+                                                    return_exceptions=True)
+
+    if isinstance(node_list, Exception):
+        states = "Unknown" if deadlines.exceeded() else "Error"
+    else:
+        states = index_node_states(node_list)
+    nodes = swarm.nodes_with_state(nodes, states)
+
+    if service_list and not isinstance(service_list[0], Exception):
+        await sync_to_async(swarm.sync_services)(service_list[0])
+    services = await sync_to_async(swarm.service_summaries)(sync=False)
+    if services == "Error":
+        services = ['ERROR']
+
+    context = {
+        "swarm": swarm,
+        "nodes": nodes,
+        "services": services,
+    }
+    return await sync_to_async(render)(
+        request, 'swarman/swarm_dashboard.html', context)
+
+
+async def node_detail(request, node_id):
+    """
+    Displays Node Specific Details
+    """
+    node = await sync_to_async(get_object_or_404)(
+        Node.objects.select_related('swarm'), id=node_id)
+    addresses = []
+    if node.swarm is not None:
+        addresses = await sync_to_async(node.swarm.manager_ip_list)()
+    client = aio_docker.get_client(f'tcp://{node.ip_address}:{node.api_port}')
+
+    # Get Container List. The summary listing has everything the page shows,
+    # so containers are not inspected one by one. The node's status is
+    # fetched alongside it, so rendering does not make a blocking call.
+    containers, node_data = await asyncio.gather(
+        client.get_json('/containers/json'), node_info(node, addresses),
+        return_exceptions=True)
+    node.set_node_info(node_data)
+
+    if isinstance(containers, Exception):
+        containers = [{"error": "Error retrieving containers"}]
+    else:
+        containers = snapshots.containers(containers)
+
+    context = {
+        'node': node,
+        'containers': containers,
+        'utilization_stream': True,
+    }
+
+    return await sync_to_async(render)(
+        request, 'swarman/node_detail.html', context)
+
+
+async def service_detail(request, swarm_id):
+
+    if request.method == "GET":
+
+        service_id = request.GET.get('service', None)
+        context = {
+            'swarm_id': swarm_id,
+        }
+        swarm = await sync_to_async(get_object_or_404)(Swarm, id=swarm_id)
+        if service_id:
+            addresses = await sync_to_async(swarm.manager_ip_list)()
+            filters = json.dumps({'service': [service_id],
+                                  'desired-state': ['running']})
+            service, tasks = await asyncio.gather(
+                aio_docker.first_manager(addresses, 'GET',
+                                         f'/services/{service_id}'),
+                aio_docker.first_manager(addresses, 'GET', '/tasks',
+                                         params={'filters': filters}))
+            context.update(service_detail_context(
+                ServiceSnapshot.from_api(service), snapshots.tasks(tasks)))
+
+        else:
+            context['error'] = 'Service ID is a required URL parameter'
+
+        return await sync_to_async(render)(
+            request, 'swarman/service_detail.html', context)
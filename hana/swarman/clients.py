@@ -0,0 +1,380 @@
+"""
+Process wide registry of reusable Docker clients.
+
+Building a DockerClient opens a new HTTP session and negotiates the API
+version with the daemon. The registry keeps one client per endpoint so that
+version negotiation happens once and the keep-alive connections in the
+client's pool are reused between requests.
+
+Usage:
+    from swarman import clients
+
+    client = clients.get_client(f'tcp://{address}')
+    client.nodes.list()
+
+Clients returned by the registry are shared and must not be closed by the
+caller. The registry never closes a client it has handed out either: another
+thread may be in the middle of a request on it. Evicted clients are only
+forgotten, their connections are closed once the last caller lets go of them
+and they are garbage collected.
+"""
+import contextvars
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import docker
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import (
+    deadlines,
+    health,
+    metrics,
+    profiling,
+)
+
+
+_request_timeout = contextvars.ContextVar('swarman_request_timeout',
+                                          default=None)
+
+
+@contextmanager
+def request_timeout(seconds):
+    '''
+    Overrides the timeout of every Docker call made by pooled clients in the
+    current thread (or task) for the duration of the with block
+    '''
+    token = _request_timeout.set(seconds)
+    try:
+        yield
+    finally:
+        _request_timeout.reset(token)
+
+
+def current_request_timeout():
+    '''
+    Returns the timeout set by request_timeout() for the current thread (or
+    task), or None if there is none
+    '''
+    return _request_timeout.get()
+
+
+class PooledAPIClient(docker.APIClient):
+    '''
+    APIClient that honours request_timeout() and sizes its HTTP connection
+    pool for concurrent use
+    '''
+
+    def __init__(self, *args, pool_size=10, **kwargs):
+        super().__init__(*args, **kwargs)
+        # docker only sizes the pool of its custom adapters, plain tcp://
+        # endpoints fall back to the requests default of 10 connections
+        if not self.base_url.startswith('http+docker://'):
+            default_adapter = self.adapters.get('http://')
+            self.mount('http://', HTTPAdapter(pool_connections=1,
+                                              pool_maxsize=pool_size))
+            if default_adapter is not None:
+                default_adapter.close()
+
+    def get_json(self, path, params=None):
+        '''
+        Issues a GET for an Engine API path (ex: /services) and returns the
+        decoded JSON body. Used for endpoints or parameters the docker SDK
+        does not expose.
+        '''
+        return self._result(self._get(self._url(path), params=params),
+                            json=True)
+
+    def open_stream(self, path, params=None):
+        '''
+        Issues a streaming GET for an Engine API path (ex:
+        /containers/{id}/stats) and returns the open response. Read it with
+        decode_stream() and end it, from any thread, with close_stream().
+        '''
+        response = self._get(self._url(path), params=params, stream=True)
+        self._raise_for_status(response)
+        return response
+
+    def decode_stream(self, response):
+        '''Yields the decoded JSON objects of a response from open_stream()'''
+        return self._stream_helper(response, decode=True)
+
+    def close_stream(self, response):
+        '''
+        Closes a response from open_stream(). Its socket is shut down first,
+        so a read blocked waiting for the next chunk returns at once (closing
+        the response alone would wait for that read).
+        '''
+        try:
+            sock = self._get_raw_response_socket(response)
+            # Plain tcp:// and unix sockets come back wrapped in a SocketIO
+            getattr(sock, '_sock', sock).shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        response.close()
+
+    def request(self, method, url, *args, **kwargs):
+        '''
+        Sends the request and records its latency or failure against the
+        endpoint's health (see health.py)
+        '''
+        start = time.monotonic()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.exceptions.RequestException as err:
+            elapsed = time.monotonic() - start
+            metrics.observe_call(self.base_url, elapsed, error=True)
+            profiling.record_call(self.base_url, method, urlsplit(url).path,
+                                  elapsed, error=type(err).__name__)
+            # A timeout cut short by the request's deadline says nothing
+            # about the endpoint
+            if not (isinstance(err, requests.exceptions.Timeout) and
+                    deadlines.exceeded()):
+                health.record_failure(self.base_url, err)
+            raise
+
+        elapsed = time.monotonic() - start
+        metrics.observe_call(self.base_url, elapsed,
+                             error=response.status_code >= 400)
+        profiling.record_call(
+            self.base_url, method, urlsplit(url).path, elapsed,
+            response.headers.get('Content-Length'),
+            response.status_code if response.status_code >= 400 else None)
+        # 503 is how a manager reports it has lost the swarm (or is not a
+        # manager); other error statuses are answers to the request itself
+        if response.status_code == 503:
+            health.record_failure(self.base_url, response.reason)
+        else:
+            health.record_success(self.base_url, elapsed)
+        return response
+
+    def _set_request_timeout(self, kwargs):
+        timeout = current_request_timeout()
+        if timeout is not None:
+            kwargs.setdefault('timeout', timeout)
+        kwargs = super()._set_request_timeout(kwargs)
+        # Connect and read timeouts are bounded by the request's deadline
+        kwargs['timeout'] = deadlines.call_timeout(kwargs['timeout'])
+        return kwargs
+
+
+class PooledDockerClient(docker.DockerClient):
+    '''
+    DockerClient backed by a PooledAPIClient
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.api = PooledAPIClient(*args, **kwargs)
+
+
+class _Entry:
+    '''
+    A client held by the registry and its bookkeeping
+    '''
+
+    def __init__(self, client):
+        now = time.monotonic()
+        self.client = client
+        self.created = now
+        self.last_used = now
+        self.uses = 0
+
+
+class ClientRegistry:
+    '''
+    Keeps one Docker client per endpoint. Clients unused for idle_timeout
+    seconds are dropped, the least recently used client is dropped when more
+    than max_clients are held, and a client that has not been used for
+    health_check_interval seconds is pinged before it is handed out again.
+    Dropped clients are not closed, see the module docstring.
+    '''
+
+    def __init__(self, max_clients=32, idle_timeout=300,
+                 health_check_interval=30, pool_size=10, timeout=60):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+            'idle_evictions': 0,
+            'capacity_evictions': 0,
+        }
+
+    def get(self, base_url):
+        '''
+        Returns the shared client for base_url, creating it if needed
+        '''
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(base_url)
+            if entry is not None:
+                self._entries.move_to_end(base_url)
+                needs_check = \
+                    now - entry.last_used > self.health_check_interval
+                entry.last_used = now
+                entry.uses += 1
+
+        if entry is not None:
+            if not needs_check or self._healthy(entry):
+                with self._lock:
+                    self._counters['hits'] += 1
+                return entry.client
+
+            # Drop the unhealthy client and fall through to build a new one
+            with self._lock:
+                if self._entries.get(base_url) is entry:
+                    del self._entries[base_url]
+
+        return self._create(base_url)
+
+    def stats(self):
+        '''
+        Returns a dictionary of registry counters and per endpoint pool usage
+        '''
+        now = time.monotonic()
+        with self._lock:
+            endpoints = []
+            for base_url, entry in self._entries.items():
+                endpoint = {
+                    'base_url': base_url,
+                    'uses': entry.uses,
+                    'age': round(now - entry.created, 1),
+                    'idle': round(now - entry.last_used, 1),
+                }
+                endpoint.update(self._connection_stats(entry.client))
+                endpoints.append(endpoint)
+
+            result = dict(self._counters)
+            result.update({
+                'clients': len(self._entries),
+                'max_clients': self.max_clients,
+                'pool_size': self.pool_size,
+                'endpoints': endpoints,
+            })
+
+        return result
+
+    def clear(self):
+        '''
+        Closes and forgets every client held by the registry. Only for
+        shutdown and tests, clients in use are closed under their callers.
+        '''
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        self._close(entries)
+
+    def _create(self, base_url):
+        client = PooledDockerClient(base_url=base_url,
+                                    timeout=self.timeout,
+                                    pool_size=self.pool_size)
+        entry = _Entry(client)
+        entry.uses = 1
+
+        with self._lock:
+            self._counters['misses'] += 1
+            existing = self._entries.get(base_url)
+            if existing is not None:
+                # Another thread won the race, keep its client. Ours was never
+                # handed out, so it is safe to close.
+                existing.uses += 1
+                self._entries.move_to_end(base_url)
+                surplus = [entry]
+                client = existing.client
+            else:
+                self._entries[base_url] = entry
+                surplus = []
+                while len(self._entries) > self.max_clients:
+                    self._entries.popitem(last=False)
+                    self._counters['capacity_evictions'] += 1
+
+        self._close(surplus)
+        return client
+
+    def _evict_idle(self, now):
+        '''Removes idle entries, must be called with the lock held'''
+        stale = [base_url for base_url, entry in self._entries.items()
+                 if now - entry.last_used > self.idle_timeout]
+        for base_url in stale:
+            del self._entries[base_url]
+            self._counters['idle_evictions'] += 1
+
+    def _healthy(self, entry):
+        try:
+            healthy = entry.client.ping()
+        except Exception:
+            healthy = False
+
+        with self._lock:
+            self._counters['health_checks'] += 1
+            if not healthy:
+                self._counters['health_check_failures'] += 1
+
+        return healthy
+
+    @staticmethod
+    def _connection_stats(client):
+        '''
+        Returns connection and request counts for the client's HTTP pools.
+        requests / connections above 1 means connections are being reused.
+        '''
+        connections = 0
+        requests_sent = 0
+        for adapter in client.api.adapters.values():
+            pool_manager = getattr(adapter, 'poolmanager', None)
+            if pool_manager is None:
+                continue
+            for key in pool_manager.pools.keys():
+                pool = pool_manager.pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+
+        return {'connections': connections, 'requests': requests_sent}
+
+    @staticmethod
+    def _close(entries):
+        for entry in entries:
+            try:
+                entry.client.close()
+            except Exception:
+                pass
+
+
+registry = ClientRegistry(
+    max_clients=getattr(settings, 'SWARMAN_DOCKER_MAX_CLIENTS', 32),
+    idle_timeout=getattr(settings, 'SWARMAN_DOCKER_IDLE_TIMEOUT', 300),
+    health_check_interval=getattr(
+        settings, 'SWARMAN_DOCKER_HEALTH_CHECK_INTERVAL', 30),
+    pool_size=getattr(settings, 'SWARMAN_DOCKER_POOL_SIZE', 10),
+    timeout=getattr(settings, 'SWARMAN_DOCKER_TIMEOUT', 60),
+)
+
+
+def get_client(base_url):
+    '''
+    Returns the shared Docker client for base_url (ex: tcp://10.0.0.2:2375)
+    '''
+    return registry.get(base_url)
+
+
+def pool_stats():
+    '''
+    Returns usage statistics for the shared Docker clients
+    '''
+    return registry.stats()
@@ -0,0 +1,303 @@
+"""
+Background collection of container utilization using streaming docker stats.
+
+Instead of asking the daemon for a blocking two sample stats reading on every
+request, the collector keeps a streaming stats subscription open for each
+running container on every node. The daemon pushes a new reading about once a
+second and the latest computed sample of each node is written to the shared
+stats store (see stats_store.py), where the web process reads it. Node totals
+are also recorded as utilization history (see history.py).
+
+Run with: python manage.py collect_stats
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import (
+    DatabaseError,
+    close_old_connections,
+)
+
+from . import (
+    clients,
+    history,
+    stats_store,
+    utils,
+)
+from .models import Node
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a subscription's thread to end once its stream is closed
+STOP_TIMEOUT = 1
+
+
+class ContainerSubscription(threading.Thread):
+    '''
+    Holds a streaming stats subscription for one container and keeps the
+    latest computed sample
+    '''
+
+    def __init__(self, api, container_id, name):
+        super().__init__(daemon=True, name=f'stats-{container_id[:12]}')
+        self.api = api
+        self.container_id = container_id
+        self.container_name = name
+        self.latest = None
+        self.finished = False
+        self._stop_event = threading.Event()
+        self._response = None
+
+    def stop(self, timeout=None):
+        '''
+        Ends the subscription. The stream is closed rather than left to end
+        after the next reading, as a paused or dead container may never send
+        one. Waits up to timeout seconds for the thread to finish.
+        '''
+        self._stop_event.set()
+        response = self._response
+        if response is not None:
+            try:
+                self.api.close_stream(response)
+            except Exception:
+                pass
+        if timeout is not None and self.ident is not None and \
+                threading.current_thread() is not self:
+            self.join(timeout)
+
+    def run(self):
+        try:
+            self._response = self.api.open_stream(
+                f'/containers/{self.container_id}/stats')
+            # stop() may have run before the stream was open
+            if self._stop_event.is_set():
+                self.api.close_stream(self._response)
+                return
+
+            for container_info in self.api.decode_stream(self._response):
+                if self._stop_event.is_set():
+                    break
+                try:
+                    cpu_usage, memory_usage = utils.container_utilization(
+                        container_info)
+                except (KeyError, TypeError):
+                    # Readings of a stopping container have no cpu or
+                    # memory stats
+                    continue
+                if cpu_usage is None:
+                    # The first reading of a stream has no previous sample
+                    continue
+
+                self.latest = {
+                    'id': self.container_id,
+                    'name': self.container_name,
+                    'cpu': cpu_usage,
+                    'memory': memory_usage,
+                    'timestamp': time.time(),
+                }
+        except Exception as err:
+            if not self._stop_event.is_set():
+                logger.warning('Stats stream for %s ended: %s',
+                               self.container_name, err)
+        finally:
+            self.finished = True
+
+
+class NodeCollector:
+    '''
+    Keeps a subscription open for every running container on a node, adding
+    and dropping them as containers start and stop
+    '''
+
+    def __init__(self, node):
+        self.node = node
+        self.base_url = f'tcp://{node.ip_address}:{node.api_port}'
+        self.subscriptions = {}
+        self._client = None
+
+    @property
+    def api(self):
+        # Streams hold their connection open for as long as the container
+        # runs, so the collector uses its own client rather than sharing the
+        # registry client's connection pool with request handling
+        if self._client is None:
+            self._client = clients.PooledDockerClient(
+                base_url=self.base_url,
+                timeout=utils.stats_timeout(),
+                pool_size=getattr(settings, 'SWARMAN_COLLECTOR_POOL_SIZE', 64))
+        return self._client.api
+
+    def refresh(self):
+        '''
+        Starts subscriptions for new containers and stops the ones for
+        containers that are no longer running
+        '''
+        try:
+            containers = self.api.containers()
+        except Exception as err:
+            logger.warning('Unable to list containers on %s: %s',
+                           self.node.hostname, err)
+            self.close()
+            return
+
+        running = {container['Id']: container['Names'][0]
+                   for container in containers}
+
+        for container_id in list(self.subscriptions):
+            subscription = self.subscriptions[container_id]
+            if container_id not in running or subscription.finished:
+                subscription.stop(STOP_TIMEOUT)
+                del self.subscriptions[container_id]
+
+        for container_id, name in running.items():
+            if container_id not in self.subscriptions:
+                subscription = ContainerSubscription(self.api, container_id,
+                                                     name)
+                subscription.start()
+                self.subscriptions[container_id] = subscription
+
+    def flush(self):
+        '''Writes the latest sample of every container to the stats store'''
+        samples = [subscription.latest
+                   for subscription in self.subscriptions.values()
+                   if subscription.latest is not None]
+        stats_store.save_node_samples(self.node.id, samples)
+
+        return samples
+
+    def close(self):
+        '''Stops every subscription and closes the node's client'''
+        # Every stream is closed before any thread is waited on
+        for subscription in self.subscriptions.values():
+            subscription.stop()
+        for subscription in self.subscriptions.values():
+            if subscription.ident is not None:
+                subscription.join(STOP_TIMEOUT)
+        self.subscriptions = {}
+        if self._client is not None:
+            try:
+                self._client.close()
+            except Exception:
+                pass
+            self._client = None
+
+
+class StatsCollector:
+    '''
+    Runs a NodeCollector for every Node with an address. Container lists
+    (and the Node table) are re-read every refresh_interval seconds and the
+    latest samples are written to the stats store every flush_interval seconds.
+    Node totals are written to the utilization history every
+    history_interval seconds, with rollups and pruning once a minute.
+    '''
+
+    def __init__(self, refresh_interval=None, flush_interval=None,
+                 node_ids=None, history_interval=None):
+        if refresh_interval is None:
+            refresh_interval = getattr(
+                settings, 'SWARMAN_COLLECTOR_REFRESH_INTERVAL', 10)
+        if flush_interval is None:
+            flush_interval = getattr(
+                settings, 'SWARMAN_COLLECTOR_FLUSH_INTERVAL', 2)
+        if history_interval is None:
+            history_interval = getattr(
+                settings, 'SWARMAN_HISTORY_INTERVAL', 10)
+
+        self.refresh_interval = refresh_interval
+        self.flush_interval = flush_interval
+        self.history_interval = history_interval
+        self.maintenance_interval = 60
+        self.node_ids = node_ids
+        self.collectors = {}
+        self._stop_event = threading.Event()
+
+    def sync_nodes(self):
+        '''Adds collectors for new nodes and removes them for deleted ones'''
+        nodes = Node.objects.exclude(ip_address=None)
+        if self.node_ids:
+            nodes = nodes.filter(id__in=self.node_ids)
+        nodes = {node.id: node for node in nodes}
+
+        for node_id in list(self.collectors):
+            collector = self.collectors[node_id]
+            node = nodes.get(node_id)
+            if node is None or collector.base_url != \
+                    f'tcp://{node.ip_address}:{node.api_port}':
+                collector.close()
+                stats_store.clear_node_samples(node_id)
+                del self.collectors[node_id]
+
+        for node_id, node in nodes.items():
+            if node_id not in self.collectors:
+                self.collectors[node_id] = NodeCollector(node)
+
+    def refresh(self):
+        '''
+        Syncs the collectors with the Node table and refreshes their
+        container lists. When the database cannot be read the current
+        collectors are refreshed without a sync.
+        '''
+        try:
+            self.sync_nodes()
+        except DatabaseError as err:
+            logger.warning('Unable to read the Node table: %s', err)
+        for collector in self.collectors.values():
+            collector.refresh()
+
+    def flush(self):
+        '''
+        Writes the latest samples of every node to the stats store. Returns
+        a dictionary of node id to (cpu_utilization, memory_utilization)
+        totals for nodes that reported samples.
+        '''
+        node_totals = {}
+        for node_id, collector in self.collectors.items():
+            samples = collector.flush()
+            if samples:
+                node_totals[node_id] = utils.total_utilization(samples)
+
+        return node_totals
+
+    def run(self):
+        '''Collects until stop() is called'''
+        next_refresh = 0
+        next_history = 0
+        next_maintenance = time.monotonic() + self.maintenance_interval
+        while not self._stop_event.is_set():
+            # Drops database connections that were closed or outlived
+            # CONN_MAX_AGE since the last cycle
+            close_old_connections()
+            if time.monotonic() >= next_refresh:
+                self.refresh()
+                next_refresh = time.monotonic() + self.refresh_interval
+
+            node_totals = self.flush()
+
+            if self.history_interval and time.monotonic() >= next_history:
+                try:
+                    history.record(node_totals)
+                except DatabaseError as err:
+                    logger.warning('Unable to record utilization history: '
+                                   '%s', err)
+                next_history = time.monotonic() + self.history_interval
+
+            if time.monotonic() >= next_maintenance:
+                try:
+                    history.maintain()
+                except DatabaseError as err:
+                    logger.warning('Unable to roll up utilization history: '
+                                   '%s', err)
+                next_maintenance = time.monotonic() + \
+                    self.maintenance_interval
+
+            self._stop_event.wait(self.flush_interval)
+
+        close_old_connections()
+        for collector in self.collectors.values():
+            collector.close()
+
+    def stop(self):
+        self._stop_event.set()
@@ -1,5 +1,15 @@
+from swarman import swarm_cache
 from swarman.models import Swarm
 
 
+def _build_swarm_list():
+    return list(Swarm.objects.with_counts().order_by('swarm_name').values(
+        'id', 'swarm_name', 'num_nodes', 'num_managers', 'num_workers'))
+
+
 def swarm_list(request):
-    return {'swarm_list': Swarm.objects.all()}
\ No newline at end of file
+    '''
+    Adds the swarms shown in the navbar, with their node counts, to every
+    page. The list is cached until a Swarm or Node changes.
+    '''
+    return {'swarm_list': swarm_cache.get_swarm_list(_build_swarm_list)}
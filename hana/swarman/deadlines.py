@@ -0,0 +1,186 @@
+"""
+Request level deadlines for Docker calls.
+
+DeadlineMiddleware (see middleware.py) gives every request a time budget,
+looked up by URL name in SWARMAN_REQUEST_DEADLINES with
+SWARMAN_REQUEST_DEADLINE as the default. Every Docker call made by the shared
+clients while serving the request gets a connect/read timeout carved out of
+the remaining budget: at most SWARMAN_DEADLINE_CALL_SHARE of what is left, so
+one slow daemon leaves time for the calls after it. Once the budget is spent
+further calls fail immediately with DeadlineExceeded and views show what they
+already have, with "Unknown" for the rest.
+
+Exhausted deadlines are logged and counted per endpoint (see stats()).
+
+Usage:
+    from swarman import deadlines
+
+    with deadlines.deadline(10, 'swarm-dashboard'):
+        swarm.get_services()
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_deadline = contextvars.ContextVar('swarman_deadline', default=None)
+
+# The shortest timeout a call is given while the budget allows it
+MIN_CALL_TIMEOUT = 1
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    '''Raised instead of making a Docker call once the deadline has passed'''
+
+
+class Deadline:
+    '''Time budget shared by every Docker call made while serving a request'''
+
+    def __init__(self, seconds, name=None):
+        self.seconds = seconds
+        self.name = name
+        self.expires = time.monotonic() + seconds
+        self.calls = 0
+        self.skipped_calls = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        '''Returns the number of seconds left in the budget'''
+        return max(0, self.expires - time.monotonic())
+
+    @property
+    def exceeded(self):
+        return self.remaining() <= 0
+
+    def call_timeout(self, timeout=None):
+        '''
+        Returns the timeout for the next call, never more than timeout.
+        Raises DeadlineExceeded if the budget is spent.
+        '''
+        remaining = self.remaining()
+        with self._lock:
+            if remaining <= 0:
+                self.skipped_calls += 1
+                raise DeadlineExceeded(
+                    f'Deadline of {self.seconds}s for {self.name} exceeded')
+            self.calls += 1
+
+        call_timeout = max(remaining * call_share(),
+                           min(remaining, MIN_CALL_TIMEOUT))
+        if timeout is not None:
+            call_timeout = min(call_timeout, timeout)
+
+        return call_timeout
+
+
+def call_share():
+    '''Returns the largest fraction of the remaining budget one call may use'''
+    return getattr(settings, 'SWARMAN_DEADLINE_CALL_SHARE', 0.5)
+
+
+def endpoint_deadline(url_name):
+    '''
+    Returns the deadline in seconds configured for a URL name, or None if
+    requests to it have no deadline
+    '''
+    configured = getattr(settings, 'SWARMAN_REQUEST_DEADLINES', {})
+    if url_name in configured:
+        return configured[url_name]
+
+    return getattr(settings, 'SWARMAN_REQUEST_DEADLINE', None)
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(current):
+    with _stats_lock:
+        endpoint = _stats.setdefault(current.name, {
+            'requests': 0,
+            'exhausted': 0,
+            'skipped_calls': 0,
+        })
+        endpoint['requests'] += 1
+        if current.skipped_calls:
+            endpoint['exhausted'] += 1
+            endpoint['skipped_calls'] += current.skipped_calls
+
+
+def stats():
+    '''
+    Returns, per endpoint, the number of requests served with a deadline, how
+    many of them ran out of budget and how many Docker calls were skipped
+    '''
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in _stats.items()}
+
+
+def clear_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+@contextmanager
+def deadline(seconds, name=None):
+    '''
+    Applies a deadline of seconds to every Docker call made in the current
+    thread (or task) for the duration of the with block. Thread pools must
+    run their work in a copy of the caller's context (see utils.py) to share
+    it.
+    '''
+    current = Deadline(seconds, name)
+    token = _deadline.set(current)
+    try:
+        yield current
+    finally:
+        _deadline.reset(token)
+        _record(current)
+        if current.skipped_calls:
+            logger.warning(
+                'Deadline of %ss for %s exhausted: %d Docker calls made, '
+                '%d skipped', seconds, name, current.calls,
+                current.skipped_calls)
+
+
+def current_deadline():
+    '''Returns the deadline of the current thread (or task), if any'''
+    return _deadline.get()
+
+
+def call_timeout(timeout=None):
+    '''
+    Returns the timeout for a Docker call under the current deadline, or
+    timeout if there is no deadline. Raises DeadlineExceeded if the deadline
+    has passed.
+    '''
+    current = _deadline.get()
+    if current is None:
+        return timeout
+
+    return current.call_timeout(timeout)
+
+
+def remaining(default=None):
+    '''
+    Returns the seconds left under the current deadline, or default if there
+    is no deadline
+    '''
+    current = _deadline.get()
+    if current is None:
+        return default
+
+    return current.remaining()
+
+
+def exceeded():
+    '''Returns whether the current deadline has passed'''
+    current = _deadline.get()
+    return current is not None and current.exceeded
@@ -0,0 +1,290 @@
+"""
+Incremental swarm state from Docker events.
+
+The listener follows the /events stream of one manager per swarm for node and
+service events, and of every node for container events. Docker does not
+publish task events; the swarm task and service labels on container events
+stand in for them. Each event updates the matching Node or Service row and
+invalidates the cached listings it makes stale (see swarm_cache.py and
+stats_store.py), so pages can be served from the cache between changes
+instead of walking the swarm on every request.
+
+Streams reconnect with backoff and resume from the last event they saw.
+
+Run with: python manage.py listen_events
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import (
+    clients,
+    stats_store,
+    swarm_cache,
+)
+from .models import (
+    Node,
+    Service,
+    Swarm,
+)
+from .snapshots import ServiceSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_FILTERS = {'type': ['node', 'service']}
+CONTAINER_FILTERS = {'type': ['container'],
+                     'event': ['start', 'die', 'destroy']}
+
+MAX_BACKOFF = 30
+
+
+def event_since(time_nano):
+    '''Returns the since parameter that resumes a stream at time_nano'''
+    return f'{time_nano // 10**9}.{time_nano % 10**9:09d}'
+
+
+class EventStream(threading.Thread):
+    '''
+    Follows the /events stream of an endpoint and passes every event to
+    handler. endpoints is a callable returning the base urls to try, so
+    cluster streams move to another manager when theirs goes away.
+    '''
+
+    def __init__(self, endpoints, filters, handler, name, on_connect=None):
+        super().__init__(daemon=True, name=f'events-{name}')
+        self.endpoints = endpoints
+        self.filters = filters
+        self.handler = handler
+        self.on_connect = on_connect
+        self.last_event = 0
+        self.connected = False
+        self._stream = None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        stream = self._stream
+        if stream is not None:
+            stream.close()
+
+    def run(self):
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                self._follow()
+                backoff = 1
+            except Exception as err:
+                if self._stop_event.is_set():
+                    break
+                logger.warning('Event stream %s lost: %s, reconnecting in '
+                               '%ss', self.name, err, backoff)
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            finally:
+                close_old_connections()
+
+    def _follow(self):
+        endpoints = self.endpoints()
+        if not endpoints:
+            raise ConnectionError('No endpoints available')
+
+        # The stream holds its connection for as long as it runs, so it gets
+        # a client of its own rather than one from the shared registry
+        client = clients.PooledAPIClient(
+            base_url=endpoints[0], pool_size=1,
+            version=getattr(settings, 'SWARMAN_DOCKER_API_VERSION', '1.41'))
+        try:
+            since = event_since(self.last_event) if self.last_event else None
+            self._stream = client.events(since=since, filters=self.filters,
+                                         decode=True)
+            self.connected = True
+            if self.on_connect is not None:
+                self.on_connect()
+
+            for event in self._stream:
+                if self._stop_event.is_set():
+                    break
+                # Resuming from the last timestamp replays the events seen at
+                # that exact time
+                time_nano = event.get('timeNano', 0)
+                if time_nano and time_nano <= self.last_event:
+                    continue
+                self.last_event = time_nano or self.last_event
+                try:
+                    self.handler(event, endpoints[0])
+                except Exception:
+                    logger.exception('Unable to handle event %s', event)
+        finally:
+            self.connected = False
+            self._stream = None
+            client.close()
+
+
+def _inspect_client(base_url):
+    return clients.get_client(base_url).api
+
+
+def handle_cluster_event(swarm, event, base_url):
+    '''
+    Applies a node or service event from a swarm manager to the Node and
+    Service rows of the swarm and drops the listings it makes stale
+    '''
+    kind = event.get('Type')
+    action = event.get('Action')
+    object_id = event.get('Actor', {}).get('ID')
+
+    if kind == 'node':
+        swarm_cache.invalidate(swarm.id, swarm_cache.NODES)
+        if action == 'remove':
+            Node.objects.filter(swarm=swarm, node_id=object_id).delete()
+            return
+
+        node_data = _inspect_client(base_url).inspect_node(object_id)
+        swarm.import_nodes([node_data])
+
+    elif kind == 'service':
+        swarm_cache.invalidate(swarm.id, swarm_cache.SERVICES)
+        # Task counts only come with a full listing, resync on the next read
+        Swarm.objects.filter(id=swarm.id).update(services_synced_at=None)
+        if action == 'remove':
+            Service.objects.filter(swarm=swarm, service_id=object_id).delete()
+            return
+
+        service_data = _inspect_client(base_url).inspect_service(object_id)
+        service = Service.objects.filter(swarm=swarm,
+                                         service_id=object_id).first()
+        if service is None:
+            service = Service(swarm=swarm)
+        service.apply_service_data(ServiceSnapshot.from_api(service_data))
+        service.save()
+
+
+def handle_container_event(node, event, base_url=None):
+    '''
+    Applies a container event from a node: task changes make the swarm's
+    service listing stale and stopped containers are dropped from the
+    node's utilization samples
+    '''
+    attributes = event.get('Actor', {}).get('Attributes', {})
+    if 'com.docker.swarm.service.id' in attributes and node.swarm_id:
+        swarm_cache.invalidate(node.swarm_id, swarm_cache.SERVICES)
+        Swarm.objects.filter(id=node.swarm_id).update(services_synced_at=None)
+
+    if event.get('Action') in ('die', 'destroy'):
+        stats_store.drop_container(node.id, event.get('Actor', {}).get('ID'))
+
+
+class EventListener:
+    '''
+    Runs one cluster EventStream per Swarm and one container EventStream per
+    Node. The Swarm and Node tables are re-read every refresh_interval
+    seconds. Swarms whose cluster stream is connected are marked as
+    listening so their listings can be cached.
+    '''
+
+    def __init__(self, refresh_interval=None, swarm_ids=None):
+        if refresh_interval is None:
+            refresh_interval = getattr(
+                settings, 'SWARMAN_EVENTS_REFRESH_INTERVAL', 30)
+
+        self.refresh_interval = refresh_interval
+        self.heartbeat_interval = max(1, swarm_cache.heartbeat_timeout() / 3)
+        self.swarm_ids = swarm_ids
+        self.cluster_streams = {}
+        self.node_streams = {}
+        self._stop_event = threading.Event()
+
+    def _cluster_stream(self, swarm):
+        def endpoints():
+            return [f'tcp://{address}'
+                    for address in Swarm.objects.get(
+                        id=swarm.id).manager_ip_list()]
+
+        def handler(event, base_url):
+            handle_cluster_event(swarm, event, base_url)
+
+        def on_connect():
+            # Events may have been missed while disconnected
+            swarm_cache.invalidate(swarm.id, swarm_cache.NODES,
+                                   swarm_cache.SERVICES)
+
+        return EventStream(endpoints, CLUSTER_FILTERS, handler,
+                           f'swarm-{swarm.id}', on_connect)
+
+    def _node_stream(self, node):
+        base_url = f'tcp://{node.ip_address}:{node.api_port}'
+
+        def handler(event, stream_url):
+            handle_container_event(node, event, stream_url)
+
+        return EventStream(lambda: [base_url], CONTAINER_FILTERS, handler,
+                           f'node-{node.id}')
+
+    def sync(self):
+        '''Starts streams for new swarms and nodes and stops removed ones'''
+        swarms = Swarm.objects.all()
+        if self.swarm_ids:
+            swarms = swarms.filter(id__in=self.swarm_ids)
+        swarms = {swarm.id: swarm for swarm in swarms}
+        nodes = {node.id: node for node in Node.objects.filter(
+            swarm__in=list(swarms)).exclude(ip_address=None)}
+
+        self._sync_streams(self.cluster_streams, swarms, self._cluster_stream,
+                           lambda swarm: swarm.id)
+        self._sync_streams(self.node_streams, nodes, self._node_stream,
+                           lambda node: (node.ip_address, node.api_port))
+
+    def _sync_streams(self, streams, objects, factory, identity):
+        for object_id in list(streams):
+            stream, current = streams[object_id]
+            updated = objects.get(object_id)
+            if updated is None or identity(updated) != identity(current):
+                stream.stop()
+                del streams[object_id]
+                if streams is self.cluster_streams:
+                    swarm_cache.stop_listening(object_id)
+
+        for object_id, obj in objects.items():
+            if object_id not in streams:
+                stream = factory(obj)
+                stream.start()
+                streams[object_id] = (stream, obj)
+
+    def heartbeat(self):
+        '''Marks swarms with a connected cluster stream as listening'''
+        for swarm_id, (stream, swarm) in self.cluster_streams.items():
+            if stream.connected:
+                swarm_cache.heartbeat(swarm_id)
+            else:
+                swarm_cache.stop_listening(swarm_id)
+
+    def run(self):
+        '''Listens until stop() is called'''
+        next_sync = 0
+        while not self._stop_event.is_set():
+            if time.monotonic() >= next_sync:
+                self.sync()
+                close_old_connections()
+                next_sync = time.monotonic() + self.refresh_interval
+
+            self.heartbeat()
+            self._stop_event.wait(self.heartbeat_interval)
+
+        self.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def close(self):
+        '''Stops every stream and marks their swarms as no longer listening'''
+        for swarm_id, (stream, swarm) in self.cluster_streams.items():
+            stream.stop()
+            swarm_cache.stop_listening(swarm_id)
+        for stream, node in self.node_streams.values():
+            stream.stop()
+        self.cluster_streams = {}
+        self.node_streams = {}
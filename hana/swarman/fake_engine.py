@@ -0,0 +1,419 @@
+"""
+A fake Docker Engine API for benchmarks and load tests.
+
+FakeEngine serves a simulated swarm of `nodes` nodes, each running `containers`
+containers, from one local HTTP server per node. Every server answers the node
+level endpoints (containers and their stats) for its own node and the swarm
+level endpoints (nodes, services and tasks) as a manager would. Node n is
+served on the loopback address 127.0.0.<n + 1> (every Node needs its own
+ip_address), so this needs an OS that routes all of 127.0.0.0/8 to loopback,
+such as Linux. Each call sleeps for `latency` seconds before answering,
+standing in for the round trip to a real daemon, and is counted per route so
+callers can see how many remote calls an operation made. Stats calls that are
+not one-shot also sleep for `stats_wait` seconds, as dockerd waits about a
+second for a second sample.
+
+Only the parts of the Engine API that swarman uses are implemented.
+
+Usage:
+    with FakeEngine(nodes=3, containers=10, latency=0.005) as engine:
+        swarm = engine.create_swarm('Benchmark Swarm')
+        swarm.get_services()
+        engine.call_counts()
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from urllib.parse import (
+    parse_qs,
+    urlsplit,
+)
+
+
+# Routes are matched after the /v1.xx version prefix is removed. Calls are
+# counted under "METHOD path" with the path as written here.
+ROUTES = [
+    ('GET', '/_ping', 'ping'),
+    ('GET', '/version', 'version'),
+    ('GET', '/containers/json', 'list_containers'),
+    ('GET', '/containers/{id}/json', 'inspect_container'),
+    ('GET', '/containers/{id}/stats', 'container_stats'),
+    ('GET', '/nodes', 'list_nodes'),
+    ('GET', '/nodes/{id}', 'inspect_node'),
+    ('GET', '/services', 'list_services'),
+    ('GET', '/services/{id}', 'inspect_service'),
+    ('POST', '/services/{id}/update', 'update_service'),
+    ('GET', '/tasks', 'list_tasks'),
+]
+
+
+def _route_pattern(path):
+    return re.compile('^' + path.replace('{id}', '(?P<id>[^/]+)') + '$')
+
+
+VERSION_PREFIX = re.compile(r'^/v[0-9.]+')
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeEngine:
+    '''A simulated swarm served by one local Docker Engine API per node'''
+
+    def __init__(self, nodes=3, containers=5, services=4, managers=1,
+                 latency=0.0, host='127.0.0.{}', stats_wait=0.0):
+        self.node_count = nodes
+        self.containers_per_node = containers
+        self.service_count = services
+        self.manager_count = max(1, min(managers, nodes))
+        self.latency = latency
+        self.host = host
+        self.stats_wait = stats_wait
+        self.servers = []
+        self._calls = Counter()
+        self._stats_reads = Counter()
+        self._bytes_sent = 0
+        self._lock = threading.Lock()
+
+        self._routes = [(method, route, _route_pattern(route), name)
+                        for method, route, name in ROUTES]
+        self.services = [self._service(index) for index in range(services)]
+        self.nodes = []
+        self.containers = {}
+
+    # Simulated swarm state
+
+    def _service(self, index):
+        return {
+            'ID': f'fakeservice{index:04d}',
+            'Version': {'Index': 20 + index},
+            'Spec': {
+                'Name': f'fake-service-{index}',
+                'TaskTemplate': {'ContainerSpec': {
+                    'Image': f'fake/image-{index}:latest@sha256:{index:064d}',
+                }},
+                'Mode': {'Replicated': {'Replicas': 2}},
+                'EndpointSpec': {'Ports': [{
+                    'TargetPort': 8000 + index,
+                    'PublishedPort': 30000 + index,
+                }]},
+            },
+        }
+
+    def _node(self, index, address):
+        host, port = address
+        node = {
+            'ID': f'fakenode{index:04d}',
+            'Version': {'Index': 10},
+            'Spec': {
+                'Role': 'manager' if index < self.manager_count else 'worker',
+                'Availability': 'active',
+            },
+            'Status': {'State': 'ready', 'Addr': host},
+            'Description': {
+                'Hostname': f'fake-node-{index}',
+                'Platform': {'Architecture': 'x86_64', 'OS': 'linux'},
+                'Resources': {'MemoryBytes': 8 * 10**9,
+                              'NanoCPUs': 4 * 10**9},
+                'Engine': {'EngineVersion': '20.10.14'},
+            },
+        }
+        if index < self.manager_count:
+            node['ManagerStatus'] = {'Leader': index == 0,
+                                     'Reachability': 'reachable',
+                                     'Addr': f'{host}:{port}'}
+        return node
+
+    def _container(self, node_index, index):
+        service = self.services[index % len(self.services)] \
+            if self.services else None
+        name = f'fake-{node_index}-{index}'
+        labels = {}
+        if service is not None:
+            labels['com.docker.swarm.service.id'] = service['ID']
+        return {
+            'Id': f'{node_index:04d}{index:04d}'.ljust(64, '0'),
+            'Name': f'/{name}',
+            'State': {'Status': 'running', 'Running': True},
+            'Config': {'Image': 'fake/image:latest', 'Labels': labels},
+        }
+
+    def _stats(self, node_index, index, one_shot=False):
+        # A fixed, non zero load so utilization math has something to do.
+        # The counters advance with every read, like a daemon's would.
+        with self._lock:
+            self._stats_reads[node_index, index] += 1
+            reads = 10 + self._stats_reads[node_index, index]
+        usage_rate = 10**8 * (1 + (node_index + index) % 5)
+        stats = {
+            'read': '2022-01-01T00:00:00Z',
+            'cpu_stats': {
+                'cpu_usage': {'total_usage': usage_rate * reads},
+                'system_cpu_usage': 10**10 * reads,
+                'online_cpus': 4,
+            },
+            'precpu_stats': {
+                'cpu_usage': {'total_usage': usage_rate * (reads - 1)},
+                'system_cpu_usage': 10**10 * (reads - 1),
+            },
+            'memory_stats': {'usage': 64 * 2**20 * (1 + index % 4),
+                             'limit': 8 * 10**9},
+        }
+        if one_shot:
+            # One-shot reads do not wait for a second sample to diff against
+            stats['precpu_stats'] = {'cpu_usage': {'total_usage': 0}}
+        return stats
+
+    def _tasks(self):
+        tasks = []
+        for node_index, node in enumerate(self.nodes):
+            for index, container in enumerate(self.containers[node_index]):
+                service_id = container['Config']['Labels'].get(
+                    'com.docker.swarm.service.id')
+                if service_id is None:
+                    continue
+                tasks.append({
+                    'ID': f'faketask{node_index:04d}{index:04d}',
+                    'ServiceID': service_id,
+                    'NodeID': node['ID'],
+                    'DesiredState': 'running',
+                    'Status': {'State': 'running', 'ContainerStatus': {
+                        'ContainerID': container['Id']}},
+                })
+        return tasks
+
+    # Request handling
+
+    def handle(self, node_index, method, path, query, body=None):
+        '''Returns the response body for a request to a node's server'''
+        path = VERSION_PREFIX.sub('', path)
+        for route_method, route, pattern, name in self._routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                self._count(f'{method} {route}')
+                if self.latency:
+                    time.sleep(self.latency)
+                return getattr(self, f'_{name}')(node_index, query, body,
+                                                 **match.groupdict())
+
+        self._count(f'{method} (unknown)')
+        raise NotFound(f'page not found: {method} {path}')
+
+    def _ping(self, node_index, query, body):
+        return 'OK'
+
+    def _version(self, node_index, query, body):
+        return {'Version': '20.10.14', 'ApiVersion': '1.41'}
+
+    def _list_containers(self, node_index, query, body):
+        return [{
+            'Id': container['Id'],
+            'Names': [container['Name']],
+            'Image': container['Config']['Image'],
+            'State': 'running',
+            'Labels': container['Config']['Labels'],
+        } for container in self.containers[node_index]]
+
+    def _find_container(self, node_index, container_id):
+        for index, container in enumerate(self.containers[node_index]):
+            if container['Id'].startswith(container_id) or \
+                    container['Name'] == f'/{container_id}':
+                return index, container
+        raise NotFound(f'No such container: {container_id}')
+
+    def _inspect_container(self, node_index, query, body, id):
+        return self._find_container(node_index, id)[1]
+
+    def _container_stats(self, node_index, query, body, id):
+        index, _ = self._find_container(node_index, id)
+        one_shot = query.get('one-shot', [''])[0].lower() in ('1', 'true')
+        if self.stats_wait and not one_shot:
+            time.sleep(self.stats_wait)
+        return self._stats(node_index, index, one_shot)
+
+    def _list_nodes(self, node_index, query, body):
+        return self.nodes
+
+    def _inspect_node(self, node_index, query, body, id):
+        for node in self.nodes:
+            if id in (node['ID'], node['Description']['Hostname']):
+                return node
+        raise NotFound(f'node {id} not found')
+
+    def _list_services(self, node_index, query, body):
+        if query.get('status', [''])[0].lower() not in ('1', 'true'):
+            return self.services
+
+        running = Counter(task['ServiceID'] for task in self._tasks())
+        return [dict(service, ServiceStatus={
+            'RunningTasks': running[service['ID']],
+            'DesiredTasks': service['Spec']['Mode']['Replicated']['Replicas'],
+        }) for service in self.services]
+
+    def _inspect_service(self, node_index, query, body, id):
+        for service in self.services:
+            if id in (service['ID'], service['Spec']['Name']):
+                return service
+        raise NotFound(f'service {id} not found')
+
+    def _update_service(self, node_index, query, body, id):
+        service = self._inspect_service(node_index, query, None, id)
+        spec = json.loads(body or '{}')
+        with self._lock:
+            replicated = spec.get('Mode', {}).get('Replicated')
+            if replicated is not None:
+                service['Spec']['Mode'] = {'Replicated': replicated}
+            service['Version'] = {'Index': service['Version']['Index'] + 1}
+        return {'Warnings': []}
+
+    def _list_tasks(self, node_index, query, body):
+        filters = json.loads(query.get('filters', ['{}'])[0])
+        tasks = self._tasks()
+        if filters.get('service'):
+            services = set()
+            for service_id in filters['service']:
+                service = self._inspect_service(node_index, query, None,
+                                                service_id)
+                services.add(service['ID'])
+            tasks = [task for task in tasks if task['ServiceID'] in services]
+        return tasks
+
+    # Call accounting
+
+    def _count(self, route):
+        with self._lock:
+            self._calls[route] += 1
+
+    def _sent(self, size):
+        with self._lock:
+            self._bytes_sent += size
+
+    def call_counts(self):
+        '''Returns the number of calls made to each route since the last reset'''
+        with self._lock:
+            return dict(self._calls)
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self._calls.values())
+
+    def bytes_sent(self):
+        with self._lock:
+            return self._bytes_sent
+
+    def reset_counts(self):
+        with self._lock:
+            self._calls.clear()
+            self._bytes_sent = 0
+
+    # Servers
+
+    def start(self):
+        '''Starts one server per node on free local ports'''
+        for node_index in range(self.node_count):
+            server = ThreadingHTTPServer(
+                (self.host.format(node_index + 1), 0),
+                _handler(self, node_index))
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True,
+                             name=f'fake-engine-{node_index}').start()
+            self.servers.append(server)
+
+            self.nodes.append(self._node(node_index,
+                                         server.server_address[:2]))
+            self.containers[node_index] = [
+                self._container(node_index, index)
+                for index in range(self.containers_per_node)]
+
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def addresses(self):
+        '''Returns the (host, port) each node's API is served on'''
+        return [server.server_address[:2] for server in self.servers]
+
+    def create_swarm(self, swarm_name='Fake Swarm'):
+        '''
+        Creates a Swarm with a Node row for every simulated node, pointing at
+        its server. Returns the Swarm.
+        '''
+        from .models import (
+            Node,
+            Swarm,
+        )
+
+        swarm = Swarm.objects.create(swarm_name=swarm_name)
+        Node.objects.bulk_create([Node(
+            swarm=swarm,
+            node_id=node['ID'],
+            hostname=node['Description']['Hostname'],
+            ip_address=host,
+            api_port=str(port),
+            role=node['Spec']['Role'].title(),
+        ) for node, (host, port) in zip(self.nodes, self.addresses)])
+
+        return swarm
+
+
+def _handler(engine, node_index):
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, like the Docker daemon
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def _respond(self, method):
+            url = urlsplit(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            request_body = self.rfile.read(length) if length else None
+
+            try:
+                body = engine.handle(node_index, method, url.path,
+                                     parse_qs(url.query), request_body)
+                status = 200
+            except NotFound as err:
+                body, status = {'message': str(err)}, 404
+
+            if isinstance(body, str):
+                payload, content_type = body.encode(), 'text/plain'
+            else:
+                payload, content_type = json.dumps(body).encode(), \
+                    'application/json'
+            engine._sent(len(payload))
+
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.send_header('Api-Version', '1.41')
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._respond('GET')
+
+        def do_POST(self):
+            self._respond('POST')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,192 @@
+"""
+Health tracking for Docker endpoints, used to order swarm managers.
+
+Every request made through the shared Docker clients (clients.py and
+aio_docker.py) records its latency or failure against its endpoint. Swarm
+manager lists are ordered fastest healthy manager first, and a manager that
+fails SWARMAN_MANAGER_FAILURE_THRESHOLD times in a row has its circuit opened:
+it is moved to the end of the list for SWARMAN_MANAGER_RETRY_INTERVAL seconds,
+after which a single request is allowed through as a probe. A successful probe
+closes the circuit again, a failed one re-opens it.
+
+The tracker is shared by every request served by the process.
+"""
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def endpoint_address(base_url):
+    '''
+    Returns the host:port address of a client base url, matching the
+    addresses returned by Swarm.manager_ip_list()
+    '''
+    if '://' not in base_url:
+        return base_url
+    return urlparse(base_url).netloc
+
+
+class _Health:
+    '''Health record of one endpoint'''
+
+    def __init__(self):
+        self.latency = None
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened = None
+        self.probe_started = None
+        self.last_error = None
+
+
+class HealthTracker:
+    '''
+    Records request latency and failures per endpoint address and orders
+    addresses by health
+    '''
+
+    def __init__(self, failure_threshold=3, retry_interval=30,
+                 latency_weight=0.3):
+        self.failure_threshold = failure_threshold
+        self.retry_interval = retry_interval
+        self.latency_weight = latency_weight
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, address):
+        entry = self._endpoints.get(address)
+        if entry is None:
+            entry = self._endpoints[address] = _Health()
+        return entry
+
+    def record_success(self, address, latency):
+        '''Records a completed request and closes the endpoint's circuit'''
+        with self._lock:
+            entry = self._entry(address)
+            if entry.latency is None:
+                entry.latency = latency
+            else:
+                # Exponentially weighted, so a manager that slows down moves
+                # back in the order within a few requests
+                entry.latency += self.latency_weight * (latency - entry.latency)
+            entry.successes += 1
+            entry.consecutive_failures = 0
+            entry.state = CLOSED
+            entry.opened = None
+            entry.probe_started = None
+
+    def record_failure(self, address, error=None):
+        '''
+        Records a failed request, opening the endpoint's circuit after
+        failure_threshold failures in a row or when a probe fails
+        '''
+        with self._lock:
+            entry = self._entry(address)
+            entry.failures += 1
+            entry.consecutive_failures += 1
+            entry.last_error = None if error is None else \
+                f'{type(error).__name__}: {error}'
+            if entry.state == HALF_OPEN or \
+                    entry.consecutive_failures >= self.failure_threshold:
+                entry.state = OPEN
+                entry.opened = time.monotonic()
+                entry.probe_started = None
+
+    def _available(self, entry, now):
+        '''
+        Returns whether a request should be sent to the endpoint, letting a
+        single probe through once an open circuit's retry interval has passed
+        '''
+        if entry.state == CLOSED:
+            return True
+
+        if entry.state == OPEN and now - entry.opened >= self.retry_interval:
+            entry.state = HALF_OPEN
+            entry.probe_started = now
+            return True
+
+        # A probe that never reported back (the caller stopped at an earlier
+        # manager) is handed to the next caller
+        if entry.state == HALF_OPEN and \
+                now - entry.probe_started >= self.retry_interval:
+            entry.probe_started = now
+            return True
+
+        return False
+
+    def order(self, addresses):
+        '''
+        Returns addresses ordered by health. Endpoints with a closed circuit
+        come first, fastest first (endpoints without requests yet count as
+        fastest so they are tried), followed by endpoints due a probe and
+        finally endpoints with an open circuit, so they are only tried when
+        every other endpoint fails.
+        '''
+        now = time.monotonic()
+        healthy, probes, unavailable = [], [], []
+        with self._lock:
+            for index, address in enumerate(addresses):
+                entry = self._entry(address)
+                was_closed = entry.state == CLOSED
+                if not self._available(entry, now):
+                    unavailable.append((entry.opened, index, address))
+                elif was_closed:
+                    healthy.append((entry.latency or 0, index, address))
+                else:
+                    probes.append((index, address))
+
+        # The probe goes first so it is actually attempted
+        return ([address for _, address in probes] +
+                [address for _, _, address in sorted(healthy)] +
+                [address for _, _, address in sorted(unavailable)])
+
+    def stats(self):
+        '''Returns the health of every tracked endpoint'''
+        with self._lock:
+            return {
+                address: {
+                    'state': entry.state,
+                    'latency': entry.latency,
+                    'successes': entry.successes,
+                    'failures': entry.failures,
+                    'consecutive_failures': entry.consecutive_failures,
+                    'last_error': entry.last_error,
+                }
+                for address, entry in self._endpoints.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+tracker = HealthTracker(
+    failure_threshold=getattr(settings, 'SWARMAN_MANAGER_FAILURE_THRESHOLD', 3),
+    retry_interval=getattr(settings, 'SWARMAN_MANAGER_RETRY_INTERVAL', 30),
+)
+
+
+def record_success(base_url, latency):
+    tracker.record_success(endpoint_address(base_url), latency)
+
+
+def record_failure(base_url, error=None):
+    tracker.record_failure(endpoint_address(base_url), error)
+
+
+def order_addresses(addresses):
+    '''Returns manager addresses ordered fastest healthy manager first'''
+    return tracker.order(addresses)
+
+
+def endpoint_stats():
+    '''Returns the health of every Docker endpoint requests were made to'''
+    return tracker.stats()
@@ -0,0 +1,223 @@
+"""
+Utilization history for Nodes.
+
+Raw UtilizationSample rows are written in bulk by the collect_stats collector.
+Completed minutes are averaged into 1 minute samples and completed hours into
+1 hour samples, and each resolution is pruned after its retention window
+(SWARMAN_HISTORY_RETENTION) so the database does not grow without bound.
+Queries pick the coarsest resolution that still gives the requested number of
+points and downsample on the server.
+"""
+from datetime import (
+    datetime,
+    timedelta,
+    timezone as dt_timezone,
+)
+
+import numpy
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from . import utilization
+from .models import UtilizationSample
+
+
+# Rollups are built from the next finer resolution
+ROLLUPS = (
+    (UtilizationSample.MINUTE, UtilizationSample.RAW),
+    (UtilizationSample.HOUR, UtilizationSample.MINUTE),
+)
+
+RESOLUTION_NAMES = {
+    UtilizationSample.RAW: 'raw',
+    UtilizationSample.MINUTE: 'minute',
+    UtilizationSample.HOUR: 'hour',
+}
+
+DEFAULT_RETENTION = {
+    'raw': 24 * 3600,
+    'minute': 7 * 24 * 3600,
+    'hour': 365 * 24 * 3600,
+}
+
+
+def retention(resolution):
+    '''Returns how many seconds samples of a resolution are kept for'''
+    name = RESOLUTION_NAMES[resolution]
+    configured = getattr(settings, 'SWARMAN_HISTORY_RETENTION', {})
+
+    return configured.get(name, DEFAULT_RETENTION[name])
+
+
+def bucket_start(timestamp, seconds):
+    '''Returns the start of the seconds long bucket timestamp falls in'''
+    epoch = timestamp.timestamp()
+
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=dt_timezone.utc)
+
+
+def record(node_totals, timestamp=None):
+    '''
+    Writes one raw sample per node in a single query. node_totals is a
+    dictionary of node id to a (cpu_utilization, memory_utilization) Tuple.
+    Returns the number of samples written.
+    '''
+    if timestamp is None:
+        timestamp = timezone.now()
+
+    samples = [
+        UtilizationSample(node_id=node_id, resolution=UtilizationSample.RAW,
+                          timestamp=timestamp, cpu=cpu, memory=memory)
+        for node_id, (cpu, memory) in node_totals.items()
+    ]
+    UtilizationSample.objects.bulk_create(samples, ignore_conflicts=True)
+
+    return len(samples)
+
+
+def rollup(resolution, source_resolution, now=None):
+    '''
+    Averages source_resolution samples into resolution long buckets for
+    every bucket that has completely passed and has not been rolled up yet.
+    Returns the number of rollup samples written.
+    '''
+    if now is None:
+        now = timezone.now()
+    cutoff = bucket_start(now, resolution)
+
+    last_rollups = dict(
+        UtilizationSample.objects
+        .filter(resolution=resolution)
+        .values('node')
+        .annotate(last=Max('timestamp'))
+        .values_list('node', 'last'))
+
+    source = UtilizationSample.objects.filter(resolution=source_resolution,
+                                              timestamp__lt=cutoff)
+    if last_rollups:
+        source = source.filter(
+            timestamp__gte=min(last_rollups.values())
+            + timedelta(seconds=resolution))
+
+    buckets = {}
+    for node_id, timestamp, cpu, memory in source.values_list(
+            'node', 'timestamp', 'cpu', 'memory').order_by():
+        bucket = bucket_start(timestamp, resolution)
+        last = last_rollups.get(node_id)
+        if last is not None and bucket <= last:
+            continue
+        totals = buckets.setdefault((node_id, bucket), [0, 0, 0])
+        totals[0] += cpu
+        totals[1] += memory
+        totals[2] += 1
+
+    samples = [
+        UtilizationSample(node_id=node_id, resolution=resolution,
+                          timestamp=bucket, cpu=cpu / count,
+                          memory=memory / count)
+        for (node_id, bucket), (cpu, memory, count) in buckets.items()
+    ]
+    UtilizationSample.objects.bulk_create(samples, batch_size=500,
+                                          ignore_conflicts=True)
+
+    return len(samples)
+
+
+def prune(now=None):
+    '''
+    Deletes samples older than the retention window of their resolution.
+    Returns the number of samples deleted.
+    '''
+    if now is None:
+        now = timezone.now()
+
+    deleted = 0
+    for resolution in RESOLUTION_NAMES:
+        count, _ = UtilizationSample.objects.filter(
+            resolution=resolution,
+            timestamp__lt=now - timedelta(seconds=retention(resolution)),
+        ).delete()
+        deleted += count
+
+    return deleted
+
+
+def maintain(now=None):
+    '''Builds every rollup and prunes expired samples'''
+    for resolution, source_resolution in ROLLUPS:
+        rollup(resolution, source_resolution, now)
+
+    return prune(now)
+
+
+def choose_resolution(start, end, points, now=None):
+    '''
+    Returns the coarsest resolution that is still finer than the spacing of
+    points samples between start and end and is still retained at start
+    '''
+    if now is None:
+        now = timezone.now()
+    bucket_seconds = (end - start).total_seconds() / points
+
+    resolutions = sorted(RESOLUTION_NAMES)
+    chosen = resolutions[0]
+    for resolution in resolutions:
+        if resolution < bucket_seconds:
+            chosen = resolution
+
+    # Fall back to coarser data when the finer data has already been pruned
+    for resolution in resolutions:
+        if resolution < chosen:
+            continue
+        if now - timedelta(seconds=retention(resolution)) <= start or \
+                resolution == resolutions[-1]:
+            return resolution
+
+    return chosen
+
+
+def query(node, start, end, points=200, now=None):
+    '''
+    Returns the utilization history of a node between start and end averaged
+    into at most points evenly sized buckets. Returns a dictionary with the
+    resolution the data was read from and a list of points with timestamp,
+    cpu and memory.
+    '''
+    resolution = choose_resolution(start, end, points, now)
+    rows = node.utilization_samples.filter(
+        resolution=resolution,
+        timestamp__gte=start,
+        timestamp__lt=end,
+    ).order_by('timestamp').values_list('timestamp', 'cpu', 'memory')
+
+    rows = list(rows)
+    width = (end - start).total_seconds() / points
+    history = []
+    if rows:
+        offsets = numpy.array([(timestamp - start).total_seconds()
+                               for timestamp, _, _ in rows])
+        indexes = numpy.minimum(offsets // width, points - 1).astype(int)
+        counts = numpy.bincount(indexes, minlength=points)
+        cpu = numpy.bincount(indexes, weights=[row[1] for row in rows],
+                             minlength=points)
+        memory = numpy.bincount(indexes, weights=[row[2] for row in rows],
+                                minlength=points)
+        filled = numpy.flatnonzero(counts)
+        for index, cpu_average, memory_average in zip(
+                filled.tolist(),
+                utilization.round2(cpu[filled] / counts[filled]),
+                utilization.round2(memory[filled] / counts[filled])):
+            history.append({
+                'timestamp': start + timedelta(seconds=index * width),
+                'cpu': cpu_average,
+                'memory': memory_average,
+            })
+
+    return {
+        'node_id': node.id,
+        'start': start,
+        'end': end,
+        'resolution': RESOLUTION_NAMES[resolution],
+        'points': history,
+    }
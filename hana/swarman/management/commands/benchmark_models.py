@@ -0,0 +1,215 @@
+import json
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import (
+    connection,
+    transaction,
+)
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from swarman import (
+    clients,
+    health,
+    views,
+)
+from swarman.fake_engine import FakeEngine
+
+
+class Rollback(Exception):
+    '''Raised to undo the rows a benchmark run created'''
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmarks(swarm, node):
+    '''
+    Returns the benchmarks as (name, setup, run). setup runs untimed before
+    every iteration.
+    '''
+    factory = RequestFactory()
+
+    def no_setup():
+        pass
+
+    def reset_services():
+        # Measure the dashboard with a stale Service table, as on a first view
+        swarm.__class__.objects.filter(id=swarm.id).update(
+            services_synced_at=None)
+
+    return [
+        ('node_utilization', no_setup, lambda: node.utilization),
+        ('node_utilization_per_container', no_setup,
+         node.utilization_per_container),
+        ('swarm_get_services', no_setup, swarm.get_services),
+        ('node_get_node_info', node.clear_node_info, node.get_node_info),
+        ('swarm_dashboard', reset_services,
+         lambda: views.swarm_dashboard(
+             factory.get(f'/swarman/dashboard/{swarm.id}'), swarm.id)),
+        ('node_detail', no_setup,
+         lambda: views.node_detail(
+             factory.get(f'/swarman/nodes/{node.id}'), node.id)),
+    ]
+
+
+def measure(engine, setup, run, iterations):
+    '''
+    Runs a benchmark iterations times and once more under tracemalloc for its
+    peak memory. Returns the timings, remote calls and queries per iteration.
+    '''
+    times, calls, queries = [], [], []
+    for _ in range(iterations):
+        setup()
+        engine.reset_counts()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        calls.append(engine.total_calls())
+        queries.append(len(captured))
+    call_counts = engine.call_counts()
+    bytes_received = engine.bytes_sent()
+
+    setup()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_time': {
+            'mean': statistics.mean(times),
+            'median': statistics.median(times),
+            'min': min(times),
+            'max': max(times),
+        },
+        'remote_calls': statistics.mean(calls),
+        'remote_calls_by_route': call_counts,
+        'bytes_received': bytes_received,
+        'queries': statistics.mean(queries),
+        'peak_memory': peak_memory,
+    }
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the Docker facing model methods and views against a '
+            'local fake Docker Engine API and reports wall time, remote '
+            'calls, queries and peak memory as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', type=int, default=3,
+                            help='Number of simulated nodes')
+        parser.add_argument('--containers', type=int, default=10,
+                            help='Containers running on each node')
+        parser.add_argument('--services', type=int, default=5,
+                            help='Number of simulated services')
+        parser.add_argument('--latency', type=float, default=0.005,
+                            help='Seconds each fake Docker call takes')
+        parser.add_argument('--stats-wait', type=float, default=0.0,
+                            help='Extra seconds each stats call that is not '
+                                 'one-shot takes, dockerd waits about 1')
+        parser.add_argument('--iterations', type=int, default=5,
+                            help='Timed runs of each benchmark')
+        parser.add_argument('--benchmark', action='append', dest='names',
+                            help='Only run this benchmark (can be repeated)')
+        parser.add_argument('--output', default=None,
+                            help='Write the results to this JSON file')
+        parser.add_argument('--compare', default=None,
+                            help='JSON results of an earlier run to compare '
+                                 'against')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as err:
+                raise CommandError(f'Unable to read {options["compare"]}: '
+                                   f'{err}')
+
+        config = {
+            'nodes': options['nodes'],
+            'containers': options['containers'],
+            'services': options['services'],
+            'latency': options['latency'],
+            'stats_wait': options['stats_wait'],
+            'iterations': options['iterations'],
+        }
+        engine = FakeEngine(nodes=options['nodes'],
+                            containers=options['containers'],
+                            services=options['services'],
+                            latency=options['latency'],
+                            stats_wait=options['stats_wait'])
+
+        results = {}
+        with engine:
+            try:
+                # The fake swarm only exists for the run
+                with transaction.atomic():
+                    swarm = engine.create_swarm(
+                        f'benchmark-{time.time_ns()}')
+                    node = swarm.nodes.order_by('hostname').first()
+
+                    for name, setup, run in benchmarks(swarm, node):
+                        if options['names'] and name not in options['names']:
+                            continue
+                        results[name] = measure(engine, setup, run,
+                                                options['iterations'])
+                        self._report(name, results[name], baseline)
+
+                    raise Rollback()
+            except Rollback:
+                pass
+            finally:
+                clients.registry.clear()
+                health.tracker.clear()
+
+        report = {
+            'revision': _git_revision(),
+            'timestamp': timezone.now().isoformat(),
+            'config': config,
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def _report(self, name, result, baseline):
+        line = (f"{name}: {result['wall_time']['mean'] * 1000:.1f}ms, "
+                f"{result['remote_calls']:g} remote calls, "
+                f"{result['queries']:g} queries, "
+                f"{result['peak_memory'] / 1024:.0f}KiB peak")
+
+        previous = (baseline or {}).get('results', {}).get(name)
+        if previous:
+            change = (result['wall_time']['mean'] /
+                      previous['wall_time']['mean'] - 1) * 100
+            line += (f" ({change:+.0f}% time, "
+                     f"{result['remote_calls'] - previous['remote_calls']:+g} "
+                     f"calls vs {baseline.get('revision') or 'baseline'})")
+
+        self.stderr.write(line)
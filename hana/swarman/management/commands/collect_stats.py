@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from swarman.collector import StatsCollector
+
+
+class Command(BaseCommand):
+    help = ('Keeps streaming docker stats subscriptions open for every '
+            'container on every Node and stores the latest utilization '
+            'samples for the web process to read')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--node', type=int, action='append',
+                            dest='node_ids',
+                            help='Only collect from this Node id '
+                                 '(can be repeated)')
+        parser.add_argument('--refresh-interval', type=float, default=None,
+                            help='Seconds between container list refreshes')
+        parser.add_argument('--flush-interval', type=float, default=None,
+                            help='Seconds between writes to the stats store')
+        parser.add_argument('--history-interval', type=float, default=None,
+                            help='Seconds between utilization history '
+                                 'samples, 0 to disable history')
+
+    def handle(self, *args, **options):
+        collector = StatsCollector(
+            refresh_interval=options['refresh_interval'],
+            flush_interval=options['flush_interval'],
+            node_ids=options['node_ids'],
+            history_interval=options['history_interval'])
+
+        self.stdout.write('Collecting container stats, press CTRL+C to stop')
+        try:
+            collector.run()
+        except KeyboardInterrupt:
+            collector.stop()
+            for node_collector in collector.collectors.values():
+                node_collector.close()
+
+        self.stdout.write('Stats collection stopped')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from swarman.events import EventListener
+
+
+class Command(BaseCommand):
+    help = ('Follows the Docker event streams of every Swarm and Node, '
+            'keeping Node and Service rows and cached swarm listings up to '
+            'date as changes happen')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--swarm', type=int, action='append',
+                            dest='swarm_ids',
+                            help='Only listen to this Swarm id '
+                                 '(can be repeated)')
+        parser.add_argument('--refresh-interval', type=float, default=None,
+                            help='Seconds between re-reading the Swarm and '
+                                 'Node tables')
+
+    def handle(self, *args, **options):
+        listener = EventListener(
+            refresh_interval=options['refresh_interval'],
+            swarm_ids=options['swarm_ids'])
+
+        self.stdout.write('Listening for Docker events, press CTRL+C to stop')
+        try:
+            listener.run()
+        except KeyboardInterrupt:
+            listener.stop()
+            listener.close()
+
+        self.stdout.write('Event listener stopped')
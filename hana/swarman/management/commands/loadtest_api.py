@@ -0,0 +1,257 @@
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import (
+    WSGIRequestHandler,
+    WSGIServer,
+    make_server,
+)
+
+import requests
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import close_old_connections
+from django.urls import reverse
+
+from swarman import clients
+from swarman.fake_engine import FakeEngine
+
+
+def endpoints(swarm, node, service_id):
+    '''Returns the API endpoints to load as (url name, method, path, body)'''
+    return [
+        ('api-swarm-list', 'GET', reverse('swarman:api-swarm-list'), None),
+        ('api-swarm-detail', 'GET',
+         reverse('swarman:api-swarm-detail', args=[swarm.id]), None),
+        ('api-node-list', 'GET',
+         reverse('swarman:api-node-list', args=[swarm.id]), None),
+        ('api-node-list-state', 'GET',
+         reverse('swarman:api-node-list', args=[swarm.id]) + '?state=true',
+         None),
+        ('api-node-utilization', 'GET',
+         reverse('swarman:api-node-utilization', args=[node.id]), None),
+        ('api-swarm-utilization', 'GET',
+         reverse('swarman:api-swarm-utilization', args=[swarm.id]), None),
+        ('api-service-scale', 'POST', reverse('swarman:api-service-scale'),
+         {'swarm_id': swarm.id, 'service_id': service_id, 'replicas': 2}),
+    ]
+
+
+def percentile(ordered, fraction):
+    '''Returns the nearest rank percentile of a sorted list'''
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def load(url, method, body, concurrency, duration):
+    '''
+    Sends requests from concurrency clients, each waiting for its response
+    before sending the next, for duration seconds. Returns a report with
+    throughput and latency percentiles in milliseconds.
+    '''
+    stop_at = time.monotonic() + duration
+
+    def client(_):
+        results = []
+        with requests.Session() as session:
+            while time.monotonic() < stop_at:
+                start = time.perf_counter()
+                try:
+                    response = session.request(method, url, json=body,
+                                               timeout=120)
+                    ok = response.status_code < 400
+                except requests.RequestException:
+                    ok = False
+                results.append((time.perf_counter() - start, ok))
+        return results
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [result for client_results in executor.map(
+            client, range(concurrency)) for result in client_results]
+    elapsed = time.monotonic() - start
+
+    latencies = sorted(latency * 1000 for latency, ok in results if ok)
+    report = {
+        'requests': len(results),
+        'errors': len(results) - len(latencies),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0,
+    }
+    if latencies:
+        report.update({
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+        })
+
+    return report
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ClosingApplication:
+    '''Closes the database connections of each wsgiref worker thread'''
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        try:
+            return self.application(environ, start_response)
+        finally:
+            close_old_connections()
+
+
+def serve_wsgi(host, port):
+    '''Serves hana.wsgi in a thread. Returns (base url, stop).'''
+    from hana.wsgi import application
+
+    server = make_server(host, port, ClosingApplication(application),
+                         server_class=ThreadingWSGIServer,
+                         handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+
+    return f'http://{host}:{server.server_address[1]}', stop
+
+
+def serve_asgi(host, port):
+    '''Serves hana.asgi with uvicorn in a thread. Returns (base url, stop).'''
+    try:
+        import uvicorn
+    except ImportError:
+        raise CommandError('--server asgi needs uvicorn, install it or run '
+                           'uvicorn yourself and pass --url')
+    from hana.asgi import application
+
+    if not port:
+        raise CommandError('--server asgi needs a --port')
+    server = uvicorn.Server(uvicorn.Config(application, host=host, port=port,
+                                           log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise CommandError(f'Unable to serve on {host}:{port}')
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+
+    return f'http://{host}:{port}', stop
+
+
+class Command(BaseCommand):
+    help = ('Load tests the REST API with concurrent clients against a swarm '
+            'simulated by a local fake Docker Engine API and reports '
+            'throughput and p50/p95/p99 latency per endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['wsgi', 'asgi'],
+                            default='wsgi',
+                            help='Entry point to serve the API from in this '
+                                 'process (asgi needs uvicorn)')
+        parser.add_argument('--url', default=None,
+                            help='Load an already running server instead, '
+                                 'ex: http://127.0.0.1:8000. It must use '
+                                 'the same database.')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=0,
+                            help='Port to serve on, 0 lets the wsgi server '
+                                 'pick a free one')
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help='Only load this endpoint (can be repeated)')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Number of concurrent clients')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Seconds to load each endpoint for')
+        parser.add_argument('--nodes', type=int, default=3,
+                            help='Number of simulated nodes')
+        parser.add_argument('--containers', type=int, default=10,
+                            help='Containers running on each node')
+        parser.add_argument('--latency', type=float, default=0.005,
+                            help='Seconds each fake Docker call takes')
+        parser.add_argument('--output', default=None,
+                            help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['duration'] <= 0:
+            raise CommandError('--concurrency and --duration must be '
+                               'positive')
+
+        engine = FakeEngine(nodes=options['nodes'],
+                            containers=options['containers'],
+                            latency=options['latency'])
+        results = {}
+        with engine:
+            # The server reads the fake swarm from the database, so it is
+            # committed for the run and deleted afterwards
+            swarm = engine.create_swarm(f'loadtest-{time.time_ns()}')
+            stop = None
+            try:
+                if options['url']:
+                    base_url = options['url'].rstrip('/')
+                elif options['server'] == 'asgi':
+                    base_url, stop = serve_asgi(options['host'],
+                                                options['port'])
+                else:
+                    base_url, stop = serve_wsgi(options['host'],
+                                                options['port'])
+
+                node = swarm.nodes.order_by('hostname').first()
+                for name, method, path, body in endpoints(
+                        swarm, node, engine.services[0]['ID']):
+                    if options['endpoints'] and \
+                            name not in options['endpoints']:
+                        continue
+                    results[name] = load(f'{base_url}{path}', method, body,
+                                         options['concurrency'],
+                                         options['duration'])
+                    self._report(name, results[name])
+            finally:
+                if stop is not None:
+                    stop()
+                swarm.delete()
+                clients.registry.clear()
+
+        report = {
+            'server': options['url'] or options['server'],
+            'config': {
+                'concurrency': options['concurrency'],
+                'duration': options['duration'],
+                'nodes': options['nodes'],
+                'containers': options['containers'],
+                'latency': options['latency'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _report(self, name, result):
+        line = (f"{name}: {result['throughput']:.1f} req/s, "
+                f"{result['requests']} requests, {result['errors']} errors")
+        if 'p50' in result:
+            line += (f", p50 {result['p50']:.1f}ms, p95 {result['p95']:.1f}ms"
+                     f", p99 {result['p99']:.1f}ms")
+        self.stdout.write(line)
@@ -0,0 +1,54 @@
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from swarman.models import (
+    NodeConflict,
+    Swarm,
+)
+
+
+class Command(BaseCommand):
+    help = ('Syncs every Node of each Swarm from one node listing, adding '
+            'nodes that joined and removing nodes that left')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--swarm', type=int, action='append',
+                            dest='swarm_ids',
+                            help='Only sync this Swarm id (can be repeated)')
+
+    def handle(self, *args, **options):
+        swarms = Swarm.objects.all()
+        if options['swarm_ids']:
+            swarms = swarms.filter(id__in=options['swarm_ids'])
+
+        failed = []
+        for swarm in swarms:
+            try:
+                report = swarm.sync_nodes()
+            except NodeConflict as err:
+                failed.append(swarm.swarm_name)
+                self.stderr.write(f'{swarm.swarm_name}: {err}')
+                continue
+            if report == "Error":
+                failed.append(swarm.swarm_name)
+                self.stderr.write(f'{swarm.swarm_name}: no manager could be '
+                                  f'reached')
+                continue
+
+            self.stdout.write(
+                f"{swarm.swarm_name}: {len(report['created'])} added, "
+                f"{len(report['updated'])} updated, "
+                f"{len(report['removed'])} removed, "
+                f"{report['unchanged']} unchanged")
+            for hostname in report['created']:
+                self.stdout.write(f'  + {hostname}')
+            for node in report['updated']:
+                self.stdout.write(f"  ~ {node['hostname']}: "
+                                  f"{', '.join(node['fields'])}")
+            for hostname in report['removed']:
+                self.stdout.write(f'  - {hostname}')
+
+        if failed:
+            raise CommandError(f'Unable to sync {", ".join(failed)}')
@@ -0,0 +1,35 @@
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from swarman.models import Swarm
+
+
+class Command(BaseCommand):
+    help = ('Pulls every service of each Swarm in one call and syncs the '
+            'Service and Mounts tables')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--swarm', type=int, action='append',
+                            dest='swarm_ids',
+                            help='Only sync this Swarm id (can be repeated)')
+
+    def handle(self, *args, **options):
+        swarms = Swarm.objects.all()
+        if options['swarm_ids']:
+            swarms = swarms.filter(id__in=options['swarm_ids'])
+
+        failed = []
+        for swarm in swarms:
+            result = swarm.sync_services()
+            if result == "Error":
+                failed.append(swarm.swarm_name)
+                self.stderr.write(f'{swarm.swarm_name}: no manager could be '
+                                  f'reached')
+            else:
+                self.stdout.write(f'{swarm.swarm_name}: {result} services '
+                                  f'synced')
+
+        if failed:
+            raise CommandError(f'Unable to sync {", ".join(failed)}')
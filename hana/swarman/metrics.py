@@ -0,0 +1,284 @@
+"""
+Prometheus metrics, served at /metrics in the text exposition format.
+
+Scrapes are answered from data HANA already keeps, so they cost (almost)
+nothing on the swarm:
+
+- node and container CPU/memory come from the samples stored by the
+  collect_stats collector (stats_store.py); nodes without fresh samples are
+  left out rather than polled
+- node state and availability come from the swarm's node listing, cached by
+  the event listener (swarm_cache.py) or, without one, fetched at most once
+  every SWARMAN_METRICS_MAX_AGE seconds per swarm
+- service replicas come from the Service table
+- Docker call latencies are counted by the shared clients as calls are made
+- request deadline counts come from deadlines.stats()
+
+Docker call histograms and deadline counts are kept per process, so with several web workers
+each scrape reports the calls of the worker that answered it.
+"""
+import bisect
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import (
+    deadlines,
+    stats_store,
+    utilization,
+)
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds, in seconds, of the Docker call latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def max_age():
+    '''Returns the seconds a swarm's node listing is reused for by scrapes'''
+    return getattr(settings, 'SWARMAN_METRICS_MAX_AGE', 15)
+
+
+class LatencyHistogram:
+    '''Cumulative latency histogram and error count of calls per target'''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._targets = {}
+        self._lock = threading.Lock()
+
+    def observe(self, target, seconds, error=False):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._targets.get(target)
+            if entry is None:
+                entry = self._targets[target] = {
+                    'counts': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                    'errors': 0,
+                }
+            entry['counts'][index] += 1
+            entry['sum'] += seconds
+            entry['errors'] += bool(error)
+
+    def snapshot(self):
+        '''
+        Returns, per target, the cumulative count of each bucket (ending with
+        +Inf), the sum of latencies and the error count
+        '''
+        with self._lock:
+            targets = {target: (list(entry['counts']), entry['sum'],
+                                entry['errors'])
+                       for target, entry in self._targets.items()}
+
+        snapshot = {}
+        for target, (counts, total, errors) in targets.items():
+            cumulative, running = [], 0
+            for count in counts:
+                running += count
+                cumulative.append(running)
+            snapshot[target] = {'buckets': cumulative, 'sum': total,
+                                'errors': errors}
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._targets.clear()
+
+
+docker_latency = LatencyHistogram()
+
+
+def observe_call(target, seconds, error=False):
+    '''Counts a Docker call made to target (an endpoint base url)'''
+    docker_latency.observe(target, seconds, error)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _sample(name, value, **labels):
+    if labels:
+        label_text = ','.join(f'{key}="{_escape(label)}"'
+                              for key, label in labels.items())
+        return f'{name}{{{label_text}}} {value}'
+    return f'{name} {value}'
+
+
+class Exposition:
+    '''Builds a text exposition, one metric family at a time'''
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, metric_type, help_text):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {metric_type}')
+
+    def sample(self, name, value, **labels):
+        self.lines.append(_sample(name, value, **labels))
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _node_states(swarm):
+    '''
+    Returns the swarm's NodeSnapshots keyed by node ID and hostname, or
+    None if no manager answered. Listings are shared by scrapes for
+    max_age() seconds.
+    '''
+    key = f'swarman:metrics:swarm:{swarm.id}:nodes'
+    states = cache.get(key)
+    if states is None:
+        states = swarm.get_node_states()
+        if states in ("Error", "Unknown"):
+            states = {}
+        cache.set(key, states, timeout=max_age())
+
+    return states or None
+
+
+def collect():
+    '''Returns the current metrics in the Prometheus text format'''
+    from .models import (
+        Service,
+        Swarm,
+    )
+
+    exposition = Exposition()
+    swarms = list(Swarm.objects.prefetch_related('nodes'))
+
+    reachable, node_states, node_availability = [], [], []
+    node_usage, container_usage = [], []
+    for swarm in swarms:
+        states = _node_states(swarm)
+        reachable.append((swarm, states is not None))
+
+        for node in swarm.nodes.all():
+            labels = {'swarm': swarm.swarm_name, 'node': node.hostname}
+            node_data = (states or {}).get(node.node_id) or \
+                (states or {}).get(node.hostname)
+            if node_data is not None:
+                node_states.append((labels, node_data.state))
+                node_availability.append((labels, node_data.availability))
+
+            samples = stats_store.latest_node_samples(node.id)
+            if samples is None:
+                continue
+            for sample in samples:
+                container_usage.append((dict(labels, container=sample[
+                    'name'].lstrip('/')), sample['cpu'], sample['memory']))
+            node_usage.append((labels, *utilization.totals(samples)))
+
+    exposition.family('hana_swarm_reachable', 'gauge',
+                      'Whether a manager of the swarm answered the last '
+                      'node listing')
+    for swarm, up in reachable:
+        exposition.sample('hana_swarm_reachable', int(up),
+                          swarm=swarm.swarm_name)
+
+    exposition.family('hana_node_state', 'gauge',
+                      'Swarm state of the node, 1 for the current state')
+    for labels, state in node_states:
+        exposition.sample('hana_node_state', 1, state=state, **labels)
+
+    exposition.family('hana_node_availability', 'gauge',
+                      'Availability of the node, 1 for the current '
+                      'availability')
+    for labels, availability in node_availability:
+        exposition.sample('hana_node_availability', 1,
+                          availability=availability, **labels)
+
+    exposition.family('hana_node_cpu_percent', 'gauge',
+                      'CPU used by the containers on the node, in percent')
+    for labels, cpu, _ in node_usage:
+        exposition.sample('hana_node_cpu_percent', round(cpu, 4), **labels)
+
+    exposition.family('hana_node_memory_percent', 'gauge',
+                      'Memory used by the containers on the node, in percent')
+    for labels, _, memory in node_usage:
+        exposition.sample('hana_node_memory_percent', round(memory, 4),
+                          **labels)
+
+    exposition.family('hana_container_cpu_percent', 'gauge',
+                      'CPU used by the container, in percent')
+    for labels, cpu, _ in container_usage:
+        exposition.sample('hana_container_cpu_percent', round(cpu, 4),
+                          **labels)
+
+    exposition.family('hana_container_memory_percent', 'gauge',
+                      'Memory used by the container, in percent of its limit')
+    for labels, _, memory in container_usage:
+        exposition.sample('hana_container_memory_percent', round(memory, 4),
+                          **labels)
+
+    services = list(Service.objects.select_related('swarm'))
+    exposition.family('hana_service_desired_replicas', 'gauge',
+                      'Tasks the service should be running')
+    for service in services:
+        if service.desired_tasks is not None:
+            exposition.sample('hana_service_desired_replicas',
+                              service.desired_tasks,
+                              swarm=service.swarm.swarm_name,
+                              service=service.service_name)
+
+    exposition.family('hana_service_running_replicas', 'gauge',
+                      'Tasks of the service that are running')
+    for service in services:
+        if service.running_tasks is not None:
+            exposition.sample('hana_service_running_replicas',
+                              service.running_tasks,
+                              swarm=service.swarm.swarm_name,
+                              service=service.service_name)
+
+    latencies = docker_latency.snapshot()
+    exposition.family('hana_docker_request_duration_seconds', 'histogram',
+                      'Latency of Docker Engine API calls made by this '
+                      'process')
+    for target, histogram in latencies.items():
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+        for bound, count in zip(bounds, histogram['buckets']):
+            exposition.sample('hana_docker_request_duration_seconds_bucket',
+                              count, target=target, le=bound)
+        exposition.sample('hana_docker_request_duration_seconds_sum',
+                          histogram['sum'], target=target)
+        exposition.sample('hana_docker_request_duration_seconds_count',
+                          histogram['buckets'][-1], target=target)
+
+    exposition.family('hana_docker_request_errors_total', 'counter',
+                      'Docker Engine API calls made by this process that '
+                      'failed or returned an error status')
+    for target, histogram in latencies.items():
+        exposition.sample('hana_docker_request_errors_total',
+                          histogram['errors'], target=target)
+
+    # Requests served without a name are reported under an empty endpoint
+    deadline_stats = {name or '': counts
+                      for name, counts in deadlines.stats().items()}
+    exposition.family('hana_request_deadline_requests_total', 'counter',
+                      'Requests served by this process with a Docker call '
+                      'deadline')
+    for endpoint, counts in deadline_stats.items():
+        exposition.sample('hana_request_deadline_requests_total',
+                          counts['requests'], endpoint=endpoint)
+
+    exposition.family('hana_request_deadline_exhausted_total', 'counter',
+                      'Requests served by this process that ran out of '
+                      'their Docker call deadline')
+    for endpoint, counts in deadline_stats.items():
+        exposition.sample('hana_request_deadline_exhausted_total',
+                          counts['exhausted'], endpoint=endpoint)
+
+    exposition.family('hana_request_deadline_skipped_calls_total', 'counter',
+                      'Docker calls this process skipped because their '
+                      'request deadline was spent')
+    for endpoint, counts in deadline_stats.items():
+        exposition.sample('hana_request_deadline_skipped_calls_total',
+                          counts['skipped_calls'], endpoint=endpoint)
+
+    return exposition.render()
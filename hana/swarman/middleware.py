@@ -0,0 +1,84 @@
+import asyncio
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import (
+    Resolver404,
+    resolve,
+)
+from django.utils.decorators import sync_and_async_middleware
+
+from . import (
+    deadlines,
+    profiling,
+)
+
+
+def _url_name(request):
+    try:
+        return resolve(request.path_info).url_name
+    except Resolver404:
+        return None
+
+
+def _request_deadline(request):
+    '''Returns the URL name and configured deadline of a request'''
+    url_name = _url_name(request)
+    if url_name is None:
+        return None, None
+
+    return url_name, deadlines.endpoint_deadline(url_name)
+
+
+@sync_and_async_middleware
+def DeadlineMiddleware(get_response):
+    '''
+    Serves each request under the Docker call deadline configured for its
+    URL name (see deadlines.py)
+    '''
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            url_name, seconds = _request_deadline(request)
+            if seconds is None:
+                return await get_response(request)
+
+            with deadlines.deadline(seconds, url_name):
+                return await get_response(request)
+
+    else:
+        def middleware(request):
+            url_name, seconds = _request_deadline(request)
+            if seconds is None:
+                return get_response(request)
+
+            with deadlines.deadline(seconds, url_name):
+                return get_response(request)
+
+    return middleware
+
+
+@sync_and_async_middleware
+def ProfilingMiddleware(get_response):
+    '''
+    Records the Docker calls and queries of each request and reports them in
+    a Server-Timing header (see profiling.py). Only used when
+    SWARMAN_PROFILING is enabled.
+    '''
+    if not profiling.enabled():
+        raise MiddlewareNotUsed()
+    profiling.instrument_queries()
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with profiling.profile(_url_name(request)) as current:
+                response = await get_response(request)
+            response['Server-Timing'] = current.server_timing()
+            return response
+
+    else:
+        def middleware(request):
+            with profiling.profile(_url_name(request)) as current:
+                response = get_response(request)
+            response['Server-Timing'] = current.server_timing()
+            return response
+
+    return middleware
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swarman', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UtilizationSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(choices=[(0, 'Raw'), (60, '1 Minute'), (3600, '1 Hour')], default=0)),
+                ('timestamp', models.DateTimeField()),
+                ('cpu', models.FloatField()),
+                ('memory', models.FloatField()),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='utilization_samples', to='swarman.node')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='utilizationsample',
+            constraint=models.UniqueConstraint(fields=('node', 'resolution', 'timestamp'), name='unique_node_sample'),
+        ),
+    ]
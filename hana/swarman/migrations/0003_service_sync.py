@@ -0,0 +1,42 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swarman', '0002_utilizationsample'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='desired_tasks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='running_tasks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='swarm',
+            name='services_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='service',
+            name='published_port',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='service',
+            name='target_port',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='service',
+            constraint=models.UniqueConstraint(fields=('swarm', 'service_id'), name='unique_swarm_service'),
+        ),
+    ]
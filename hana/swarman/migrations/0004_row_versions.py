@@ -0,0 +1,23 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swarman', '0003_service_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='swarm',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.4 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+def forget_unsynced_counts(apps, schema_editor):
+    # Services of swarms never synced from a listing with status only hold
+    # the old default of 0
+    Service = apps.get_model('swarman', 'Service')
+    Service.objects.filter(swarm__services_synced_at=None).update(
+        running_tasks=None, desired_tasks=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swarman', '0004_row_versions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='service',
+            name='desired_tasks',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='service',
+            name='running_tasks',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(forget_unsynced_counts,
+                             migrations.RunPython.noop),
+    ]
@@ -1,13 +1,73 @@
 from tempfile import TemporaryFile
 from unittest import result
-from django.db import models
+import time
+from datetime import timedelta
+
+from django.db import (
+    models,
+    transaction,
+)
+from django.utils import timezone
 from django.utils.html import format_html
 
-import requests
-import docker
+from . import (
+    clients,
+    deadlines,
+    health,
+    snapshots,
+    stats_store,
+    swarm_cache,
+    utilization,
+    utils,
+)
+from .snapshots import (
+    NodeSnapshot,
+    ServiceSnapshot,
+)
+
+
+class NodeConflict(Exception):
+    '''
+    Raised when a node listing holds a node (matched by node ID or ip
+    address) that is already tracked by another swarm
+    '''
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        super().__init__('Nodes tracked by another swarm: ' + ', '.join(
+            f'{node.hostname} ({node.swarm.swarm_name})' for node in nodes))
 
 
 # Create your models here.
+def index_node_states(node_list):
+    '''
+    Returns a dictionary of NodeSnapshots keyed by both node ID and hostname
+    for a node listing from a manager
+    '''
+    states = {}
+    for node in snapshots.nodes(node_list):
+        states[node.id] = node
+        states[node.hostname] = node
+
+    return states
+
+
+class SwarmQuerySet(models.QuerySet):
+
+    def with_counts(self):
+        '''
+        Annotates every swarm with its num_nodes, num_managers and num_workers,
+        counted by the database in the same query
+        '''
+        return self.annotate(
+            num_nodes=models.Count('nodes'),
+            num_managers=models.Count(
+                'nodes', filter=models.Q(nodes__role='Manager')),
+            num_workers=models.Count(
+                'nodes', filter=models.Q(nodes__role='Worker')),
+        )
+
+
 class Swarm(models.Model):
     """
     Swarm Model is for multiple swarm management. This is a feature that may be 
@@ -17,6 +77,12 @@ class Swarm(models.Model):
     manager_join_token = models.CharField(
         max_length=200, blank=True, null=True)
     worker_join_token = models.CharField(max_length=200, blank=True, null=True)
+    services_synced_at = models.DateTimeField(blank=True, null=True)
+    # Row version for conditional API requests. Writes that bypass save()
+    # (bulk_update, save(update_fields=...)) must set it themselves.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SwarmQuerySet.as_manager()
 
     def __str__(self):
 
@@ -42,51 +108,360 @@ class Swarm(models.Model):
         '''Returns a QuerySet with all worker nodes assigned to a Swarm'''
         return self.nodes.filter(role='Worker').all()
 
+    # The counts below use the annotations of Swarm.objects.with_counts()
+    # when the swarm was loaded with them, and a COUNT query otherwise
+
     @property
     def node_count(self):
         '''Returns a count of all nodes assigned to a swarm'''
-        return len(self.nodes.all())
+        if hasattr(self, 'num_nodes'):
+            return self.num_nodes
+        return self.nodes.count()
 
     @property
     def manager_count(self):
         '''Returns a count of all manager nodes assigned to a swarm'''
-        return len(self.manager_nodes())
+        if hasattr(self, 'num_managers'):
+            return self.num_managers
+        return self.manager_nodes().count()
 
     def worker_count(self):
         '''Returns a count of all worker nodes assigned to a swarm'''
-        return len(self.worker_nodes())
+        if hasattr(self, 'num_workers'):
+            return self.num_workers
+        return self.worker_nodes().count()
 
     def manager_ip_list(self):
-        '''Return a list of Manager Addresses'''
+        '''
+        Return a list of Manager Addresses, ordered fastest healthy manager
+        first (see health.py)
+        '''
         managers = self.manager_nodes()
         addresses = []
         for manager in managers:
             addresses.append(f'{manager.ip_address}:{manager.api_port}')
 
-        return addresses
+        return health.order_addresses(addresses)
 
     def get_services(self):
         '''
-        Return a list of services running on a swarm
+        Return a list of ServiceSnapshots of the services running on a swarm
         '''
+        cached = swarm_cache.get(self.id, swarm_cache.SERVICES)
+        if cached is not None:
+            return snapshots.services(cached)
+        generation = swarm_cache.generation(self.id, swarm_cache.SERVICES)
+
         for ip_address in self.manager_ip_list():
             try:
-                url = f'http://{ip_address}/services?status=true'
-                response = requests.get(url)
+                client = clients.get_client(f'tcp://{ip_address}')
+                services = snapshots.services(client.api.get_json(
+                    '/services', params={'status': True}))
 
-                if response.status_code == 200:
-                    service_list = response.json
-                    services = []
+                swarm_cache.save(self.id, swarm_cache.SERVICES, services,
+                                 generation)
+                return services
+            except:
+                pass
+
+        return "Error"
 
-                    for service in service_list():
-                        services.append(service)
 
-                    return services
-            except:
+    def get_node_states(self):
+        '''
+        Lists every node in the swarm with a single call to a manager.
+        Returns a dictionary of NodeSnapshots keyed by both node ID and
+        hostname, or "Error" if no manager could be reached.
+        '''
+        node_list = swarm_cache.get(self.id, swarm_cache.NODES)
+        if node_list is not None:
+            return index_node_states(node_list)
+        generation = swarm_cache.generation(self.id, swarm_cache.NODES)
+
+        for address in self.manager_ip_list():
+            try:
+                client = clients.get_client(f'tcp://{address}')
+                node_list = snapshots.nodes(client.api.nodes())
+            except Exception:
+                continue
+
+            swarm_cache.save(self.id, swarm_cache.NODES, node_list,
+                             generation)
+            return index_node_states(node_list)
+
+        return "Unknown" if deadlines.exceeded() else "Error"
+
+    def nodes_with_state(self, nodes=None, states=None):
+        '''
+        Returns a list of the swarm's nodes (or the given Node queryset)
+        with their node information already attached from one node listing,
+        so get_status and get_availability make no further remote calls.
+        states can be passed in when the listing was already fetched.
+        '''
+        if nodes is None:
+            nodes = self.nodes.order_by('hostname')
+        nodes = list(nodes)
+        if not nodes:
+            return nodes
+
+        if states is None:
+            states = self.get_node_states()
+        for node in nodes:
+            if states in ("Error", "Unknown"):
+                node.set_node_info(states)
+            else:
+                node.set_node_info(states.get(node.node_id) or
+                                   states.get(node.hostname, "Error"))
+
+        return nodes
+
+    def utilization(self, deadline=None, top_containers=5):
+        '''
+        Polls every node in the swarm at the same time for CPU and memory
+        utilization. Nodes that do not answer within deadline seconds or
+        cannot be reached are marked instead of blocking the poll. Returns a
+        dictionary with per node (and per container) utilization, the
+        top_containers containers using the most CPU across the swarm and
+        swarm totals.
+        '''
+        nodes = utils.collect_node_utilization(
+            self.nodes.order_by('hostname'), deadline)
+
+        total_cpu_load, total_memory_load = utils.total_utilization(
+            [node for node in nodes if node['status'] == 'ok'])
+
+        containers = [dict(container, node=node['hostname'])
+                      for node in nodes for container in node['containers']]
+
+        return {
+            'swarm_id': self.id,
+            'swarm_name': self.swarm_name,
+            'nodes': nodes,
+            'top_containers': utilization.top_consumers(
+                containers, top_containers),
+            'totals': {
+                'cpu': utilization.round2(total_cpu_load),
+                'memory': utilization.round2(total_memory_load),
+                'nodes_reporting': len(
+                    [node for node in nodes if node['status'] == 'ok']),
+                'node_count': len(nodes),
+            },
+        }
+
+    def import_nodes(self, node_list, join_tokens=None):
+        '''
+        Upserts a manager's node listing into the Node table in one
+        transaction. Nodes are matched by node_id, or by ip address for rows
+        that have none; new nodes are inserted in bulk and changed nodes are
+        updated in bulk. Also stores join_tokens when given. Returns the
+        number of nodes created and updated. Raises NodeConflict, without
+        changing anything, when a node is tracked by another swarm.
+        '''
+        with transaction.atomic():
+            created, updated = self._upsert_nodes(node_list)
+
+            if join_tokens is not None:
+                self.manager_join_token = join_tokens['Manager']
+                self.worker_join_token = join_tokens['Worker']
+                self.save(update_fields=['manager_join_token',
+                                         'worker_join_token', 'updated_at'])
+
+        return len(created), len(updated)
+
+    def sync_nodes(self, node_list=None):
+        '''
+        Syncs every Node of the swarm from one node listing (fetched from the
+        first manager that answers unless node_list is given) in one
+        transaction: changed nodes are updated with a single bulk_update,
+        nodes that joined are created and nodes that left are deleted.
+        Returns a report of the created, updated (with the changed fields)
+        and removed nodes, or "Error" if no manager could be reached. Raises
+        NodeConflict, without changing anything, when a node is tracked by
+        another swarm.
+        '''
+        if node_list is None:
+            node_list = self._list_nodes()
+        if node_list == "Error":
+            return "Error"
+        node_list = snapshots.nodes(node_list)
+
+        with transaction.atomic():
+            created, updated = self._upsert_nodes(node_list)
+            left = list(self.nodes.exclude(node_id='').exclude(
+                node_id__in=[node_data.id for node_data in node_list],
+            ).values_list('id', 'hostname'))
+            if left:
+                Node.objects.filter(
+                    id__in=[node_id for node_id, _ in left]).delete()
+            removed = [hostname for _, hostname in left]
+
+        swarm_cache.invalidate(self.id, swarm_cache.NODES)
+
+        return {
+            'created': [node.hostname for node in created],
+            'updated': [{'hostname': node.hostname, 'fields': fields}
+                        for node, fields in updated],
+            'removed': removed,
+            'unchanged': len(node_list) - len(created) - len(updated),
+        }
+
+    def _list_nodes(self):
+        '''Returns the node listing of the first manager that answers'''
+        for address in self.manager_ip_list():
+            try:
+                client = clients.get_client(f'tcp://{address}')
+                return client.api.nodes()
+            except Exception:
                 pass
 
         return "Error"
 
+    def _upsert_nodes(self, node_list):
+        '''
+        Inserts and updates Node rows for a node listing in bulk. Returns the
+        created nodes and a list of (node, changed fields) for updated ones.
+        Only the swarm's own nodes, and nodes that left a swarm (see
+        Node.leave_swarm), are matched. A node of another swarm sharing a
+        node ID or ip address (ip addresses are unique) raises NodeConflict
+        rather than being moved into this swarm.
+        '''
+        node_list = snapshots.nodes(node_list)
+        matches = models.Q(
+            node_id__in=[node_data.id for node_data in node_list if
+                         node_data.id]) | \
+            models.Q(ip_address__in=[node_data.address
+                                     for node_data in node_list if
+                                     node_data.address])
+        existing = list(Node.objects.filter(matches).select_related('swarm'))
+        conflicts = [node for node in existing
+                     if node.swarm_id not in (self.id, None)]
+        if conflicts:
+            raise NodeConflict(conflicts)
+        by_node_id = {node.node_id: node for node in existing}
+        by_address = {node.ip_address: node for node in existing}
+
+        created, updated = [], []
+        for node_data in node_list:
+            node = by_node_id.get(node_data.id) or \
+                by_address.get(node_data.address)
+            if node is None:
+                node = Node(api_port='2375')
+                created.append(node)
+                before = None
+            else:
+                before = node.import_values()
+
+            node.swarm = self
+            node.hostname = node_data.hostname
+            node.ip_address = node_data.address
+            node.docker_version_index = str(node_data.version_index)
+            node.apply_node_data(node_data)
+            if before is not None:
+                changed = [field for field, old, new in zip(
+                    Node.IMPORT_FIELDS, before, node.import_values())
+                    if old != new]
+                if changed:
+                    updated.append((node, changed))
+
+        now = timezone.now()
+        for node, _ in updated:
+            node.updated_at = now
+        Node.objects.bulk_create(created)
+        Node.objects.bulk_update([node for node, _ in updated],
+                                 Node.IMPORT_FIELDS + ['updated_at'])
+        # Bulk operations send no model signals (see signals.py)
+        if created or updated:
+            swarm_cache.invalidate_swarm_list()
+
+        return created, updated
+
+    @property
+    def services_stale(self):
+        '''
+        Returns whether the Service table of the swarm is older than
+        SWARMAN_SERVICES_MAX_AGE seconds (or was never synced)
+        '''
+        if self.services_synced_at is None:
+            return True
+
+        return timezone.now() - self.services_synced_at > timedelta(
+            seconds=utils.services_max_age())
+
+    def sync_services(self, service_list=None):
+        '''
+        Pulls every service of the swarm in one call (or uses service_list)
+        and upserts the Service and Mounts rows in one transaction, deleting
+        services that no longer exist. Returns the number of services, or
+        "Error" if no manager could be reached.
+        '''
+        if service_list is None:
+            service_list = self.get_services()
+        if service_list == "Error":
+            return "Error"
+        service_list = snapshots.services(service_list)
+
+        with transaction.atomic():
+            existing = {service.service_id: service
+                        for service in self.service_set.all()}
+            existing_mounts = {}
+            for mount in Mounts.objects.filter(service__swarm=self):
+                existing_mounts.setdefault(mount.service_id, []).append(
+                    (mount.mount_type, mount.mount_src, mount.mount_target))
+
+            created, updated, mounts = [], [], {}
+            for service_data in service_list:
+                service = existing.pop(service_data.id, None)
+                if service is None:
+                    service = Service(swarm=self)
+                    service.apply_service_data(service_data)
+                    created.append(service)
+                else:
+                    before = service.sync_values()
+                    service.apply_service_data(service_data)
+                    if service.sync_values() != before:
+                        updated.append(service)
+                mounts[service.service_id] = list(service_data.mounts)
+
+            Service.objects.bulk_create(created)
+            Service.objects.bulk_update(updated, Service.SYNC_FIELDS)
+            Service.objects.filter(
+                id__in=[service.id for service in existing.values()]).delete()
+
+            # Mounts are replaced only for services whose mounts changed
+            ids = dict(self.service_set.values_list('service_id', 'id'))
+            replaced = [ids[service_id] for service_id, service_mounts_list
+                        in mounts.items()
+                        if sorted(existing_mounts.get(ids[service_id], [])) !=
+                        sorted(service_mounts_list)]
+            Mounts.objects.filter(service_id__in=replaced).delete()
+            Mounts.objects.bulk_create([
+                Mounts(service_id=ids[service_id], mount_type=mount_type,
+                       mount_src=mount_src, mount_target=mount_target)
+                for service_id, service_mounts_list in mounts.items()
+                if ids[service_id] in replaced
+                for mount_type, mount_src, mount_target in service_mounts_list
+            ])
+
+            self.services_synced_at = timezone.now()
+            Swarm.objects.filter(id=self.id).update(
+                services_synced_at=self.services_synced_at)
+
+        return len(service_list)
+
+    def service_summaries(self, sync=True):
+        '''
+        Returns the dashboard summary of every service in the Service table,
+        syncing the table first when it is stale (unless sync is False).
+        Falls back to the last synced rows when no manager answers. Returns
+        "Error" if the table has never been synced.
+        '''
+        if sync and self.services_stale:
+            self.sync_services()
+        if self.services_synced_at is None:
+            return "Error"
+
+        return [service.summary()
+                for service in self.service_set.order_by('service_name')]
 
     @property
     def services_count(self):
@@ -97,27 +472,34 @@ class Swarm(models.Model):
 
     def get_service_data(self, service_id):
         '''
-        Return the attrs dict of a service item
+        Return a ServiceSnapshot of a service, asking each manager in turn
         '''
         for address in self.manager_ip_list():
-            client = docker.DockerClient(base_url=f"tcp://{address}")
-            service = client.services.get(service_id)
-            client.close()
-            return service.attrs
-
+            try:
+                client = clients.get_client(f"tcp://{address}")
+                service = client.services.get(service_id)
+                return ServiceSnapshot.from_api(service.attrs)
+            except Exception:
+                continue
 
         return "Error retrieving service information"
 
     def get_service_tasks(self, service_id):
         '''
-        Return running tasks assinged to a service
+        Return TaskSnapshots of the running tasks assinged to a service,
+        asking each manager in turn. Returns "Error" if no manager could be
+        reached.
         '''
         for address in self.manager_ip_list():
-            client = docker.DockerClient(base_url=f'tcp://{address}')
-            service = client.services.get(service_id)
-            client.close
-            return service.tasks({'desired-state':'running'})
-            
+            try:
+                client = clients.get_client(f'tcp://{address}')
+                service = client.services.get(service_id)
+                return snapshots.tasks(
+                    service.tasks({'desired-state': 'running'}))
+            except Exception:
+                continue
+
+        return "Error"
 
 
 class Node(models.Model):
@@ -138,6 +520,13 @@ class Node(models.Model):
     cpu_count = models.IntegerField(default=0)
     os = models.CharField(max_length=32, default="Unknown")
     docker_engine = models.CharField(max_length=16, default="Unknown")
+    # Row version for conditional API requests, see Swarm.updated_at
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Fields written when importing a node listing (see Swarm.import_nodes)
+    IMPORT_FIELDS = ['swarm', 'hostname', 'ip_address', 'docker_version_index',
+                     'role', 'node_architecture', 'node_id', 'total_memory',
+                     'cpu_count', 'os', 'docker_engine']
 
     def __str__(self):
         return self.hostname
@@ -158,7 +547,7 @@ class Node(models.Model):
             # Go to the next manager in the list
             for address in self.swarm.manager_ip_list():
 
-                client = docker.DockerClient(base_url=f'tcp://{address}')
+                client = clients.get_client(f'tcp://{address}')
 
                 node = client.nodes.get(self.hostname)
                 # post Request to swarm to promote Manager
@@ -170,7 +559,7 @@ class Node(models.Model):
                 if node.update(node_spec):
                     self.role = "Manager"
                     self.save()
-                    client.close()
+                    self.clear_node_info()
                     return True
 
             return False
@@ -189,7 +578,7 @@ class Node(models.Model):
             # Attempt to update, if communication fails,
             # Go to the next manager in the list
             for address in self.swarm.manager_ip_list():
-                client = docker.DockerClient(base_url=f'tcp://{address}')
+                client = clients.get_client(f'tcp://{address}')
 
                 node = client.nodes.get(self.hostname)
                 # post Request to swarm to promote Manager
@@ -201,29 +590,92 @@ class Node(models.Model):
                 if node.update(node_spec):
                     self.role = "Worker"
                     self.save()
-                    client.close()
+                    self.clear_node_info()
                     return True
 
             return False
 
     def get_node_info(self):
         '''
-            Returns a JSON object with node information from Docker API   
+            Returns a NodeSnapshot with node information from Docker API.
+            The result is kept on this Node instance for
+            SWARMAN_NODE_INFO_TTL seconds so every property that needs node
+            information while rendering a page shares one remote call.
         '''
+        cached = getattr(self, '_node_info', None)
+        if cached is not None and \
+                time.monotonic() - cached[0] < utils.node_info_ttl():
+            return cached[1]
+
+        node_data = self._fetch_node_info()
+        self.set_node_info(node_data)
+
+        return node_data
+
+    def apply_node_data(self, node_data):
+        '''
+            Copies role, architecture, id, memory, cpu, os and engine version
+            from a NodeSnapshot onto this Node. Does not save.
+        '''
+        # role
+        self.role = node_data.role.title()
+        # node_architecture
+        self.node_architecture = node_data.architecture
+        # node_id
+        self.node_id = node_data.id
+        # total_memory
+        self.total_memory = node_data.memory_bytes/(10**9)
+        # cpu_count
+        self.cpu_count = node_data.nano_cpus/(10**9)
+        # os
+        self.os = node_data.os
+        # docker_engine
+        self.docker_engine = node_data.engine_version
+
+    def import_values(self):
+        '''Returns the values of IMPORT_FIELDS, used to detect changes'''
+        return tuple(getattr(self, 'swarm_id' if field == 'swarm' else field)
+                     for field in self.IMPORT_FIELDS)
+
+    def set_node_info(self, node_data):
+        '''
+            Stores node information fetched elsewhere (ex: a swarm wide node
+            listing) so get_node_info does not need to fetch it
+        '''
+        self._node_info = (time.monotonic(), node_data)
+
+    def clear_node_info(self):
+        '''
+            Forgets the node information cached by get_node_info
+        '''
+        self._node_info = None
+
+    def _fetch_node_info(self):
+        '''
+            Inspects the node on the first manager that answers, or reads it
+            from the swarm's node listing while an event listener keeps it
+            fresh
+        '''
+        node_list = swarm_cache.get(self.swarm_id, swarm_cache.NODES)
+        if node_list is not None:
+            states = index_node_states(node_list)
+            node_data = states.get(self.node_id) or states.get(self.hostname)
+            if node_data is not None:
+                return node_data
 
         for address in self.swarm.manager_ip_list():
 
             try:
-                client = docker.DockerClient(base_url=f'tcp://{address}')
+                client = clients.get_client(f'tcp://{address}')
 
-                node_data = client.nodes.get(self.hostname).attrs
-                client.close()
-                return node_data
+                return NodeSnapshot.from_api(
+                    client.nodes.get(self.hostname).attrs)
 
             except Exception as err:
                 pass
 
-        return 'Error'
+        # Running out of time says nothing about the node itself
+        return 'Unknown' if deadlines.exceeded() else 'Error'
 
     @property
     def get_cpu_load(self):
@@ -231,31 +683,16 @@ class Node(models.Model):
             Calculate the current CPU load on the node, returns value as a
             percentage Returns float
         '''
+        total_cpu_load, _ = utils.total_utilization(self.container_samples())
 
-        client = docker.DockerClient(
-            base_url=f'tcp://{self.ip_address}:{self.api_port}')
-        total_cpu_load = 0
-
-        for container in client.containers.list():
-
-            container_info = container.stats(stream=False)
-            cpu_delta = container_info['cpu_stats']['cpu_usage']['total_usage'] - \
-                container_info['precpu_stats']['cpu_usage']['total_usage']
-            system_cpu_delta = container_info['cpu_stats']['system_cpu_usage'] - \
-                container_info['precpu_stats']['system_cpu_usage']
-            number_cpus = container_info['cpu_stats']['online_cpus']
-            cpu_usage = (cpu_delta / system_cpu_delta) * number_cpus * 100.0
-            total_cpu_load += cpu_usage
-
-        client.close()
-        return float(format(total_cpu_load, '.2f'))
+        return utilization.round2(total_cpu_load)
 
     def get_container_info(self, container_id):
         '''
             Get the container info from a node
         '''
-        client = docker.DockerClient(
-            base_url=f'tcp://{self.ip_address}:{self.api_port}')
+        client = clients.get_client(
+            f'tcp://{self.ip_address}:{self.api_port}')
 
         return client.services.get(container_id).attrs
 
@@ -265,87 +702,92 @@ class Node(models.Model):
             Calculate Memory Usage on a Node, returns memory usage as percentage
             Returns Float
         '''
-        client = docker.DockerClient(
-            base_url=f'tcp://{self.ip_address}:{self.api_port}')
+        _, total_memory_load = utils.total_utilization(
+            self.container_samples())
 
-        total_memory_load = 0
-        # Loop through all containers returned in container JSON
-        # and calculate memory usage
-        for container in client.containers.list():
+        return utilization.round2(total_memory_load)
 
-            container_info = container.stats(stream=False)
+    def container_samples(self, max_workers=None, timeout=None):
+        '''
+            Polls every running container on the node for CPU and memory
+            usage. Up to max_workers containers are polled at the same time
+            and each stats call is given timeout seconds before it is marked
+            as an error. Returns a list of dictionaries with container name,
+            cpu and memory utilization (unrounded). Containers are taken
+            from the summary listing, without inspecting each one.
+        '''
+        if max_workers is None:
+            max_workers = utils.stats_max_workers()
+        if timeout is None:
+            timeout = utils.stats_timeout()
 
-            used_memory = container_info['memory_stats']['usage']
-            available_memory = container_info['memory_stats']['limit']
-            memory_usage = (used_memory / available_memory) * 100.0
-            total_memory_load += memory_usage
+        client = clients.get_client(
+            f'tcp://{self.ip_address}:{self.api_port}')
+        with clients.request_timeout(timeout):
+            containers = client.containers.list(sparse=True)
 
-        client.close()
-        return float(format(total_memory_load, '.2f'))
+        return utils.collect_container_utilization(
+            containers, max_workers, timeout, node_id=self.id)
 
     @property
     def get_status(self):
 
         #return 'ready'
         result = self.get_node_info()
-        if result == "Error":
+        if result in ("Error", "Unknown"):
             return result
 
-        return result['Status']['State']
+        return result.state
 
     @property
     def get_availability(self):
 
         #return 'active'
         result = self.get_node_info()
-        if result == "Error":
+        if result in ("Error", "Unknown"):
             return result
 
-        return result['Spec']['Availability']
+        return result.availability
 
     @property
     def utilization(self):
         """
         Calculates the total CPU and memory utalization by services on the 
-        node as a percentage. Returns a Tuple: 
+        node as a percentage. Containers that fail to report stats are left
+        out of the totals. Returns a Tuple: 
         (cpu_utilization, memory_utilization)
         """
-        client = docker.DockerClient(
-            base_url=f'tcp://{self.ip_address}:{self.api_port}')
-
-        total_memory_load = 0
-        total_cpu_load = 0
-        # Loop through all containers returned in container JSON
-        # and calculate memory and cpu usage
-
-        for container in client.containers.list():
-
-            container_info = container.stats(stream=False)
-            # Calculate Memory Usage per container
-            used_memory = container_info['memory_stats']['usage']
-            available_memory = container_info['memory_stats']['limit']
-            memory_usage = (used_memory / available_memory) * 100.0
-
-            total_memory_load += memory_usage
-
-            # Calculate CPU Usage per container
-            cpu_delta = container_info['cpu_stats']['cpu_usage']['total_usage'] - \
-                container_info['precpu_stats']['cpu_usage']['total_usage']
-            system_cpu_delta = container_info['cpu_stats']['system_cpu_usage'] - \
-                container_info['precpu_stats']['system_cpu_usage']
-            number_cpus = container_info['cpu_stats']['online_cpus']
-            cpu_usage = (cpu_delta / system_cpu_delta) * number_cpus * 100.0
-            total_cpu_load += cpu_usage
-
-        client.close()
-        utilization = (float(format(total_cpu_load, '.2f')),
-                       float(format(total_memory_load, '.2f')))
-        return utilization
+        total_cpu_load, total_memory_load = utils.total_utilization(
+            self.container_samples())
+
+        return (utilization.round2(total_cpu_load),
+                utilization.round2(total_memory_load))
+
+    def latest_utilization(self):
+        """
+        Returns the latest per container utilization stored by the
+        collect_stats background collector, in the same format as
+        utilization_per_container. Returns None if the collector has no
+        recent samples for the node.
+        """
+        samples = stats_store.latest_node_samples(self.id)
+        if samples is None:
+            return None
+
+        return utilization.rounded([
+            {'name': sample['name'], 'cpu': sample['cpu'],
+             'memory': sample['memory']}
+            for sample in samples])
 
     @property
     def utilization_display(self):
         try:
-            result = self.utilization
+            result = self.latest_utilization()
+            if result is None:
+                result = self.utilization
+            else:
+                result = tuple(utilization.round2(total)
+                               for total in utils.total_utilization(result))
 
             return format_html("{}<br>{}",
                                f"CPU: {result[0]}%",
@@ -354,8 +796,8 @@ class Node(models.Model):
             return "Error retreiving node utilization stats"
 
     def leave_swarm(self):
-        client = docker.DockerClient(
-            base_url=f"tcp://{self.ip_address}:{self.api_port}")
+        client = clients.get_client(
+            f"tcp://{self.ip_address}:{self.api_port}")
 
         if client.swarm.leave():
             self.swarm = None
@@ -365,43 +807,50 @@ class Node(models.Model):
 
         return False
 
-    def utilization_per_container(self):
+    def utilization_per_container(self, max_workers=None, timeout=None):
         """
         Calculates the total CPU and memory utalization by containers on the 
         node as a percentage. Returns a list of dictionaries with container 
-        name, cpu, and memory utilization
+        name, cpu, and memory utilization. Containers that could not be
+        polled have cpu and memory set to None and an 'error' key.
         """
-        client = docker.DockerClient(
-            base_url=f'tcp://{self.ip_address}:{self.api_port}')
-
-        # Loop through all containers returned in container JSON
-        # and calculate memory and cpu usage
-        utilization_data = []
-        for container in client.containers.list():
-            container_utilization = {}
-            container_info = container.stats(stream=False)
-            container_utilization['name'] = container.attrs['Name']
-
-            # Calculate Memory Usage per container
-            used_memory = container_info['memory_stats']['usage']
-            available_memory = container_info['memory_stats']['limit']
-            memory_usage = (used_memory / available_memory) * 100.0
-            container_utilization['memory'] = float(
-                format(memory_usage, '.2f'))
-
-            # Calculate CPU Usage per container
-            cpu_delta = container_info['cpu_stats']['cpu_usage']['total_usage'] - \
-                container_info['precpu_stats']['cpu_usage']['total_usage']
-            system_cpu_delta = container_info['cpu_stats']['system_cpu_usage'] - \
-                container_info['precpu_stats']['system_cpu_usage']
-            number_cpus = container_info['cpu_stats']['online_cpus']
-            cpu_usage = (cpu_delta / system_cpu_delta) * number_cpus * 100.0
-            container_utilization['cpu'] = float(format(cpu_usage, '.2f'))
-            utilization_data.append(container_utilization)
-
-        client.close()
-
-        return utilization_data
+        return utilization.rounded(
+            self.container_samples(max_workers, timeout))
+
+
+class UtilizationSample(models.Model):
+    """
+    Total CPU and memory utilization of a Node at a point in time. Raw
+    samples are written by the collect_stats collector and rolled up into
+    1 minute and 1 hour averages (see history.py) so old data can be pruned
+    without losing long term trends.
+    """
+    RAW = 0
+    MINUTE = 60
+    HOUR = 3600
+    RESOLUTION_CHOICES = (
+        (RAW, 'Raw'),
+        (MINUTE, '1 Minute'),
+        (HOUR, '1 Hour'),
+    )
+
+    node = models.ForeignKey(
+        Node, on_delete=models.CASCADE, related_name="utilization_samples")
+    resolution = models.PositiveIntegerField(
+        choices=RESOLUTION_CHOICES, default=RAW)
+    timestamp = models.DateTimeField()
+    cpu = models.FloatField()
+    memory = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['node', 'resolution', 'timestamp'],
+                name='unique_node_sample'),
+        ]
+
+    def __str__(self):
+        return f'{self.node} - {self.timestamp}'
 
 
 class Service(models.Model):
@@ -409,11 +858,70 @@ class Service(models.Model):
     service_name = models.CharField(max_length=64)
     service_id = models.CharField(max_length=64)
     swarm = models.ForeignKey(Swarm, on_delete=models.CASCADE)
-    target_port = models.IntegerField()
-    published_port = models.IntegerField()
+    target_port = models.IntegerField(blank=True, null=True)
+    published_port = models.IntegerField(blank=True, null=True)
     desired_replicas = models.IntegerField()
     image_name = models.CharField(max_length=64)
     status = models.CharField(max_length=64)
+    # Task counts only come with service listings requested with status,
+    # None until one has been synced
+    running_tasks = models.IntegerField(blank=True, null=True)
+    desired_tasks = models.IntegerField(blank=True, null=True)
+
+    # Fields written by apply_service_data
+    SYNC_FIELDS = ['service_name', 'image_name', 'desired_replicas',
+                   'target_port', 'published_port', 'status',
+                   'running_tasks', 'desired_tasks']
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['swarm', 'service_id'],
+                                    name='unique_swarm_service'),
+        ]
+
+    def __str__(self):
+        return self.service_name
+
+    def sync_values(self):
+        '''Returns the values of SYNC_FIELDS, used to detect changes'''
+        return tuple(getattr(self, field) for field in self.SYNC_FIELDS)
+
+    def summary(self):
+        '''
+        Returns the fields of the service shown on the swarm dashboard
+        '''
+        return {
+            'name': self.service_name,
+            'ID': self.service_id,
+            'image': self.image_name,
+            'replicas': self.desired_replicas,
+            'desired_tasks': self.desired_tasks,
+            'running_tasks': self.running_tasks,
+            'target_port': self.target_port,
+            'published_port': self.published_port,
+        }
+
+    def apply_service_data(self, service_data):
+        '''
+        Copies name, id, image, replicas, ports and status from a
+        ServiceSnapshot onto this Service. Does not save.
+        '''
+        self.service_name = service_data.name
+        self.service_id = service_data.id
+        self.image_name = service_data.image[:64]
+        self.desired_replicas = service_data.replicas or 0
+        self.target_port = service_data.target_port
+        self.published_port = service_data.published_port
+
+        # Only service listings requested with status include task counts
+        if service_data.running_tasks is not None:
+            self.running_tasks = service_data.running_tasks
+            self.desired_tasks = service_data.desired_tasks
+
+        if service_data.replicas == 0:
+            self.status = "paused"
+        else:
+            self.status = "running"
 
     def pause(self):
         """
@@ -421,11 +929,10 @@ class Service(models.Model):
         """
         for address in self.swarm.manager_ip_list():
             try:
-                client = docker.DockerClient(base_url=f'tcp://{address}')
+                client = clients.get_client(f'tcp://{address}')
                 service = client.services.get(self.service_id)
 
                 if service.scale(0):
-                    client.close()
                     self.status = "paused"
                     self.save()
                     return True
@@ -440,7 +947,7 @@ class Service(models.Model):
         """
         for address in self.swarm.manager_ip_list():
             try:
-                client = docker.DockerClient(base_url=f'tcp://{address}')
+                client = clients.get_client(f'tcp://{address}')
                 service = client.services.get(self.service_id)
 
                 if service.scale(self.desired_replics):
@@ -458,7 +965,7 @@ class Service(models.Model):
         """
         for address in self.swarm.manager_ip_list():
             try:
-                client = docker.DockerClient(base_url=f'tcp://{address}')
+                client = clients.get_client(f'tcp://{address}')
                 service = client.services.get(self.service_id)
 
                 if service.scale(replicas):
@@ -0,0 +1,232 @@
+"""
+Per request profiling of Docker calls and database queries.
+
+When SWARMAN_PROFILING is enabled, ProfilingMiddleware (see middleware.py)
+records every Docker Engine call made by the shared clients while serving a
+request (endpoint, target, latency, response size and errors) and every ORM
+query. The totals are added to the response as Server-Timing headers, shown
+by the browser's developer tools, and the last SWARMAN_PROFILING_HISTORY
+requests are kept for summary(), served at api/docker/profile.
+
+With profiling disabled the middleware removes itself and the clients only
+look up an unset context variable per call.
+"""
+import contextvars
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+_profile = contextvars.ContextVar('swarman_profile', default=None)
+
+# Docker API paths are summarised with their ids replaced, so calls to every
+# container or service of a kind add up
+_VERSION_PREFIX = re.compile(r'^/v[0-9.]+(?=/)')
+_ID_SEGMENT = re.compile(r'/(?=[^/]*\d)[0-9a-zA-Z_.-]{12,}(?=/|$)')
+
+
+def enabled():
+    return getattr(settings, 'SWARMAN_PROFILING', False)
+
+
+def history_size():
+    '''Returns the number of recent requests summary() covers'''
+    return getattr(settings, 'SWARMAN_PROFILING_HISTORY', 500)
+
+
+def docker_path(path):
+    '''Returns a Docker API path without its version prefix and ids'''
+    path = _VERSION_PREFIX.sub('', path.split('?', 1)[0])
+    return _ID_SEGMENT.sub('/{id}', path)
+
+
+class RequestProfile:
+    '''The Docker calls and queries made while serving one request'''
+
+    def __init__(self, name=None):
+        self.name = name
+        self.started = time.monotonic()
+        self.duration = None
+        self.calls = []
+        self.queries = 0
+        self.query_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_call(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.query_time += seconds
+
+    @property
+    def docker_time(self):
+        return sum(call['latency'] for call in self.calls)
+
+    def server_timing(self):
+        '''
+        Returns the Server-Timing header value: the total, database and
+        Docker time, and the Docker time spent on each target
+        '''
+        entries = [
+            f'total;dur={self.duration * 1000:.1f}',
+            f'db;dur={self.query_time * 1000:.1f};'
+            f'desc="{self.queries} queries"',
+            f'docker;dur={self.docker_time * 1000:.1f};'
+            f'desc="{len(self.calls)} calls"',
+        ]
+        targets = {}
+        for call in self.calls:
+            target = targets.setdefault(call['target'], [0, 0.0])
+            target[0] += 1
+            target[1] += call['latency']
+        for index, (target, (calls, latency)) in enumerate(targets.items()):
+            entries.append(f'docker-{index};dur={latency * 1000:.1f};'
+                           f'desc="{target} ({calls} calls)"')
+
+        return ', '.join(entries)
+
+
+def record_call(target, method, path, seconds, size=None, error=None):
+    '''
+    Records a Docker call against the request being profiled, if any.
+    target is the endpoint base url and path the Engine API path.
+    '''
+    current = _profile.get()
+    if current is None:
+        return
+
+    current.add_call({
+        'target': target,
+        'endpoint': f'{method} {docker_path(path)}',
+        'latency': seconds,
+        'bytes': int(size) if size is not None else None,
+        'error': error,
+    })
+
+
+def _query_wrapper(execute, sql, params, many, context):
+    current = _profile.get()
+    if current is None:
+        return execute(sql, params, many, context)
+
+    start = time.monotonic()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        current.add_query(time.monotonic() - start)
+
+
+def _instrument_connection(sender, connection, **kwargs):
+    if _query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_wrapper)
+
+
+def instrument_queries():
+    '''
+    Counts the queries of profiled requests on every database connection,
+    including those opened by sync_to_async and thread pool workers
+    '''
+    connection_created.connect(_instrument_connection,
+                               dispatch_uid='swarman_profiling')
+
+    from django.db import connections
+    for connection in connections.all():
+        if connection.connection is not None:
+            _instrument_connection(None, connection)
+
+
+_history = deque()
+_history_lock = threading.Lock()
+
+
+@contextmanager
+def profile(name=None):
+    '''
+    Profiles the Docker calls and queries made in the current thread (or
+    task) for the duration of the with block and adds the result to the
+    history summarised by summary()
+    '''
+    current = RequestProfile(name)
+    token = _profile.set(current)
+    try:
+        yield current
+    finally:
+        _profile.reset(token)
+        current.duration = time.monotonic() - current.started
+        with _history_lock:
+            _history.append(current)
+            while len(_history) > history_size():
+                _history.popleft()
+
+
+def current_profile():
+    return _profile.get()
+
+
+def clear():
+    with _history_lock:
+        _history.clear()
+
+
+def summary():
+    '''
+    Summarises the recent profiled requests per URL name (requests, mean and
+    max duration, Docker calls and queries) and the Docker calls they made
+    per endpoint and target (calls, errors, mean and max latency and bytes)
+    '''
+    with _history_lock:
+        profiles = list(_history)
+
+    requests = {}
+    docker = {}
+    for request_profile in profiles:
+        entry = requests.setdefault(request_profile.name, {
+            'requests': 0, 'total_time': 0.0, 'max_time': 0.0,
+            'docker_calls': 0, 'docker_time': 0.0, 'queries': 0,
+        })
+        entry['requests'] += 1
+        entry['total_time'] += request_profile.duration
+        entry['max_time'] = max(entry['max_time'], request_profile.duration)
+        entry['docker_calls'] += len(request_profile.calls)
+        entry['docker_time'] += request_profile.docker_time
+        entry['queries'] += request_profile.queries
+
+        for call in request_profile.calls:
+            key = f"{call['endpoint']} {call['target']}"
+            endpoint = docker.setdefault(key, {
+                'endpoint': call['endpoint'], 'target': call['target'],
+                'calls': 0, 'errors': 0, 'total_latency': 0.0,
+                'max_latency': 0.0, 'bytes': 0,
+            })
+            endpoint['calls'] += 1
+            endpoint['errors'] += call['error'] is not None
+            endpoint['total_latency'] += call['latency']
+            endpoint['max_latency'] = max(endpoint['max_latency'],
+                                          call['latency'])
+            endpoint['bytes'] += call['bytes'] or 0
+
+    for entry in requests.values():
+        count = entry['requests']
+        entry['mean_time'] = entry.pop('total_time') / count
+        entry['mean_docker_calls'] = entry.pop('docker_calls') / count
+        entry['mean_docker_time'] = entry.pop('docker_time') / count
+        entry['mean_queries'] = entry.pop('queries') / count
+
+    for endpoint in docker.values():
+        endpoint['mean_latency'] = endpoint.pop('total_latency') / \
+            endpoint['calls']
+
+    return {
+        'requests': {str(name): entry for name, entry in requests.items()},
+        'docker': sorted(docker.values(),
+                         key=lambda endpoint: endpoint['mean_latency'] *
+                         endpoint['calls'], reverse=True),
+    }
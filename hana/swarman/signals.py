@@ -0,0 +1,24 @@
+"""
+Keeps the cached navbar swarm list (see swarm_cache.py) in step with the Swarm
+and Node tables. Bulk operations send no signals, so code that creates or
+updates nodes in bulk drops the cached list itself.
+"""
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+)
+from django.dispatch import receiver
+
+from . import swarm_cache
+from .models import (
+    Node,
+    Swarm,
+)
+
+
+@receiver(post_save, sender=Swarm)
+@receiver(post_delete, sender=Swarm)
+@receiver(post_save, sender=Node)
+@receiver(post_delete, sender=Node)
+def invalidate_swarm_list(sender, **kwargs):
+    swarm_cache.invalidate_swarm_list()
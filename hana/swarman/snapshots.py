@@ -0,0 +1,186 @@
+"""
+Compact snapshots of the Docker objects swarman reads.
+
+Engine API responses carry much more than swarman shows or stores (a node
+inspect is a few KB of JSON, most of it plugin and TLS details). Responses
+are turned into snapshots as soon as they are fetched, so views, the model
+layer and cached listings (see swarm_cache.py) only keep the fields they
+use. Snapshots are NamedTuples: slotted (no per instance __dict__),
+immutable, typed and cheap to pickle.
+
+Usage:
+    from swarman.snapshots import NodeSnapshot
+
+    node = NodeSnapshot.from_api(client.api.inspect_node('node1'))
+    node.state, node.availability
+"""
+from typing import (
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+
+def _node_address(data):
+    '''
+    Returns the IP address of a node from its inspect data. Managers may
+    report 0.0.0.0 as their address, their manager address is used instead.
+    '''
+    address = data.get('Status', {}).get('Addr', '')
+    if address == '0.0.0.0' and data.get('ManagerStatus'):
+        return data['ManagerStatus']['Addr'].split(':')[0]
+
+    return address
+
+
+class NodeSnapshot(NamedTuple):
+    '''A swarm node, from a node listing or inspect'''
+    id: str
+    version_index: int
+    hostname: str
+    role: str
+    availability: str
+    state: str
+    address: str
+    architecture: str
+    os: str
+    memory_bytes: int
+    nano_cpus: int
+    engine_version: str
+
+    @classmethod
+    def from_api(cls, data):
+        spec = data.get('Spec', {})
+        description = data.get('Description', {})
+        platform = description.get('Platform', {})
+        resources = description.get('Resources', {})
+        return cls(
+            id=data.get('ID', ''),
+            version_index=data.get('Version', {}).get('Index', 0),
+            hostname=description.get('Hostname', ''),
+            role=spec.get('Role', ''),
+            availability=spec.get('Availability', ''),
+            state=data.get('Status', {}).get('State', ''),
+            address=_node_address(data),
+            architecture=platform.get('Architecture', ''),
+            os=platform.get('OS', ''),
+            memory_bytes=resources.get('MemoryBytes', 0),
+            nano_cpus=resources.get('NanoCPUs', 0),
+            engine_version=description.get('Engine', {}).get(
+                'EngineVersion', ''),
+        )
+
+
+class ServiceSnapshot(NamedTuple):
+    '''
+    A swarm service, from a service listing or inspect. replicas is None for
+    global services and the task counts are None unless the listing was
+    requested with status.
+    '''
+    id: str
+    name: str
+    image: str
+    replicas: Optional[int]
+    target_port: Optional[int]
+    published_port: Optional[int]
+    mounts: Tuple[Tuple[str, str, str], ...]
+    running_tasks: Optional[int]
+    desired_tasks: Optional[int]
+
+    @classmethod
+    def from_api(cls, data):
+        spec = data['Spec']
+        container_spec = spec['TaskTemplate']['ContainerSpec']
+        replicated = spec.get('Mode', {}).get('Replicated')
+        ports = data.get('Endpoint', {}).get('Ports') or \
+            spec.get('EndpointSpec', {}).get('Ports') or [{}]
+        status = data.get('ServiceStatus', {})
+        return cls(
+            id=data['ID'],
+            name=spec['Name'],
+            # Images are pinned by digest, which is only noise on a page
+            image=container_spec['Image'].split('@')[0],
+            replicas=replicated.get('Replicas', 0)
+            if replicated is not None else None,
+            target_port=ports[0].get('TargetPort'),
+            published_port=ports[0].get('PublishedPort'),
+            mounts=tuple((mount.get('Type', ''), mount.get('Source', ''),
+                          mount.get('Target', ''))
+                         for mount in container_spec.get('Mounts', [])),
+            running_tasks=status.get('RunningTasks'),
+            desired_tasks=status.get('DesiredTasks'),
+        )
+
+
+class TaskSnapshot(NamedTuple):
+    '''A task of a swarm service'''
+    id: str
+    service_id: str
+    node_id: str
+    state: str
+    desired_state: str
+    container_id: str
+
+    @classmethod
+    def from_api(cls, data):
+        status = data.get('Status', {})
+        return cls(
+            id=data['ID'],
+            service_id=data.get('ServiceID', ''),
+            node_id=data.get('NodeID', ''),
+            state=status.get('State', ''),
+            desired_state=data.get('DesiredState', ''),
+            container_id=status.get('ContainerStatus', {}).get(
+                'ContainerID', ''),
+        )
+
+
+class ContainerSnapshot(NamedTuple):
+    '''
+    A container on a node, from the /containers/json summary listing (or an
+    inspect). name keeps the leading slash (ex: /web), as stats samples do.
+    '''
+    id: str
+    name: str
+    image: str
+    state: str
+    status: str
+
+    @classmethod
+    def from_api(cls, data):
+        if 'Names' in data:
+            return cls(id=data['Id'], name=data['Names'][0],
+                       image=data.get('Image', ''),
+                       state=data.get('State', ''),
+                       status=data.get('Status', ''))
+
+        state = data.get('State', {})
+        return cls(id=data['Id'], name=data['Name'],
+                   image=data.get('Config', {}).get('Image', ''),
+                   state=state.get('Status', ''), status='')
+
+
+def _build(snapshot_class, items):
+    # Listings cached before snapshots were introduced are still raw JSON
+    return [item if isinstance(item, snapshot_class)
+            else snapshot_class.from_api(item) for item in items]
+
+
+def nodes(node_list):
+    '''Returns a node listing (JSON or snapshots) as NodeSnapshots'''
+    return _build(NodeSnapshot, node_list)
+
+
+def services(service_list):
+    '''Returns a service listing (JSON or snapshots) as ServiceSnapshots'''
+    return _build(ServiceSnapshot, service_list)
+
+
+def tasks(task_list):
+    '''Returns a task listing (JSON or snapshots) as TaskSnapshots'''
+    return _build(TaskSnapshot, task_list)
+
+
+def containers(container_list):
+    '''Returns a container listing (JSON or snapshots) as ContainerSnapshots'''
+    return _build(ContainerSnapshot, container_list)
@@ -0,0 +1,131 @@
+"""
+Shared store for the latest container utilization samples of each node.
+
+Samples are written by the collect_stats management command and read by the
+web process through the Django cache, so both must be configured with a
+cache backend they share (see CACHES in settings.py).
+
+The cpu_stats of each container's last one-shot stats reading are kept here
+too (see SWARMAN_STATS_ONE_SHOT), so the next reading has something to diff
+against.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def max_sample_age():
+    '''Returns the age in seconds after which a stored sample is ignored'''
+    return getattr(settings, 'SWARMAN_STATS_MAX_AGE', 15)
+
+
+def previous_max_age():
+    '''
+    Returns the seconds a container's last stats reading is kept to diff the
+    next one-shot reading against
+    '''
+    return getattr(settings, 'SWARMAN_STATS_ONE_SHOT_MAX_AGE', 300)
+
+
+def node_key(node_id):
+    '''Returns the cache key holding the samples of a node'''
+    return f'swarman:stats:node:{node_id}'
+
+
+def save_node_samples(node_id, samples):
+    '''
+    Stores the latest per container samples of a node. samples is a list of
+    dictionaries with container id, name, cpu, memory and the timestamp the
+    sample was taken at.
+    '''
+    cache.set(node_key(node_id),
+              {'timestamp': time.time(), 'containers': samples},
+              timeout=max_sample_age() * 4)
+
+
+def latest_node_samples(node_id, max_age=None):
+    '''
+    Returns the latest per container samples of a node, or None if the
+    collector has not stored any within max_age seconds
+    '''
+    if max_age is None:
+        max_age = max_sample_age()
+
+    entry = cache.get(node_key(node_id))
+    if entry is None or time.time() - entry['timestamp'] > max_age:
+        return None
+
+    return [sample for sample in entry['containers']
+            if time.time() - sample['timestamp'] <= max_age]
+
+
+def clear_node_samples(node_id):
+    '''Removes the stored samples of a node'''
+    cache.delete(node_key(node_id))
+
+
+def previous_key(container_id):
+    '''Returns the cache key holding a container's last cpu_stats'''
+    return f'swarman:stats:previous:{container_id}'
+
+
+def previous_cpu_stats(container_ids):
+    '''
+    Returns the cpu_stats of the last stats reading of every container in
+    container_ids that has one, keyed by container id
+    '''
+    keys = {previous_key(container_id): container_id
+            for container_id in container_ids}
+    return {keys[key]: cpu_stats
+            for key, cpu_stats in cache.get_many(list(keys)).items()}
+
+
+def save_cpu_stats(readings):
+    '''
+    Stores the cpu_stats of each container's latest stats reading. readings
+    is a dictionary of container id to cpu_stats.
+    '''
+    if readings:
+        cache.set_many({previous_key(container_id): cpu_stats
+                        for container_id, cpu_stats in readings.items()},
+                       timeout=previous_max_age())
+
+
+def previous_index_key(node_id):
+    '''Returns the cache key listing the containers of a node with readings'''
+    return f'swarman:stats:previous-ids:{node_id}'
+
+
+def forget_vanished(node_id, container_ids):
+    '''
+    Drops the last stats reading of every container of the node that is no
+    longer in container_ids (the node's current listing), and remembers
+    container_ids for the next call. Keeps stopped and removed containers
+    from holding readings when no event listener drops them.
+    '''
+    container_ids = set(container_ids)
+    key = previous_index_key(node_id)
+    vanished = (cache.get(key) or set()) - container_ids
+    if vanished:
+        cache.delete_many([previous_key(container_id)
+                           for container_id in vanished])
+    cache.set(key, container_ids, timeout=previous_max_age())
+
+
+def drop_container(node_id, container_id):
+    '''
+    Removes the stored sample and last stats reading of a container that has
+    stopped
+    '''
+    cache.delete(previous_key(container_id))
+
+    entry = cache.get(node_key(node_id))
+    if entry is None:
+        return
+
+    containers = [sample for sample in entry['containers']
+                  if sample.get('id') != container_id]
+    if len(containers) != len(entry['containers']):
+        entry['containers'] = containers
+        cache.set(node_key(node_id), entry, timeout=max_sample_age() * 4)
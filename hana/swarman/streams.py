@@ -0,0 +1,334 @@
+"""
+Live utilization pushed to browsers over Server-Sent Events.
+
+Every node (or swarm) that has at least one open stream gets a Broadcaster: a
+thread that takes one utilization sample every SWARMAN_STREAM_INTERVAL
+seconds and hands it to all of the streams subscribed to it, so the Docker
+daemon is polled once however many pages are open. Each subscriber holds a
+single frame. A new sample replaces a frame that a slow client has not taken
+yet, so clients that fall behind skip to the latest sample instead of
+building up a backlog. The broadcaster stops once its last subscriber leaves.
+
+Streams are closed after SWARMAN_STREAM_MAX_AGE seconds and the browser
+reconnects. Synchronous streams (event_stream) hold a worker thread for as
+long as they are open, so at most SWARMAN_STREAM_MAX_CLIENTS of them are
+served at once per process (see stream_slots). Under ASGI, async_event_stream
+waits for frames without holding a thread (see swarman/asgi.py).
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds the browser waits before reconnecting a closed stream
+RETRY_MS = 1000
+
+
+def stream_interval():
+    '''Returns the seconds between two samples pushed to a stream'''
+    return getattr(settings, 'SWARMAN_STREAM_INTERVAL', 5)
+
+
+def keepalive_interval():
+    '''
+    Returns the seconds a stream can go without a frame before a keepalive
+    comment is sent, which is also how quickly a closed client is noticed
+    '''
+    return getattr(settings, 'SWARMAN_STREAM_KEEPALIVE', 15)
+
+
+def stream_max_age():
+    '''Returns the seconds a stream stays open before the client reconnects'''
+    return getattr(settings, 'SWARMAN_STREAM_MAX_AGE', 300)
+
+
+def stream_max_clients():
+    '''
+    Returns the number of synchronous streams a process serves at once, or 0
+    for no limit
+    '''
+    return getattr(settings, 'SWARMAN_STREAM_MAX_CLIENTS', 8)
+
+
+class Subscription:
+    '''A subscriber's slot for the latest frame of a Broadcaster'''
+
+    def __init__(self):
+        self._frames = queue.Queue(maxsize=1)
+        self.dropped = 0
+        # (loop, asyncio.Event) of a get_async waiting for a frame
+        self._waiter = None
+
+    def put(self, frame):
+        '''Offers a frame, replacing the previous one if it was not taken'''
+        while True:
+            try:
+                self._frames.put_nowait(frame)
+                break
+            except queue.Full:
+                try:
+                    self._frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+        waiter = self._waiter
+        if waiter is not None:
+            loop, event = waiter
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiting loop has been closed
+                pass
+
+    def get(self, timeout):
+        '''Returns the next frame, or None if none arrives within timeout'''
+        try:
+            return self._frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def get_async(self, timeout):
+        '''
+        Async version of get, waits on the event loop instead of blocking a
+        thread. Only one coroutine may wait on a subscription at a time.
+        '''
+        event = asyncio.Event()
+        self._waiter = (asyncio.get_running_loop(), event)
+        try:
+            # A frame may have been put before the waiter was set
+            frame = self.get(timeout=0)
+            if frame is not None:
+                return frame
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+            return self.get(timeout=0)
+        finally:
+            self._waiter = None
+
+
+class Broadcaster(threading.Thread):
+    '''
+    Calls sample every interval seconds while it has subscribers and fans the
+    result out to each of them. Errors are sent to the subscribers as
+    {'error': message} frames.
+    '''
+
+    def __init__(self, key, sample, interval=None, on_stop=None):
+        super().__init__(daemon=True, name=f'stream-{key}')
+        self.key = key
+        self.sample = sample
+        self.interval = stream_interval() if interval is None else interval
+        self.on_stop = on_stop
+        self.samples = 0
+        self._subscribers = set()
+        self._latest = None
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def subscribe(self):
+        '''
+        Returns a new Subscription, primed with the latest frame so a new
+        client does not wait a full interval for its first one. Returns None
+        once the broadcaster has stopped.
+        '''
+        subscription = Subscription()
+        with self._lock:
+            if self._stopped:
+                return None
+            self._subscribers.add(subscription)
+            if self._latest is not None:
+                subscription.put(self._latest)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            if not self._subscribers:
+                self._wake.set()
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, frame):
+        with self._lock:
+            self._latest = frame
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            subscription.put(frame)
+
+    def run(self):
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    frame = self.sample()
+                except Exception as err:
+                    logger.warning('Unable to sample %s: %s', self.key, err)
+                    frame = {'error': str(err)}
+                self.samples += 1
+                self.publish(frame)
+
+                self._wake.wait(max(0, self.interval -
+                                    (time.monotonic() - started)))
+                if self._stopping():
+                    break
+        finally:
+            close_old_connections()
+            if self.on_stop is not None:
+                self.on_stop(self)
+
+    def _stopping(self):
+        with self._lock:
+            if self._subscribers:
+                self._wake.clear()
+                return False
+            self._stopped = True
+            return True
+
+
+class BroadcasterRegistry:
+    '''Shares one Broadcaster per key between every stream of the process'''
+
+    def __init__(self):
+        self._broadcasters = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, key, sample):
+        '''
+        Subscribes to the broadcaster for key, starting one that calls sample
+        if there is none running. Returns (broadcaster, subscription).
+        '''
+        with self._lock:
+            broadcaster = self._broadcasters.get(key)
+            subscription = None
+            if broadcaster is not None:
+                subscription = broadcaster.subscribe()
+
+            if subscription is None:
+                broadcaster = Broadcaster(key, sample, on_stop=self._remove)
+                subscription = broadcaster.subscribe()
+                self._broadcasters[key] = broadcaster
+                broadcaster.start()
+
+        return broadcaster, subscription
+
+    def _remove(self, broadcaster):
+        with self._lock:
+            if self._broadcasters.get(broadcaster.key) is broadcaster:
+                del self._broadcasters[broadcaster.key]
+
+    def stats(self):
+        '''Returns the subscriber count of every running broadcaster'''
+        with self._lock:
+            broadcasters = list(self._broadcasters.items())
+
+        return {str(key): broadcaster.subscriber_count
+                for key, broadcaster in broadcasters}
+
+
+registry = BroadcasterRegistry()
+
+
+class StreamSlots:
+    '''Counts the synchronous streams open in the process against a limit'''
+
+    def __init__(self):
+        self.open = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, limit=None):
+        '''
+        Takes a slot and returns True, or returns False when limit streams
+        are already open
+        '''
+        if limit is None:
+            limit = stream_max_clients()
+        with self._lock:
+            if limit and self.open >= limit:
+                return False
+            self.open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open = max(0, self.open - 1)
+
+
+stream_slots = StreamSlots()
+
+
+def format_event(data, event='utilization'):
+    '''Encodes data as a Server-Sent Event'''
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def event_stream(key, sample, max_age=None, keepalive=None):
+    '''
+    Yields Server-Sent Events with the samples of the shared broadcaster for
+    key until max_age seconds have passed or the client goes away
+    '''
+    if max_age is None:
+        max_age = stream_max_age()
+    if keepalive is None:
+        keepalive = keepalive_interval()
+
+    broadcaster, subscription = registry.subscribe(key, sample)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        closes = time.monotonic() + max_age
+        while True:
+            remaining = closes - time.monotonic()
+            if remaining <= 0:
+                break
+            frame = subscription.get(min(keepalive, remaining))
+            if frame is None:
+                yield ': keepalive\n\n'
+            else:
+                yield format_event(frame)
+    finally:
+        # Runs when the server closes the response, including when writing to
+        # a client that has gone away fails
+        broadcaster.unsubscribe(subscription)
+
+
+async def async_event_stream(key, sample, max_age=None, keepalive=None):
+    '''
+    Async version of event_stream, for ASGI. Waiting for a frame does not
+    hold a thread, only the broadcaster samples in one.
+    '''
+    if max_age is None:
+        max_age = stream_max_age()
+    if keepalive is None:
+        keepalive = keepalive_interval()
+
+    broadcaster, subscription = registry.subscribe(key, sample)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        closes = time.monotonic() + max_age
+        while True:
+            remaining = closes - time.monotonic()
+            if remaining <= 0:
+                break
+            frame = await subscription.get_async(min(keepalive, remaining))
+            if frame is None:
+                yield ': keepalive\n\n'
+            else:
+                yield format_event(frame)
+    finally:
+        broadcaster.unsubscribe(subscription)
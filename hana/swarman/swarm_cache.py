@@ -0,0 +1,117 @@
+"""
+Shared cache of swarm wide Docker listings (nodes and services), kept fresh
+by the listen_events command.
+
+Listings are only cached while the event listener for the swarm is running,
+since it is what removes them when an event makes them stale. The listener
+marks itself alive with a heartbeat; without one, reads miss and callers ask
+a manager as before. Each invalidation bumps a generation number so a listing
+fetched before an event cannot be stored after it. Listings are stored as
+snapshots (see snapshots.py), not as the raw Engine API JSON.
+
+Like stats_store.py this goes through the Django cache, so the web process
+and the listener must share a cache backend.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+
+NODES = 'nodes'
+SERVICES = 'services'
+
+
+def heartbeat_timeout():
+    '''
+    Returns the seconds a listener heartbeat counts for. Cached listings
+    expire after the same time so a stopped listener cannot leave stale data.
+    '''
+    return getattr(settings, 'SWARMAN_EVENTS_HEARTBEAT_TIMEOUT', 30)
+
+
+def _key(swarm_id, kind):
+    return f'swarman:swarm:{swarm_id}:{kind}'
+
+
+def _generation_key(swarm_id, kind):
+    return f'swarman:swarm:{swarm_id}:{kind}:generation'
+
+
+def _heartbeat_key(swarm_id):
+    return f'swarman:swarm:{swarm_id}:listener'
+
+
+def heartbeat(swarm_id):
+    '''Marks the event listener of a swarm as running'''
+    cache.set(_heartbeat_key(swarm_id), True, timeout=heartbeat_timeout())
+
+
+def stop_listening(swarm_id):
+    '''Marks the event listener of a swarm as stopped and drops its listings'''
+    cache.delete(_heartbeat_key(swarm_id))
+    invalidate(swarm_id, NODES, SERVICES)
+
+
+def listening(swarm_id):
+    '''Returns whether an event listener is keeping the swarm's cache fresh'''
+    return cache.get(_heartbeat_key(swarm_id), False)
+
+
+def generation(swarm_id, kind):
+    '''
+    Returns the current generation of a listing, read before fetching it and
+    passed to save()
+    '''
+    return cache.get(_generation_key(swarm_id, kind), 0)
+
+
+def get(swarm_id, kind):
+    '''Returns a cached listing, or None if there is no fresh one'''
+    if not listening(swarm_id):
+        return None
+
+    return cache.get(_key(swarm_id, kind))
+
+
+def save(swarm_id, kind, listing, fetched_generation):
+    '''
+    Caches a listing fetched at fetched_generation, unless an event has
+    invalidated it since or no listener is running
+    '''
+    if not listening(swarm_id) or \
+            generation(swarm_id, kind) != fetched_generation:
+        return False
+
+    cache.set(_key(swarm_id, kind), listing, timeout=heartbeat_timeout())
+    return True
+
+
+def invalidate(swarm_id, *kinds):
+    '''Drops cached listings that an event has made stale'''
+    for kind in kinds:
+        cache.set(_generation_key(swarm_id, kind),
+                  generation(swarm_id, kind) + 1, timeout=None)
+        cache.delete(_key(swarm_id, kind))
+
+
+# The swarm list shown in the navbar of every page does not depend on Docker,
+# so it is cached until a Swarm or Node row changes (see signals.py) rather
+# than gated by the listener.
+SWARM_LIST_KEY = 'swarman:swarm_list'
+
+
+def get_swarm_list(build):
+    '''
+    Returns the cached navbar swarm list, calling build to make and cache it
+    on a miss
+    '''
+    swarm_list = cache.get(SWARM_LIST_KEY)
+    if swarm_list is None:
+        swarm_list = build()
+        cache.set(SWARM_LIST_KEY, swarm_list, timeout=None)
+
+    return swarm_list
+
+
+def invalidate_swarm_list():
+    '''Drops the cached navbar swarm list after a Swarm or Node change'''
+    cache.delete(SWARM_LIST_KEY)
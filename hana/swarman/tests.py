@@ -1,11 +1,116 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import wait
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import (
+    OperationalError,
+    close_old_connections,
+    connection,
+)
+from django.test import (
+    AsyncRequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
+from . import async_views
+from .api.v1_0 import async_api_views
+from .asgi import StreamingASGIHandler
+from .clients import (
+    ClientRegistry,
+    PooledAPIClient,
+)
+from .collector import (
+    ContainerSubscription,
+    NodeCollector,
+    StatsCollector,
+)
+from .fake_engine import FakeEngine
+from .health import HealthTracker
+from . import (
+    clients,
+    deadlines,
+    events,
+    health,
+    history,
+    metrics,
+    profiling,
+    snapshots,
+    stats_store,
+    streams,
+    swarm_cache,
+    utilization,
+    utils,
+)
 from .models import (
+    NodeConflict,
     Swarm,
     Node,
+    Mounts,
+    Service,
+    UtilizationSample,
+)
+from .snapshots import (
+    NodeSnapshot,
+    ServiceSnapshot,
 )
 
 
+def container_stats(total_usage, system_cpu_usage, memory_usage):
+    '''
+    Builds a minimal container stats response for utilization tests. The
+    counters are deltas from a previous sample at 1000.
+    '''
+    return {
+        'cpu_stats': {
+            'cpu_usage': {'total_usage': 1000 + total_usage},
+            'system_cpu_usage': 1000 + system_cpu_usage,
+            'online_cpus': 2,
+        },
+        'precpu_stats': {
+            'cpu_usage': {'total_usage': 1000},
+            'system_cpu_usage': 1000,
+        },
+        'memory_stats': {'usage': memory_usage, 'limit': 1000},
+    }
+
+
+class FakeContainer:
+    '''
+    Stands in for a docker Container returned by containers.list(sparse=True)
+    '''
+
+    def __init__(self, name, stats=None, error=None):
+        self.id = name.lstrip('/')
+        self.attrs = {'Id': self.id, 'Names': [name]}
+        self.client = mock.MagicMock()
+        self.client.api.get_json.side_effect = self._get_json
+        self._stats = stats
+        self._error = error
+
+    def _get_json(self, path, params=None):
+        if self._error:
+            raise self._error
+        return self._stats
+
+
 # Create your tests here.
 class SwarmModelTests(TestCase):
 
@@ -94,6 +199,9 @@ class NodeModelTests(TestCase):
                                          ip_address="0.0.0.3",
                                          api_port="2375",
                                          role="Worker", swarm=self.swarm)
+        # These tests reach for real daemons, keep their failures out of the
+        # shared manager health
+        self.addCleanup(health.tracker.clear)
 
     def test_node_promote(self):
         '''Test that test_node_promote() will successfully Promote a worker to a manager'''
@@ -106,3 +214,1656 @@ class NodeModelTests(TestCase):
         self.assertEqual(self.node3.demote(), "Node is already a Worker")
         self.assertEqual(self.node1.demote(), "Update Successful")
         self.assertEqual(self.node1.role, "Worker")
+
+
+class NodeUtilizationTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        self.node = Node.objects.create(hostname="testnode1",
+                                        ip_address="0.0.0.0",
+                                        api_port="2375",
+                                        role="Manager", swarm=self.swarm)
+        self.containers = [
+            FakeContainer('/web', container_stats(25, 100, 100)),
+            FakeContainer('/db', container_stats(10, 100, 250)),
+            FakeContainer('/broken', error=TimeoutError('Read timed out')),
+        ]
+        patcher = mock.patch('swarman.models.clients.get_client')
+        self.get_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.get_client.return_value.containers.list.return_value = \
+            self.containers
+
+    def test_utilization_per_container_marks_errors(self):
+        '''Test that a failing container is marked instead of failing the node'''
+        data = self.node.utilization_per_container(max_workers=3)
+
+        self.assertEqual(data[0], {'name': '/web', 'cpu': 50.0, 'memory': 10.0})
+        self.assertEqual(data[1], {'name': '/db', 'cpu': 20.0, 'memory': 25.0})
+        self.assertEqual(data[2]['name'], '/broken')
+        self.assertIsNone(data[2]['cpu'])
+        self.assertIn('Read timed out', data[2]['error'])
+
+    def test_utilization_totals_skip_errors(self):
+        '''Test that utilization totals only include containers that reported stats'''
+        self.assertEqual(self.node.utilization, (70.0, 35.0))
+        self.assertEqual(self.node.get_cpu_load, 70.0)
+        self.assertEqual(self.node.get_memory_usage, 35.0)
+
+    def test_container_samples_uses_node_client(self):
+        '''Test that stats are collected through the shared client for the node'''
+        self.node.container_samples(max_workers=4, timeout=3)
+
+        self.get_client.assert_called_with('tcp://0.0.0.0:2375')
+
+
+class SwarmUtilizationTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        for index, hostname in enumerate(('fast', 'slow', 'down')):
+            Node.objects.create(hostname=hostname,
+                                ip_address=f"0.0.0.{index}",
+                                api_port="2375",
+                                role="Worker", swarm=self.swarm)
+        self.addCleanup(self.wait_for_polls)
+
+    @staticmethod
+    def wait_for_polls():
+        '''Lets polls the tests gave up on finish before the next test'''
+        for future in list(utils._node_polls.values()):
+            wait([future])
+
+    @staticmethod
+    def fake_utilization(node, max_workers=None, timeout=None):
+        if node.hostname == 'slow':
+            time.sleep(1)
+        if node.hostname == 'down':
+            raise ConnectionError('Connection refused')
+        return [{'name': '/web', 'cpu': 12.5, 'memory': 30.0}]
+
+    def test_swarm_utilization_marks_slow_and_unreachable_nodes(self):
+        '''Test that slow and unreachable nodes are marked without blocking the poll'''
+        with mock.patch.object(Node, 'utilization_per_container', autospec=True,
+                               side_effect=self.fake_utilization):
+            start = time.monotonic()
+            data = self.swarm.utilization(deadline=0.2)
+            elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 1)
+        nodes = {node['hostname']: node for node in data['nodes']}
+        self.assertEqual(nodes['down']['status'], 'unreachable')
+        self.assertEqual(nodes['slow']['status'], 'timeout')
+        self.assertEqual(nodes['fast']['status'], 'ok')
+        self.assertEqual(nodes['fast']['cpu'], 12.5)
+        self.assertEqual(data['totals'], {'cpu': 12.5, 'memory': 30.0,
+                                          'nodes_reporting': 1,
+                                          'node_count': 3})
+        self.assertEqual(data['top_containers'],
+                         [{'name': '/web', 'cpu': 12.5, 'memory': 30.0,
+                           'node': 'fast'}])
+
+
+    @override_settings(SWARMAN_SWARM_UTILIZATION_MAX_WORKERS=2)
+    def test_swarm_utilization_bounds_its_threads(self):
+        '''Test that nodes are polled a few at a time on one stats pool'''
+        lock = threading.Lock()
+        running = []
+        peak = []
+        pools = set()
+
+        def fake_utilization(node, max_workers=None, timeout=None):
+            with lock:
+                running.append(node)
+                peak.append(len(running))
+                pools.add(utils._stats_executor.get())
+            time.sleep(0.05)
+            with lock:
+                running.remove(node)
+            return []
+
+        with mock.patch.object(Node, 'utilization_per_container',
+                               autospec=True, side_effect=fake_utilization):
+            data = self.swarm.utilization(deadline=5)
+
+        self.assertEqual([node['status'] for node in data['nodes']],
+                         ['ok', 'ok', 'ok'])
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(len(pools), 1)
+        self.assertIsNotNone(pools.pop())
+
+    def test_swarm_utilization_reuses_running_node_polls(self):
+        '''Test that a node still polled from an earlier poll is not polled again'''
+        with mock.patch.object(Node, 'utilization_per_container', autospec=True,
+                               side_effect=self.fake_utilization) as polled:
+            self.swarm.utilization(deadline=0.2)
+            data = self.swarm.utilization(deadline=0.2)
+            self.wait_for_polls()
+
+        hostnames = [call.args[0].hostname for call in polled.call_args_list]
+        self.assertEqual(hostnames.count('slow'), 1)
+        self.assertEqual(hostnames.count('fast'), 2)
+        nodes = {node['hostname']: node for node in data['nodes']}
+        self.assertEqual(nodes['slow']['status'], 'timeout')
+
+
+class UtilizationMathTests(TestCase):
+
+    def test_percentages_match_docker_formula(self):
+        '''Test that a batch of stats responses is computed in one call'''
+        cpu, memory = utilization.percentages([
+            container_stats(25, 100, 100),
+            container_stats(10, 100, 250),
+        ])
+
+        self.assertEqual(cpu.tolist(), [50.0, 20.0])
+        self.assertEqual(memory.tolist(), [10.0, 25.0])
+
+    def test_zero_system_delta_and_limit(self):
+        '''Test that a zero system cpu delta or memory limit gives 0% instead of raising'''
+        stats = container_stats(25, 0, 100)
+        stats['memory_stats']['limit'] = 0
+
+        self.assertEqual(utils.container_utilization(stats), (0.0, 0.0))
+
+    def test_missing_precpu_stats(self):
+        '''Test that a reading without a previous sample has no CPU value'''
+        stats = container_stats(25, 100, 100)
+        del stats['precpu_stats']
+        one_shot = container_stats(25, 100, 100)
+        one_shot['precpu_stats'] = {'cpu_usage': {'total_usage': 0}}
+
+        self.assertEqual(utils.container_utilization(stats), (None, 10.0))
+        samples = utilization.rounded(utils.container_samples(
+            ['/web', '/db'], [(one_shot, None),
+                              (container_stats(10, 100, 250), None)]))
+        self.assertEqual(samples, [
+            {'name': '/web', 'cpu': None, 'memory': 10.0},
+            {'name': '/db', 'cpu': 20.0, 'memory': 25.0}])
+        self.assertEqual(utilization.totals(samples), (20.0, 35.0))
+
+    def test_online_cpus_fallback(self):
+        '''Test that a reading without online_cpus counts the per CPU counters'''
+        stats = container_stats(25, 100, 100)
+        del stats['cpu_stats']['online_cpus']
+        stats['cpu_stats']['cpu_usage']['percpu_usage'] = [10, 10, 5, 0]
+
+        self.assertEqual(utils.container_utilization(stats), (100.0, 10.0))
+
+    def test_stopped_container_is_marked(self):
+        '''Test that a container reporting no stats is marked as an error'''
+        samples = utils.container_samples(
+            ['/web', '/stopped'],
+            [(container_stats(25, 100, 100), None),
+             ({'cpu_stats': {}, 'memory_stats': {}}, None)])
+
+        self.assertEqual(samples[0], {'name': '/web', 'cpu': 50.0,
+                                      'memory': 10.0})
+        self.assertIsNone(samples[1]['cpu'])
+        self.assertIn('error', samples[1])
+
+    def test_totals_and_top_consumers(self):
+        '''Test that totals skip errors and top consumers are ordered'''
+        samples = [
+            {'name': '/a', 'cpu': 5.0, 'memory': 40.0},
+            {'name': '/b', 'cpu': None, 'memory': None, 'error': 'x'},
+            {'name': '/c', 'cpu': 30.0, 'memory': 1.0},
+            {'name': '/d', 'cpu': 12.0, 'memory': 2.0},
+        ]
+
+        self.assertEqual(utilization.totals(samples), (47.0, 43.0))
+        self.assertEqual(
+            [sample['name']
+             for sample in utilization.top_consumers(samples, 2)],
+            ['/c', '/d'])
+        self.assertEqual(
+            [sample['name'] for sample in utilization.top_consumers(
+                samples, 10, key='memory')],
+            ['/a', '/d', '/c'])
+        self.assertEqual(utilization.top_consumers([], 3), [])
+        self.assertEqual(utilization.totals([]), (0.0, 0.0))
+
+
+class ClientRegistryTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('swarman.clients.PooledDockerClient',
+                             side_effect=lambda **kwargs: mock.MagicMock())
+        self.client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_registry_reuses_clients(self):
+        '''Test that one client is built per endpoint and then reused'''
+        registry = ClientRegistry()
+        client = registry.get('tcp://0.0.0.0:2375')
+
+        self.assertIs(registry.get('tcp://0.0.0.0:2375'), client)
+        self.assertIsNot(registry.get('tcp://0.0.0.1:2375'), client)
+        self.assertEqual(self.client_class.call_count, 2)
+        stats = registry.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['clients']),
+                         (1, 2, 2))
+
+    def test_registry_evicts_least_recently_used(self):
+        '''Test that the registry drops the least recently used client when full'''
+        registry = ClientRegistry(max_clients=2)
+        first = registry.get('tcp://0.0.0.0:2375')
+        registry.get('tcp://0.0.0.1:2375')
+        registry.get('tcp://0.0.0.2:2375')
+
+        first.close.assert_not_called()
+        self.assertEqual(registry.stats()['capacity_evictions'], 1)
+        self.assertIsNot(registry.get('tcp://0.0.0.0:2375'), first)
+
+    def test_registry_evicts_idle_clients(self):
+        '''Test that clients idle past idle_timeout are dropped'''
+        registry = ClientRegistry(idle_timeout=0)
+        first = registry.get('tcp://0.0.0.0:2375')
+        time.sleep(0.01)
+        second = registry.get('tcp://0.0.0.0:2375')
+
+        first.close.assert_not_called()
+        self.assertIsNot(second, first)
+        self.assertEqual(registry.stats()['idle_evictions'], 1)
+
+    def test_registry_replaces_unhealthy_clients(self):
+        '''Test that a client failing its health check is replaced'''
+        registry = ClientRegistry(health_check_interval=0)
+        first = registry.get('tcp://0.0.0.0:2375')
+        first.ping.side_effect = ConnectionError('Connection refused')
+        time.sleep(0.01)
+        second = registry.get('tcp://0.0.0.0:2375')
+
+        self.assertIsNot(second, first)
+        first.close.assert_not_called()
+        self.assertEqual(registry.stats()['health_check_failures'], 1)
+
+    def test_registry_eviction_spares_requests_in_flight(self):
+        '''Test that evicting a client does not close it under a running request'''
+        registry = ClientRegistry(max_clients=1)
+        started, release = threading.Event(), threading.Event()
+        closed = threading.Event()
+        results = []
+
+        first = registry.get('tcp://0.0.0.0:2375')
+        first.close.side_effect = closed.set
+
+        def list_nodes():
+            started.set()
+            release.wait(5)
+            # A closed connection pool would fail the request here
+            return 'closed' if closed.is_set() else 'nodes'
+        first.nodes.list.side_effect = list_nodes
+
+        worker = threading.Thread(target=lambda: results.append(
+            registry.get('tcp://0.0.0.0:2375').nodes.list()))
+        worker.start()
+        started.wait(5)
+        registry.get('tcp://0.0.0.1:2375')
+        release.set()
+        worker.join(5)
+
+        self.assertEqual(registry.stats()['capacity_evictions'], 1)
+        self.assertEqual(results, ['nodes'])
+
+
+class HealthTrackerTests(TestCase):
+
+    def setUp(self):
+        self.tracker = HealthTracker(failure_threshold=2, retry_interval=30)
+        self.addresses = ['10.0.0.1:2375', '10.0.0.2:2375', '10.0.0.3:2375']
+
+    def test_order_prefers_fastest_manager(self):
+        '''Test that healthy managers are ordered by average latency'''
+        self.tracker.record_success('10.0.0.1:2375', 0.5)
+        self.tracker.record_success('10.0.0.2:2375', 0.1)
+        self.tracker.record_success('10.0.0.3:2375', 0.2)
+
+        self.assertEqual(self.tracker.order(self.addresses),
+                         ['10.0.0.2:2375', '10.0.0.3:2375', '10.0.0.1:2375'])
+
+    def test_failing_manager_opens_circuit(self):
+        '''Test that a manager is moved last once it reaches the failure threshold'''
+        self.tracker.record_failure('10.0.0.1:2375')
+        self.assertEqual(self.tracker.order(self.addresses)[0],
+                         '10.0.0.1:2375')
+
+        self.tracker.record_failure('10.0.0.1:2375')
+        self.assertEqual(self.tracker.order(self.addresses)[-1],
+                         '10.0.0.1:2375')
+        self.assertEqual(self.tracker.stats()['10.0.0.1:2375']['state'],
+                         'open')
+
+    def test_open_circuit_is_probed_after_retry_interval(self):
+        '''Test that one caller probes an open manager after the retry interval'''
+        self.tracker.record_success('10.0.0.2:2375', 0.1)
+        self.tracker.record_success('10.0.0.3:2375', 0.2)
+        self.tracker.record_failure('10.0.0.1:2375')
+        self.tracker.record_failure('10.0.0.1:2375')
+
+        with mock.patch('swarman.health.time.monotonic',
+                        return_value=time.monotonic() + 31):
+            self.assertEqual(self.tracker.order(self.addresses)[0],
+                             '10.0.0.1:2375')
+            # Only one probe is handed out at a time
+            self.assertEqual(self.tracker.order(self.addresses)[-1],
+                             '10.0.0.1:2375')
+
+            self.tracker.record_success('10.0.0.1:2375', 0.01)
+            self.assertEqual(self.tracker.order(self.addresses)[0],
+                             '10.0.0.1:2375')
+
+    def test_failed_probe_reopens_circuit(self):
+        '''Test that a single failed probe re-opens the circuit'''
+        self.tracker.record_failure('10.0.0.1:2375')
+        self.tracker.record_failure('10.0.0.1:2375')
+        with mock.patch('swarman.health.time.monotonic',
+                        return_value=time.monotonic() + 31):
+            self.tracker.order(self.addresses)
+            self.tracker.record_failure('10.0.0.1:2375')
+            self.assertEqual(self.tracker.order(self.addresses)[-1],
+                             '10.0.0.1:2375')
+
+    def test_manager_ip_list_orders_by_health(self):
+        '''Test that manager_ip_list returns the healthy manager first'''
+        swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        Node.objects.create(hostname="manager1", ip_address="10.0.0.1",
+                            api_port="2375", role="Manager", swarm=swarm)
+        Node.objects.create(hostname="manager2", ip_address="10.0.0.2",
+                            api_port="2375", role="Manager", swarm=swarm)
+        self.addCleanup(health.tracker.clear)
+        for _ in range(health.tracker.failure_threshold):
+            health.record_failure('http://10.0.0.1:2375')
+
+        self.assertEqual(swarm.manager_ip_list(),
+                         ['10.0.0.2:2375', '10.0.0.1:2375'])
+
+
+class DeadlineTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(deadlines.clear_stats)
+
+    def test_calls_share_the_remaining_budget(self):
+        '''Test that a call gets at most its share of the remaining time'''
+        with deadlines.deadline(10, 'test') as deadline:
+            self.assertAlmostEqual(deadlines.call_timeout(60), 5, places=1)
+            self.assertEqual(deadlines.call_timeout(2), 2)
+            self.assertEqual(deadline.calls, 2)
+
+        self.assertIsNone(deadlines.call_timeout(None))
+
+    def test_exhausted_deadline_skips_calls(self):
+        '''Test that calls fail fast and are counted once the deadline passes'''
+        with self.assertLogs('swarman.deadlines', level='WARNING'):
+            with deadlines.deadline(0, 'test'):
+                with self.assertRaises(deadlines.DeadlineExceeded):
+                    deadlines.call_timeout(60)
+
+        self.assertEqual(deadlines.stats()['test'],
+                         {'requests': 1, 'exhausted': 1, 'skipped_calls': 1})
+
+    def test_pooled_client_timeout_is_bounded(self):
+        '''Test that pooled clients bound connect and read timeouts by the deadline'''
+        client = PooledAPIClient(base_url='tcp://127.0.0.1:2375',
+                                 version='1.41', timeout=60)
+        self.addCleanup(client.close)
+
+        self.assertEqual(client._set_request_timeout({})['timeout'], 60)
+        with deadlines.deadline(4):
+            self.assertLessEqual(client._set_request_timeout({})['timeout'], 2)
+
+    @override_settings(SWARMAN_REQUEST_DEADLINES={'swarm-dashboard': 0})
+    def test_dashboard_shows_unknown_when_deadline_runs_out(self):
+        '''Test that swarm_dashboard degrades to Unknown once its deadline is spent'''
+        swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        Node.objects.create(hostname="testnode1", ip_address="0.0.0.0",
+                            api_port="2375", role="Manager", swarm=swarm)
+        with mock.patch('swarman.clients.get_client') as get_client:
+            api = get_client.return_value.api
+            api.nodes.side_effect = lambda: deadlines.call_timeout()
+            api.get_json.side_effect = lambda *args, **kwargs: \
+                deadlines.call_timeout()
+            with self.assertLogs('swarman.deadlines', level='WARNING'):
+                response = self.client.get(reverse('swarman:swarm-dashboard',
+                                                   args=[swarm.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Unknown')
+        self.assertEqual(deadlines.stats()['swarm-dashboard']['exhausted'], 1)
+
+
+class NodeInfoRemoteCallTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        self.node1 = Node.objects.create(hostname="testnode1",
+                                         ip_address="0.0.0.0",
+                                         api_port="2375",
+                                         role="Manager", swarm=self.swarm)
+        self.node2 = Node.objects.create(hostname="testnode2",
+                                         ip_address="0.0.0.1",
+                                         api_port="2375",
+                                         role="Worker", swarm=self.swarm)
+        patcher = mock.patch('swarman.clients.get_client')
+        self.get_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        client = self.get_client.return_value
+        client.nodes.get.return_value.attrs = {
+            'Status': {'State': 'ready'},
+            'Spec': {'Availability': 'active'},
+        }
+        client.api.containers.return_value = []
+        client.api.get_json.return_value = []
+
+    def test_node_info_is_memoized(self):
+        '''Test that status and availability share one node inspect'''
+        self.assertEqual(self.node1.get_status, 'ready')
+        self.assertEqual(self.node1.get_availability, 'active')
+
+        self.assertEqual(self.get_client.return_value.nodes.get.call_count, 1)
+
+    def test_node_detail_inspects_node_once(self):
+        '''Test that rendering node_detail makes a single node inspect call'''
+        response = self.client.get(reverse('swarman:node-detail',
+                                           args=[self.node1.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_client.return_value.nodes.get.call_count, 1)
+
+    def test_swarm_dashboard_lists_nodes_once(self):
+        '''Test that rendering swarm_dashboard gets every node state from one listing'''
+        client = self.get_client.return_value
+        client.api.nodes.return_value = [
+            {'ID': 'abc', 'Description': {'Hostname': 'testnode1'},
+             'Status': {'State': 'ready'}, 'Spec': {'Availability': 'active'}},
+            {'ID': 'def', 'Description': {'Hostname': 'testnode2'},
+             'Status': {'State': 'down'}, 'Spec': {'Availability': 'drain'}},
+        ]
+        response = self.client.get(reverse('swarman:swarm-dashboard',
+                                           args=[self.swarm.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.api.nodes.call_count, 1)
+        self.assertEqual(client.nodes.get.call_count, 0)
+        self.assertContains(response, 'Drain')
+
+    def test_node_list_state_uses_one_listing(self):
+        '''Test that api-node-list with state=true lists the swarm nodes once'''
+        client = self.get_client.return_value
+        client.api.nodes.return_value = [
+            {'ID': 'abc', 'Description': {'Hostname': 'testnode1'},
+             'Status': {'State': 'ready'}, 'Spec': {'Availability': 'active'}},
+        ]
+        response = self.client.get(reverse('swarman:api-node-list',
+                                           args=[self.swarm.id]),
+                                   {'state': 'true'})
+
+        states = {node['hostname']: (node['status'], node['availability'])
+                  for node in response.json()}
+        self.assertEqual(states, {'testnode1': ('ready', 'active'),
+                                  'testnode2': ('Error', 'Error')})
+        self.assertEqual(client.api.nodes.call_count, 1)
+        self.assertEqual(client.nodes.get.call_count, 0)
+
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StatsCollectorTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        self.node = Node.objects.create(hostname="testnode1",
+                                        ip_address="0.0.0.0",
+                                        api_port="2375",
+                                        role="Manager", swarm=self.swarm)
+        first_frame = container_stats(0, 0, 100)
+        first_frame['precpu_stats'] = {'cpu_usage': {'total_usage': 0}}
+        self.api = mock.MagicMock()
+        self.api.containers.return_value = [
+            {'Id': 'abc123', 'Names': ['/web']},
+        ]
+        self.api.decode_stream.side_effect = lambda response: iter(
+            [first_frame, container_stats(25, 100, 100)])
+
+    def collect(self):
+        collector = NodeCollector(self.node)
+        collector._client = mock.MagicMock(api=self.api)
+        collector.refresh()
+        for subscription in collector.subscriptions.values():
+            subscription.join(timeout=1)
+        collector.flush()
+        return collector
+
+    def test_collector_stores_latest_sample(self):
+        '''Test that the collector stores the latest sample from the stats stream'''
+        self.collect()
+
+        self.assertEqual(self.node.latest_utilization(),
+                         [{'name': '/web', 'cpu': 50.0, 'memory': 10.0}])
+        self.api.open_stream.assert_called_once_with('/containers/abc123/stats')
+
+    def test_collector_drops_stopped_containers(self):
+        '''Test that subscriptions are dropped when a container stops'''
+        collector = self.collect()
+        self.api.containers.return_value = []
+        collector.refresh()
+
+        self.assertEqual(collector.subscriptions, {})
+        self.assertEqual(collector.flush(), [])
+
+    def test_stop_closes_a_silent_stream(self):
+        '''Test that stopping a subscription closes a stream that sends no readings'''
+        closed = threading.Event()
+        self.api.close_stream.side_effect = lambda response: closed.set()
+
+        def paused_container(response):
+            # A paused container sends nothing until its stream is closed
+            closed.wait(5)
+            return iter([])
+        self.api.decode_stream.side_effect = paused_container
+
+        subscription = ContainerSubscription(self.api, 'abc123', '/web')
+        subscription.start()
+        while subscription._response is None:
+            time.sleep(0.01)
+        subscription.stop(timeout=1)
+
+        self.assertFalse(subscription.is_alive())
+        self.api.close_stream.assert_called_once_with(
+            self.api.open_stream.return_value)
+
+    def test_collector_survives_database_errors(self):
+        '''Test that a lost database connection does not stop the collector'''
+        collector = StatsCollector(refresh_interval=0, flush_interval=0,
+                                   history_interval=0.001)
+        refreshes = []
+
+        def sync_nodes():
+            refreshes.append(True)
+            if len(refreshes) == 2:
+                collector.stop()
+            raise OperationalError('server closed the connection')
+
+        with mock.patch.object(collector, 'sync_nodes',
+                               side_effect=sync_nodes), \
+                mock.patch('swarman.collector.history.record',
+                           side_effect=OperationalError('gone')) as record, \
+                mock.patch('swarman.collector.close_old_connections') \
+                as close_old:
+            collector.run()
+
+        self.assertEqual(len(refreshes), 2)
+        record.assert_called()
+        self.assertGreaterEqual(close_old.call_count, 2)
+
+    def test_node_utilization_reads_stored_samples(self):
+        '''Test that node_utilization serves collector samples without polling the node'''
+        self.collect()
+        with mock.patch.object(Node, 'utilization_per_container') as poll:
+            response = self.client.get(reverse('swarman:api-node-utilization',
+                                               args=[self.node.id]))
+
+        poll.assert_not_called()
+        self.assertEqual(response.json(),
+                         [{'name': '/web', 'cpu': 50.0, 'memory': 10.0}])
+
+
+class UtilizationHistoryTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        self.node = Node.objects.create(hostname="testnode1",
+                                        ip_address="0.0.0.0",
+                                        api_port="2375",
+                                        role="Manager", swarm=self.swarm)
+        self.start = datetime(2022, 5, 1, 12, 0, tzinfo=timezone.utc)
+        # Six raw samples 10 seconds apart in each of the first two minutes
+        for second in range(0, 120, 10):
+            history.record({self.node.id: (second / 10, 50.0)},
+                           self.start + timedelta(seconds=second))
+
+    def test_record_writes_in_bulk(self):
+        '''Test that record writes one sample per node in a single query'''
+        with self.assertNumQueries(1):
+            history.record({self.node.id: (1.0, 2.0)},
+                           self.start + timedelta(hours=1))
+
+    def test_rollup_averages_completed_minutes(self):
+        '''Test that raw samples are averaged into completed minutes only once'''
+        now = self.start + timedelta(seconds=90)
+        self.assertEqual(history.rollup(UtilizationSample.MINUTE,
+                                        UtilizationSample.RAW, now), 1)
+        self.assertEqual(history.rollup(UtilizationSample.MINUTE,
+                                        UtilizationSample.RAW, now), 0)
+
+        minute = UtilizationSample.objects.get(
+            resolution=UtilizationSample.MINUTE)
+        self.assertEqual(minute.timestamp, self.start)
+        self.assertEqual(minute.cpu, 2.5)
+
+        now = self.start + timedelta(minutes=5)
+        self.assertEqual(history.rollup(UtilizationSample.MINUTE,
+                                        UtilizationSample.RAW, now), 1)
+
+    def test_prune_applies_retention(self):
+        '''Test that raw samples past their retention window are deleted'''
+        now = self.start + timedelta(seconds=24 * 3600 + 60)
+        with self.settings(SWARMAN_HISTORY_RETENTION={'raw': 24 * 3600}):
+            self.assertEqual(history.prune(now), 6)
+
+        self.assertEqual(UtilizationSample.objects.count(), 6)
+
+    def test_query_downsamples_to_points(self):
+        '''Test that history queries return at most the requested points'''
+        end = self.start + timedelta(minutes=2)
+        data = history.query(self.node, self.start, end, points=2, now=end)
+
+        self.assertEqual(data['resolution'], 'raw')
+        self.assertEqual([point['cpu'] for point in data['points']],
+                         [2.5, 8.5])
+
+    def test_history_endpoint_validates_range(self):
+        '''Test that api-node-history rejects a range that ends before it starts'''
+        response = self.client.get(
+            reverse('swarman:api-node-history', args=[self.node.id]),
+            {'start': '2022-05-02T00:00:00Z', 'end': '2022-05-01T00:00:00Z'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        self.node1 = Node.objects.create(hostname="testnode1",
+                                         ip_address="0.0.0.0",
+                                         api_port="2375",
+                                         role="Manager", swarm=self.swarm)
+        self.node2 = Node.objects.create(hostname="testnode2",
+                                         ip_address="0.0.0.1",
+                                         api_port="2375",
+                                         role="Worker", swarm=self.swarm)
+
+    async def test_async_swarm_dashboard_uses_one_listing(self):
+        '''Test that the async swarm_dashboard fetches services and nodes once each'''
+        responses = {
+            '/services': [],
+            '/nodes': [
+                {'ID': 'abc', 'Description': {'Hostname': 'testnode1'},
+                 'Status': {'State': 'ready'},
+                 'Spec': {'Availability': 'active'}},
+                {'ID': 'def', 'Description': {'Hostname': 'testnode2'},
+                 'Status': {'State': 'down'},
+                 'Spec': {'Availability': 'drain'}},
+            ],
+        }
+
+        async def first_manager(addresses, method, path, **kwargs):
+            return responses[path]
+
+        with mock.patch('swarman.aio_docker.first_manager',
+                        side_effect=first_manager) as manager_call:
+            response = await async_views.swarm_dashboard(
+                self.factory.get('/'), self.swarm.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(manager_call.call_count, 2)
+        self.assertIn(b'Drain', response.content)
+
+    async def test_async_node_utilization_marks_errors(self):
+        '''Test that the async node_utilization reports failing containers individually'''
+        async def get_json(path, params=None):
+            if path == '/containers/json':
+                return [{'Id': 'a', 'Names': ['/good']},
+                        {'Id': 'b', 'Names': ['/bad']}]
+            if path == '/containers/b/stats':
+                raise TimeoutError('timed out')
+            return container_stats(25, 100, 100)
+
+        client = mock.MagicMock()
+        client.get_json.side_effect = get_json
+        with mock.patch('swarman.aio_docker.get_client', return_value=client):
+            response = await async_api_views.node_utilization(
+                self.factory.get('/'), self.node1.id)
+
+        data = json.loads(response.content)
+        self.assertEqual(data[0], {'name': '/good', 'cpu': 50.0,
+                                   'memory': 10.0})
+        self.assertIsNone(data[1]['cpu'])
+        self.assertIn('TimeoutError', data[1]['error'])
+
+    async def test_async_node_detail_prefetches_node_info(self):
+        '''Test that the async node_detail fetches node status before rendering'''
+        async def get_json(path, params=None):
+            return [{'Id': 'a', 'Names': ['/web'], 'Image': 'nginx',
+                     'State': 'running'}]
+
+        async def first_manager(addresses, method, path, **kwargs):
+            return node_inspect('abc', 'testnode1', '0.0.0.0',
+                                availability='drain')
+
+        client = mock.MagicMock()
+        client.get_json.side_effect = get_json
+        with mock.patch('swarman.aio_docker.get_client',
+                        return_value=client), \
+                mock.patch('swarman.aio_docker.first_manager',
+                           side_effect=first_manager) as manager_call, \
+                mock.patch.object(Node, '_fetch_node_info') as fetch:
+            response = await async_views.node_detail(
+                self.factory.get('/'), self.node1.id)
+
+        self.assertEqual(response.status_code, 200)
+        fetch.assert_not_called()
+        self.assertEqual(manager_call.call_args.args[2], '/nodes/testnode1')
+        self.assertIn(b'Ready - Drain', response.content)
+
+
+def node_inspect(node_id, hostname, address, availability='active'):
+    '''Builds a minimal node inspect response for event tests'''
+    return {
+        'ID': node_id,
+        'Version': {'Index': 10},
+        'Spec': {'Role': 'worker', 'Availability': availability},
+        'Status': {'State': 'ready', 'Addr': address},
+        'Description': {
+            'Hostname': hostname,
+            'Platform': {'Architecture': 'aarch64', 'OS': 'linux'},
+            'Resources': {'MemoryBytes': 4 * 10**9, 'NanoCPUs': 4 * 10**9},
+            'Engine': {'EngineVersion': '20.10.14'},
+        },
+    }
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class EventListenerTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        self.node = Node.objects.create(hostname="testnode1",
+                                        ip_address="10.0.0.1",
+                                        api_port="2375", node_id="abc",
+                                        role="Manager", swarm=self.swarm)
+        patcher = mock.patch('swarman.clients.get_client')
+        self.get_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api = self.get_client.return_value.api
+        self.api.nodes.return_value = [
+            node_inspect('abc', 'testnode1', '10.0.0.1')]
+        swarm_cache.heartbeat(self.swarm.id)
+        self.addCleanup(swarm_cache.stop_listening, self.swarm.id)
+
+    def test_listings_are_cached_while_listening(self):
+        '''Test that node listings are reused while a listener keeps them fresh'''
+        self.swarm.get_node_states()
+        self.swarm.get_node_states()
+
+        self.assertEqual(self.api.nodes.call_count, 1)
+
+        swarm_cache.stop_listening(self.swarm.id)
+        self.swarm.get_node_states()
+        self.assertEqual(self.api.nodes.call_count, 2)
+
+    def test_node_event_updates_row_and_invalidates_listing(self):
+        '''Test that a node update event saves the node and drops the cached listing'''
+        self.swarm.get_node_states()
+        self.api.inspect_node.return_value = node_inspect(
+            'abc', 'testnode1', '10.0.0.1', availability='drain')
+
+        events.handle_cluster_event(
+            self.swarm, {'Type': 'node', 'Action': 'update',
+                         'Actor': {'ID': 'abc'}}, 'tcp://10.0.0.1:2375')
+
+        self.node.refresh_from_db()
+        self.assertEqual(self.node.node_architecture, 'aarch64')
+        self.assertIsNone(swarm_cache.get(self.swarm.id, swarm_cache.NODES))
+
+    def test_service_events_upsert_and_remove_rows(self):
+        '''Test that service events create and delete Service rows'''
+        self.api.inspect_service.return_value = {
+            'ID': 'svc1',
+            'Spec': {
+                'Name': 'web',
+                'Mode': {'Replicated': {'Replicas': 2}},
+                'TaskTemplate': {'ContainerSpec': {'Image': 'nginx:1@sha256:x'}},
+            },
+            'Endpoint': {'Ports': [{'TargetPort': 80, 'PublishedPort': 8080}]},
+        }
+        event = {'Type': 'service', 'Action': 'create',
+                 'Actor': {'ID': 'svc1'}}
+        events.handle_cluster_event(self.swarm, event, 'tcp://10.0.0.1:2375')
+        events.handle_cluster_event(self.swarm, event, 'tcp://10.0.0.1:2375')
+
+        service = Service.objects.get(swarm=self.swarm)
+        self.assertEqual((service.service_name, service.image_name,
+                          service.published_port), ('web', 'nginx:1', 8080))
+
+        event['Action'] = 'remove'
+        events.handle_cluster_event(self.swarm, event, 'tcp://10.0.0.1:2375')
+        self.assertFalse(Service.objects.exists())
+
+    def test_stream_resumes_after_last_event(self):
+        '''Test that a reconnecting stream resumes from the last event and skips replays'''
+        first = {'Type': 'node', 'timeNano': 1651406400123456789}
+        second = {'Type': 'node', 'timeNano': 1651406401000000000}
+        handled = []
+        stream = events.EventStream(lambda: ['tcp://10.0.0.1:2375'],
+                                    events.CLUSTER_FILTERS,
+                                    lambda event, url: handled.append(event),
+                                    'test')
+        with mock.patch('swarman.clients.PooledAPIClient') as client_class:
+            api = client_class.return_value
+            api.events.return_value = iter([first])
+            stream._follow()
+            api.events.return_value = iter([first, second])
+            stream._follow()
+
+        self.assertEqual(handled, [first, second])
+        self.assertEqual(api.events.call_args.kwargs['since'],
+                         '1651406400.123456789')
+
+
+def service_listing(service_id, name, replicas=1, mounts=()):
+    '''Builds a service from a services listing requested with status'''
+    return {
+        'ID': service_id,
+        'Spec': {
+            'Name': name,
+            'Mode': {'Replicated': {'Replicas': replicas}},
+            'TaskTemplate': {'ContainerSpec': {
+                'Image': f'{name}:latest@sha256:abc',
+                'Mounts': [{'Type': 'bind', 'Source': source,
+                            'Target': target} for source, target in mounts],
+            }},
+        },
+        'Endpoint': {'Ports': [{'TargetPort': 80, 'PublishedPort': 8000}]},
+        'ServiceStatus': {'RunningTasks': replicas, 'DesiredTasks': replicas},
+    }
+
+
+class ServiceSyncTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        Node.objects.create(hostname="testnode1", ip_address="0.0.0.0",
+                            api_port="2375", role="Manager", swarm=self.swarm)
+        patcher = mock.patch('swarman.clients.get_client')
+        self.get_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api = self.get_client.return_value.api
+        self.api.nodes.return_value = []
+
+    def test_sync_upserts_and_deletes_services(self):
+        '''Test that sync_services inserts, updates and deletes Service and Mounts rows'''
+        self.swarm.sync_services([
+            service_listing('a', 'web', mounts=[('/data', '/srv')]),
+            service_listing('b', 'db'),
+        ])
+        self.swarm.sync_services([
+            service_listing('a', 'web', replicas=3,
+                            mounts=[('/data', '/srv'), ('/logs', '/log')]),
+        ])
+
+        service = Service.objects.get(swarm=self.swarm)
+        self.assertEqual((service.service_id, service.desired_replicas,
+                          service.image_name), ('a', 3, 'web:latest'))
+        self.assertEqual(sorted(Mounts.objects.values_list(
+            'mount_src', flat=True)), ['/data', '/logs'])
+        self.assertIsNotNone(self.swarm.services_synced_at)
+
+    def test_unchanged_sync_makes_no_writes(self):
+        '''Test that syncing an unchanged listing only reads and stamps the swarm'''
+        listing = [service_listing(str(index), f'service{index}',
+                                   mounts=[('/data', '/srv')])
+                   for index in range(20)]
+        self.swarm.sync_services(listing)
+
+        # Services, mounts, service ids and the swarm timestamp, plus the
+        # savepoint around them
+        with self.assertNumQueries(6):
+            self.swarm.sync_services(listing)
+
+    def test_dashboard_reads_fresh_service_table(self):
+        '''Test that swarm_dashboard only lists services when the table is stale'''
+        self.api.get_json.return_value = [service_listing('a', 'web')]
+        url = reverse('swarman:swarm-dashboard', args=[self.swarm.id])
+
+        self.client.get(url)
+        response = self.client.get(url)
+
+        self.assertEqual(self.api.get_json.call_count, 1)
+        self.assertContains(response, 'Web')
+        self.assertContains(response, 'Updated')
+
+    def test_service_detail_skips_failing_managers(self):
+        '''Test that service data and tasks come from the next manager when one fails'''
+        Node.objects.create(hostname="testnode2", ip_address="0.0.0.1",
+                            api_port="2375", role="Manager", swarm=self.swarm)
+        working = mock.MagicMock()
+        working.services.get.return_value.attrs = service_listing('a', 'web')
+        working.services.get.return_value.tasks.return_value = []
+        failing = mock.MagicMock()
+        failing.services.get.side_effect = ConnectionError('Connection refused')
+        self.get_client.side_effect = lambda url: \
+            working if url == 'tcp://0.0.0.1:2375' else failing
+
+        self.assertEqual(self.swarm.get_service_data('a').name, 'web')
+        self.assertEqual(self.swarm.get_service_tasks('a'), [])
+
+        working.services.get.side_effect = ConnectionError('Connection refused')
+        self.assertEqual(self.swarm.get_service_data('a'),
+                         "Error retrieving service information")
+        self.assertEqual(self.swarm.get_service_tasks('a'), "Error")
+
+
+class NodeImportTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        self.node_list = [
+            node_inspect(f'id{index}', f'node{index}', f'10.0.1.{index}')
+            for index in range(100)]
+
+    def test_import_is_bulk_and_idempotent(self):
+        '''Test that importing a 100 node swarm takes a handful of queries and can be repeated'''
+        # Existing nodes, two insert batches (SQLite limits the parameters
+        # per query), the join tokens and the savepoint
+        with self.assertNumQueries(6):
+            self.assertEqual(self.swarm.import_nodes(
+                self.node_list, {'Manager': 'm-token', 'Worker': 'w-token'}),
+                (100, 0))
+
+        self.assertEqual(self.swarm.import_nodes(self.node_list), (0, 0))
+        self.assertEqual(Node.objects.filter(swarm=self.swarm).count(), 100)
+        self.swarm.refresh_from_db()
+        self.assertEqual(self.swarm.worker_join_token, 'w-token')
+
+    def test_import_updates_nodes_matched_by_address(self):
+        '''Test that rows without a node_id are matched by ip address and updated'''
+        Node.objects.create(hostname="old-name", ip_address="10.0.1.5",
+                            api_port="2376", role="Worker")
+
+        self.assertEqual(self.swarm.import_nodes(self.node_list), (99, 1))
+
+        node = Node.objects.get(ip_address="10.0.1.5")
+        self.assertEqual((node.node_id, node.hostname, node.api_port,
+                          node.swarm_id), ('id5', 'node5', '2376',
+                                           self.swarm.id))
+
+    def test_sync_nodes_reports_changes(self):
+        '''Test that sync_nodes updates changed nodes in bulk and handles joins and leaves'''
+        self.node_list[2]['Spec']['Role'] = 'manager'
+        self.swarm.import_nodes(self.node_list[:3])
+        node_list = self.node_list[1:4]
+        node_list[0] = node_inspect('id1', 'node1', '10.0.1.1')
+        node_list[0]['Spec']['Role'] = 'manager'
+
+        with mock.patch('swarman.clients.get_client') as get_client:
+            get_client.return_value.api.nodes.return_value = node_list
+            response = self.client.get(reverse('swarman:api-sync-swarm',
+                                               args=[self.swarm.id]))
+
+        self.assertEqual(response.json(), {
+            'created': ['node3'],
+            'updated': [{'hostname': 'node1', 'fields': ['role']}],
+            'removed': ['node0'],
+            'unchanged': 1,
+        })
+        self.assertEqual(Node.objects.get(node_id='id1').role, 'Manager')
+
+    def test_sync_nodes_is_one_bulk_update(self):
+        '''Test that syncing a swarm with changed nodes takes a fixed number of queries'''
+        self.swarm.import_nodes(self.node_list)
+        for node_data in self.node_list:
+            node_data['Description']['Engine']['EngineVersion'] = '23.0.1'
+
+        # Existing nodes, the bulk update (two batches on SQLite), nodes that
+        # left and the savepoint
+        with self.assertNumQueries(6):
+            report = self.swarm.sync_nodes(self.node_list)
+
+        self.assertEqual(len(report['updated']), 100)
+
+    def test_add_existing_swarm_nodes_uses_one_client(self):
+        '''Test that the import view gets nodes and tokens from one client'''
+        with mock.patch('swarman.clients.get_client') as get_client:
+            api = get_client.return_value.api
+            api.nodes.return_value = self.node_list[:3]
+            api.inspect_swarm.return_value = {
+                'JoinTokens': {'Manager': 'm-token', 'Worker': 'w-token'}}
+            for _ in range(2):
+                response = self.client.post(
+                    reverse('swarman:api-add-swarm-nodes'),
+                    {'swarm_id': self.swarm.id,
+                     'swarm_address': '10.0.1.0:2375'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_client.call_count, 2)
+        self.assertEqual(Node.objects.count(), 3)
+
+    def test_import_leaves_other_swarms_alone(self):
+        '''Test that a node tracked by another swarm is a conflict, not moved'''
+        other = Swarm.objects.create(swarm_name="Other Swarm")
+        other.import_nodes(self.node_list[5:6])
+        Node.objects.create(hostname="manager", ip_address="10.0.2.1",
+                            api_port="2375", role="Manager", swarm=self.swarm)
+        node_list = self.node_list[:3] + [
+            node_inspect('id99', 'other-node', '10.0.1.5')]
+
+        with self.assertRaises(NodeConflict):
+            self.swarm.import_nodes(node_list)
+        with mock.patch('swarman.clients.get_client') as get_client:
+            get_client.return_value.api.nodes.return_value = node_list
+            response = self.client.get(reverse('swarman:api-sync-swarm',
+                                               args=[self.swarm.id]))
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Node.objects.get(ip_address='10.0.1.5').swarm, other)
+        self.assertEqual(self.swarm.nodes.count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RestApiTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        for index in range(5):
+            Node.objects.create(hostname=f"node{index}",
+                                ip_address=f"10.0.0.{index}",
+                                api_port="2375", role="Worker",
+                                swarm=self.swarm)
+        self.url = reverse('swarman:api-node-list', args=[self.swarm.id])
+
+    def test_node_list_cursor_pagination(self):
+        '''Test that node lists are paginated with cursors'''
+        response = self.client.get(self.url, {'page_size': 2})
+        first = response.json()
+        response = self.client.get(first['next'])
+        second = response.json()
+
+        self.assertEqual([node['hostname'] for node in first['results']],
+                         ['node0', 'node1'])
+        self.assertEqual([node['hostname'] for node in second['results']],
+                         ['node2', 'node3'])
+        self.assertIsNotNone(second['previous'])
+
+    def test_lists_stay_arrays_by_default(self):
+        '''Test that lists are only paginated when asked to be'''
+        response = self.client.get(self.url)
+        self.assertEqual([node['hostname'] for node in response.json()],
+                         [f'node{index}' for index in range(5)])
+
+        response = self.client.get(reverse('swarman:api-swarm-list'))
+        self.assertEqual([swarm['swarm_name'] for swarm in response.json()],
+                         ['Test Swarm'])
+
+    def test_fields_projection(self):
+        '''Test that fields= narrows both the response and the query'''
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(self.url, {'fields': 'id,hostname'})
+
+        self.assertEqual(set(response.json()[0]), {'id', 'hostname'})
+        select = [query['sql'] for query in captured
+                  if 'FROM "swarman_node"' in query['sql'] and
+                  'COUNT' not in query['sql']][0]
+        self.assertNotIn('"node_architecture"', select)
+
+        response = self.client.get(self.url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        '''Test that unchanged lists answer 304 and changed rows a new ETag'''
+        response = self.client.get(self.url)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Imports write with bulk_update, which must move the row version
+        node = Node.objects.get(hostname='node0')
+        self.swarm.import_nodes([node_inspect('id0', 'node0', '10.0.0.0')])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        Node.objects.filter(id=node.id).delete()
+        response = self.client.get(self.url,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_swarm_detail_last_modified(self):
+        '''Test that a swarm detail answers If-Modified-Since'''
+        url = reverse('swarman:api-swarm-detail', args=[self.swarm.id])
+        response = self.client.get(url)
+        self.assertNotIn('services_synced_at', response.json())
+
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_swarm_detail_is_not_versioned(self):
+        '''Test that a missing swarm is a 404, even to a conditional GET'''
+        url = reverse('swarman:api-swarm-detail', args=[self.swarm.id + 1])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SnapshotTests(TestCase):
+
+    def test_node_snapshot(self):
+        '''Test that a node snapshot keeps the fields swarman uses'''
+        data = node_inspect('abc', 'manager1', '0.0.0.0')
+        data['ManagerStatus'] = {'Addr': '10.0.0.5:2377'}
+        node = NodeSnapshot.from_api(data)
+
+        self.assertEqual(node.id, 'abc')
+        self.assertEqual(node.hostname, 'manager1')
+        self.assertEqual(node.address, '10.0.0.5')
+        self.assertEqual((node.state, node.availability), ('ready', 'active'))
+        self.assertFalse(hasattr(node, '__dict__'))
+
+    def test_service_snapshot(self):
+        '''Test that a service snapshot drops the image digest and keeps mounts and task counts'''
+        service = ServiceSnapshot.from_api({
+            'ID': 'svc1',
+            'Spec': {
+                'Name': 'web',
+                'TaskTemplate': {'ContainerSpec': {
+                    'Image': 'nginx:latest@sha256:abc',
+                    'Mounts': [{'Type': 'bind', 'Source': '/data',
+                                'Target': '/srv'}],
+                }},
+                'Mode': {'Global': {}},
+            },
+            'ServiceStatus': {'RunningTasks': 3, 'DesiredTasks': 3},
+        })
+
+        self.assertEqual(service.image, 'nginx:latest')
+        self.assertIsNone(service.replicas)
+        self.assertEqual(service.mounts, (('bind', '/data', '/srv'),))
+        self.assertEqual(service.running_tasks, 3)
+        self.assertIsNone(service.published_port)
+
+    def test_container_snapshot(self):
+        '''Test that containers are built from the summary listing'''
+        container = snapshots.ContainerSnapshot.from_api({
+            'Id': 'c1', 'Names': ['/web'], 'Image': 'nginx',
+            'State': 'running', 'Status': 'Up 2 hours', 'Labels': {}})
+
+        self.assertEqual(container, ('c1', '/web', 'nginx', 'running',
+                                     'Up 2 hours'))
+
+    def test_listings_are_cached_as_snapshots(self):
+        '''Test that cached listings hold snapshots and raw ones are still read'''
+        swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        Node.objects.create(hostname="manager1", ip_address="0.0.0.0",
+                            api_port="2375", role="Manager", swarm=swarm)
+        swarm_cache.heartbeat(swarm.id)
+        self.addCleanup(swarm_cache.stop_listening, swarm.id)
+
+        with mock.patch('swarman.models.clients.get_client') as get_client:
+            get_client.return_value.api.nodes.return_value = [
+                node_inspect('abc', 'manager1', '0.0.0.0')]
+            states = swarm.get_node_states()
+
+        self.assertIsInstance(states['manager1'], NodeSnapshot)
+        cached = swarm_cache.get(swarm.id, swarm_cache.NODES)
+        self.assertIsInstance(cached[0], NodeSnapshot)
+
+        # Listings cached as JSON by an older version
+        swarm_cache.save(swarm.id, swarm_cache.NODES,
+                         [node_inspect('abc', 'manager1', '0.0.0.0')],
+                         swarm_cache.generation(swarm.id, swarm_cache.NODES))
+        self.assertEqual(swarm.get_node_states()['abc'], states['abc'])
+
+
+class SwarmListTests(TestCase):
+
+    def setUp(self):
+        self.swarm = Swarm.objects.create(swarm_name="Test Swarm")
+        for index, role in enumerate(['Manager', 'Worker', 'Worker']):
+            Node.objects.create(hostname=f"testnode{index}", swarm=self.swarm,
+                                role=role)
+        Swarm.objects.create(swarm_name="Empty Swarm")
+        swarm_cache.invalidate_swarm_list()
+        self.addCleanup(swarm_cache.invalidate_swarm_list)
+
+    def test_with_counts_is_one_query(self):
+        '''Test that the node counts of every swarm are read in a single query'''
+        with self.assertNumQueries(1):
+            counts = [(str(swarm), swarm.node_count, swarm.manager_count,
+                       swarm.worker_count())
+                      for swarm in Swarm.objects.with_counts().order_by('id')]
+
+        self.assertEqual(counts, [
+            ('Test Swarm - 3 Node Swarm', 3, 1, 2),
+            ('Empty Swarm - 0 Node Swarm', 0, 0, 0),
+        ])
+
+    def test_navbar_swarm_list_is_cached(self):
+        '''Test that the navbar swarm list is only queried on the first page'''
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('swarman:new-swarm'))
+        self.assertContains(response, 'Test Swarm')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('swarman:new-swarm'))
+        self.assertEqual([swarm['num_nodes'] for swarm
+                          in response.context['swarm_list']], [0, 3])
+
+    def test_navbar_swarm_list_follows_changes(self):
+        '''Test that Swarm and Node changes, including bulk imports, refresh the navbar'''
+        self.client.get(reverse('swarman:new-swarm'))
+        Swarm.objects.create(swarm_name="New Swarm")
+        response = self.client.get(reverse('swarman:new-swarm'))
+        self.assertContains(response, 'New Swarm')
+
+        self.swarm.import_nodes([node_inspect('id9', 'node9', '10.0.1.9')])
+        response = self.client.get(reverse('swarman:new-swarm'))
+        self.assertEqual(response.context['swarm_list'][-1]['num_nodes'], 4)
+
+        Node.objects.filter(swarm=self.swarm).delete()
+        response = self.client.get(reverse('swarman:new-swarm'))
+        self.assertEqual(response.context['swarm_list'][-1]['num_nodes'], 0)
+
+
+class StreamTests(TestCase):
+
+    def test_subscription_drops_stale_frames(self):
+        '''Test that a slow subscriber only keeps the latest frame'''
+        subscription = streams.Subscription()
+        for frame in range(3):
+            subscription.put(frame)
+
+        self.assertEqual(subscription.get(timeout=0), 2)
+        self.assertIsNone(subscription.get(timeout=0))
+        self.assertEqual(subscription.dropped, 2)
+
+    def test_broadcaster_samples_once_for_every_subscriber(self):
+        '''Test that subscribers of the same key share one sampler'''
+        registry = streams.BroadcasterRegistry()
+        sample = mock.Mock(return_value={'cpu': 1})
+        broadcaster, first = registry.subscribe('node-1', sample)
+        same, second = registry.subscribe('node-1', sample)
+
+        self.assertIs(broadcaster, same)
+        self.assertEqual(first.get(timeout=5), {'cpu': 1})
+        self.assertEqual(second.get(timeout=5), {'cpu': 1})
+        self.assertEqual(registry.stats(), {'node-1': 2})
+
+        broadcaster.unsubscribe(first)
+        broadcaster.unsubscribe(second)
+        broadcaster.join(timeout=5)
+        self.assertFalse(broadcaster.is_alive())
+        self.assertEqual(registry.stats(), {})
+        self.assertEqual(sample.call_count, broadcaster.samples)
+
+        # A stopped broadcaster is replaced by a new one
+        restarted, third = registry.subscribe('node-1', sample)
+        self.assertIsNot(restarted, broadcaster)
+        restarted.unsubscribe(third)
+        restarted.join(timeout=5)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_node_utilization_stream(self):
+        '''Test that the node stream sends the node utilization as events'''
+        node = Node.objects.create(hostname="testnode1", ip_address="0.0.0.0",
+                                   api_port="2375", role="Manager")
+
+        with mock.patch('swarman.models.clients.get_client') as get_client:
+            get_client.return_value.containers.list.return_value = [
+                FakeContainer('/web', container_stats(25, 100, 100))]
+            response = self.client.get(
+                reverse('swarman:api-node-utilization-stream',
+                        args=[node.id]))
+            content = iter(response.streaming_content)
+            retry, event = next(content), next(content)
+            response.close()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(retry, b'retry: 1000\n\n')
+        self.assertEqual(event, streams.format_event(
+            [{'name': '/web', 'cpu': 50.0, 'memory': 10.0}]).encode())
+        self.assertEqual(streams.registry.stats().get(f'node-{node.id}', 0), 0)
+
+    @override_settings(SWARMAN_STREAM_MAX_CLIENTS=1)
+    def test_sync_streams_are_limited(self):
+        '''Test that sync streams past SWARMAN_STREAM_MAX_CLIENTS are refused until one closes'''
+        node = Node.objects.create(hostname="testnode1", ip_address="0.0.0.0",
+                                   api_port="2375", role="Manager")
+        url = reverse('swarman:api-node-utilization-stream', args=[node.id])
+
+        first = self.client.get(url)
+        refused = self.client.get(url)
+        first.close()
+        again = self.client.get(url)
+        again.close()
+
+        self.assertEqual((first.status_code, refused.status_code,
+                          again.status_code), (200, 503, 200))
+        self.assertEqual(streams.stream_slots.open, 0)
+
+    async def test_async_stream_is_sent_from_the_event_loop(self):
+        '''Test that the ASGI handler sends async streams and stops when the client leaves'''
+        node = await sync_to_async(Node.objects.create)(
+            hostname="testnode1", ip_address="0.0.0.0", api_port="2375",
+            role="Manager")
+        samples = [{'name': '/web', 'cpu': 50.0, 'memory': 10.0}]
+        request_started.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+
+        handler = StreamingASGIHandler()
+        messages = []
+        left = asyncio.Event()
+        requests_sent = []
+
+        async def receive():
+            if not requests_sent:
+                requests_sent.append(True)
+                return {'type': 'http.request', 'body': b''}
+            await left.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            # The client leaves after the first event
+            if len([m for m in messages if m.get('body')]) == 2:
+                left.set()
+
+        with mock.patch.object(Node, 'latest_utilization',
+                               return_value=samples):
+            response = await async_api_views.node_utilization_stream(
+                AsyncRequestFactory().get('/'), node.id)
+            with mock.patch.object(handler, 'get_response_async',
+                                   mock.AsyncMock(return_value=response)):
+                await asyncio.wait_for(handler.handle(
+                    {'type': 'http', 'method': 'GET', 'path': '/',
+                     'query_string': b'', 'headers': []},
+                    receive, send), timeout=5)
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'Content-Type', b'text/event-stream'),
+                      messages[0]['headers'])
+        self.assertEqual([m['body'] for m in messages if m.get('body')], [
+            b'retry: 1000\n\n', streams.format_event(samples).encode()])
+        self.assertEqual(messages[-1], {'type': 'http.response.body'})
+        self.assertEqual(streams.registry.stats().get(f'node-{node.id}', 0), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SWARMAN_STATS_ONE_SHOT=True)
+class OneShotStatsTests(TestCase):
+
+    def setUp(self):
+        self.container = mock.MagicMock(id='abc')
+        one_shot = container_stats(50, 200, 100)
+        one_shot['precpu_stats'] = {'cpu_usage': {'total_usage': 0}}
+        self.container.client.api.get_json.side_effect = \
+            lambda path, params: dict(one_shot) if 'one-shot' in params \
+            else container_stats(25, 100, 100)
+        self.addCleanup(stats_store.drop_container, 1, 'abc')
+
+    def test_first_read_waits_for_two_samples(self):
+        '''Test that a container without a previous reading is read the two sample way'''
+        samples = utils.collect_container_utilization([self.container])
+
+        self.assertEqual(samples[0]['cpu'], 50.0)
+        self.container.client.api.get_json.assert_called_once_with(
+            '/containers/abc/stats', params={'stream': 'false'})
+        self.assertEqual(stats_store.previous_cpu_stats(['abc']),
+                         {'abc': container_stats(25, 100, 100)['cpu_stats']})
+
+    def test_one_shot_diffs_against_previous_reading(self):
+        '''Test that later reads are one-shot and diffed against the cached reading'''
+        utils.collect_container_utilization([self.container])
+        samples = utils.collect_container_utilization([self.container])
+
+        # (50 - 25) / (200 - 100) * 2 cpus
+        self.assertEqual(samples[0]['cpu'], 50.0)
+        self.assertEqual(self.container.client.api.get_json.call_args_list[1],
+                         mock.call('/containers/abc/stats',
+                                   params={'stream': 'false',
+                                           'one-shot': 'true'}))
+
+    def test_stopped_container_is_evicted(self):
+        '''Test that a container's previous reading is dropped once it leaves the listing'''
+        other = FakeContainer('/other', container_stats(10, 100, 100))
+        self.addCleanup(stats_store.forget_vanished, 1, [])
+        utils.collect_container_utilization([self.container, other],
+                                            node_id=1)
+        self.assertEqual(set(stats_store.previous_cpu_stats(
+            ['abc', 'other'])), {'abc', 'other'})
+
+        utils.collect_container_utilization([self.container], node_id=1)
+        self.assertEqual(set(stats_store.previous_cpu_stats(
+            ['abc', 'other'])), {'abc'})
+
+        utils.collect_container_utilization([], node_id=1)
+        self.assertEqual(stats_store.previous_cpu_stats(['abc']), {})
+
+    def test_one_shot_against_fake_engine(self):
+        '''Test that one-shot reads report the same utilization as two sample reads'''
+        with FakeEngine(nodes=1, containers=2) as engine:
+            node = engine.create_swarm().nodes.get()
+            first = node.utilization_per_container()
+            second = node.utilization_per_container()
+            clients.registry.clear()
+            for container in engine.containers[0]:
+                self.addCleanup(stats_store.drop_container, node.id,
+                                container['Id'])
+
+        self.assertEqual(first, second)
+        self.assertGreater(first[0]['cpu'], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkTests(TestCase):
+
+    def test_fake_engine_serves_the_model_layer(self):
+        '''Test that the fake engine answers the calls the models make and counts them'''
+        with FakeEngine(nodes=2, containers=3, services=2) as engine:
+            swarm = engine.create_swarm()
+            node = swarm.nodes.order_by('hostname').first()
+
+            self.assertEqual(len(node.utilization_per_container()), 3)
+            self.assertEqual(len(swarm.get_services()), 2)
+            self.assertEqual(node.get_status, 'ready')
+            self.assertEqual(engine.call_counts()['GET /containers/{id}/stats'],
+                             3)
+            clients.registry.clear()
+
+    def test_container_listing_skips_inspect(self):
+        '''Test that node_detail and utilization polls do not inspect each container'''
+        with FakeEngine(nodes=1, containers=50) as engine:
+            node = engine.create_swarm().nodes.get()
+            engine.reset_counts()
+            response = self.client.get(reverse('swarman:node-detail',
+                                               args=[node.id]))
+            node.utilization_per_container()
+            counts = engine.call_counts()
+            clients.registry.clear()
+
+        self.assertContains(response, '/fake-0-49')
+        self.assertNotIn('GET /containers/{id}/json', counts)
+        self.assertEqual(counts['GET /containers/json'], 2)
+        self.assertEqual(counts['GET /containers/{id}/stats'], 50)
+
+    def test_benchmark_models_writes_json(self):
+        '''Test that the benchmark command reports every benchmark and leaves no rows behind'''
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('benchmark_models', nodes=2, containers=2,
+                         latency=0, iterations=1, output=output,
+                         stdout=io.StringIO(), stderr=io.StringIO())
+            with open(output) as results_file:
+                report = json.load(results_file)
+
+        self.assertEqual(set(report['results']), {
+            'node_utilization', 'node_utilization_per_container',
+            'swarm_get_services', 'node_get_node_info', 'swarm_dashboard',
+            'node_detail'})
+        self.assertEqual(report['results']['swarm_get_services']
+                         ['remote_calls'], 1)
+        self.assertFalse(Swarm.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LoadTestTests(TransactionTestCase):
+
+    def test_loadtest_api_reports_percentiles(self):
+        '''Test that the load test serves the API over WSGI and reports each endpoint'''
+        endpoints = ['api-swarm-list', 'api-node-utilization',
+                     'api-service-scale']
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('loadtest_api', endpoints=endpoints, duration=0.2,
+                         concurrency=2, nodes=2, containers=2, latency=0,
+                         output=output, stdout=io.StringIO())
+            with open(output) as results_file:
+                report = json.load(results_file)
+
+        self.assertEqual(list(report['results']), endpoints)
+        for result in report['results'].values():
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['p50'], result['p99'])
+        self.assertFalse(Swarm.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SWARMAN_PROFILING=True)
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        self.engine = FakeEngine(nodes=1, containers=3).start()
+        self.addCleanup(self.engine.stop)
+        self.addCleanup(clients.registry.clear)
+        self.addCleanup(profiling.clear)
+        self.swarm = self.engine.create_swarm()
+        self.node = self.swarm.nodes.get()
+
+    def test_docker_calls_in_server_timing(self):
+        '''Test that the Docker calls and queries of a request are reported in Server-Timing'''
+        response = self.client.get(reverse('swarman:api-node-utilization',
+                                           args=[self.node.id]))
+
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[0-9.]+;desc="1 queries"')
+        # Version negotiation by the new client, the container list, and one
+        # stats call per container
+        self.assertRegex(timing, r'docker;dur=[0-9.]+;desc="5 calls"')
+        self.assertIn(f'{self.node.ip_address}:{self.node.api_port} (5 calls)',
+                      timing)
+
+    def test_profile_summary(self):
+        '''Test that the debug endpoint summarises recent requests per endpoint'''
+        for _ in range(2):
+            self.client.get(reverse('swarman:api-node-utilization',
+                                    args=[self.node.id]))
+
+        summary = self.client.get(reverse('swarman:api-docker-profile')).json()
+
+        self.assertEqual(summary['requests']['api-node-utilization']
+                         ['requests'], 2)
+        stats = [endpoint for endpoint in summary['docker']
+                 if endpoint['endpoint'] == 'GET /containers/{id}/stats']
+        self.assertEqual(stats[0]['calls'], 6)
+        self.assertGreater(stats[0]['bytes'], 0)
+
+    @override_settings(SWARMAN_PROFILING=False)
+    def test_disabled(self):
+        '''Test that nothing is recorded when profiling is disabled'''
+        response = self.client.get(reverse('swarman:api-node-utilization',
+                                           args=[self.node.id]))
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(
+            reverse('swarman:api-docker-profile')).status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.engine = FakeEngine(nodes=2, containers=2).start()
+        self.addCleanup(self.engine.stop)
+        self.addCleanup(clients.registry.clear)
+        self.addCleanup(metrics.docker_latency.clear)
+        self.swarm = self.engine.create_swarm('Metrics Swarm')
+        self.node = self.swarm.nodes.get(hostname='fake-node-0')
+        self.addCleanup(stats_store.clear_node_samples, self.node.id)
+        stats_store.save_node_samples(self.node.id, [
+            {'id': 'a', 'name': '/web', 'cpu': 12.5, 'memory': 4.0,
+             'timestamp': time.time()},
+            {'id': 'b', 'name': '/db', 'cpu': 2.5, 'memory': 6.0,
+             'timestamp': time.time()},
+        ])
+        Service.objects.create(swarm=self.swarm, service_name='web',
+                               service_id='s1', image_name='web',
+                               desired_replicas=3, desired_tasks=3,
+                               running_tasks=2, status='running')
+        # Synced from an inspect, without task counts
+        Service.objects.create(swarm=self.swarm, service_name='worker',
+                               service_id='s2', image_name='worker',
+                               desired_replicas=1, status='running')
+
+    def test_metrics_exposition(self):
+        '''Test that /metrics reports nodes, containers, services and Docker latencies'''
+        response = self.client.get(reverse('metrics'))
+        body = response.content.decode()
+
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        for line in [
+            'hana_swarm_reachable{swarm="Metrics Swarm"} 1',
+            'hana_node_state{state="ready",swarm="Metrics Swarm",'
+            'node="fake-node-1"} 1',
+            'hana_node_cpu_percent{swarm="Metrics Swarm",node="fake-node-0"} '
+            '15.0',
+            'hana_container_memory_percent{swarm="Metrics Swarm",'
+            'node="fake-node-0",container="db"} 6.0',
+            'hana_service_running_replicas{swarm="Metrics Swarm",'
+            'service="web"} 2',
+        ]:
+            self.assertIn(line, body)
+        self.assertRegex(body, r'hana_docker_request_duration_seconds_count'
+                               r'\{target="http://127\.0\.0\.1:\d+"\} 2')
+        # Nodes without collector samples are not polled
+        self.assertNotIn('node="fake-node-1"} 0', body)
+        # Services with unknown task counts are left out, not reported as 0
+        self.assertNotIn('service="worker"', body)
+
+    def test_metrics_report_exhausted_deadlines(self):
+        '''Test that /metrics counts requests that ran out of their deadline'''
+        self.addCleanup(deadlines.clear_stats)
+        with self.assertLogs('swarman.deadlines', level='WARNING'):
+            with deadlines.deadline(0, 'node-detail'):
+                with self.assertRaises(deadlines.DeadlineExceeded):
+                    deadlines.call_timeout(60)
+        with deadlines.deadline(10, 'node-detail'):
+            pass
+
+        body = self.client.get(reverse('metrics')).content.decode()
+
+        for line in [
+            '# TYPE hana_request_deadline_exhausted_total counter',
+            'hana_request_deadline_requests_total{endpoint="node-detail"} 2',
+            'hana_request_deadline_exhausted_total{endpoint="node-detail"} 1',
+            'hana_request_deadline_skipped_calls_total'
+            '{endpoint="node-detail"} 1',
+        ]:
+            self.assertIn(line, body)
+
+    def test_scrapes_reuse_node_listing(self):
+        '''Test that repeated scrapes make no further Docker calls'''
+        self.client.get(reverse('metrics'))
+        self.engine.reset_counts()
+
+        self.client.get(reverse('metrics'))
+
+        self.assertEqual(self.engine.total_calls(), 0)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import (
     path,
     include,
@@ -5,14 +6,19 @@ from django.urls import (
 
 from . import views
 
+if getattr(settings, 'SWARMAN_ASYNC_VIEWS', False):
+    from . import async_views as docker_views
+else:
+    docker_views = views
+
 
 urlpatterns = [
-    path('dashboard/<int:swarm_id>', views.swarm_dashboard,
+    path('dashboard/<int:swarm_id>', docker_views.swarm_dashboard,
          name='swarm-dashboard'),
-    path('nodes/<str:node_id>', views.node_detail, name='node-detail'),
+    path('nodes/<str:node_id>', docker_views.node_detail, name='node-detail'),
     path('new_swarm/', views.AddSwarm.as_view(), name='new-swarm'),
     path('create_swarm/', views.create_swarm, name='create-swarm'),
-    path('swarm/<int:swarm_id>/service', views.service_detail, 
+    path('swarm/<int:swarm_id>/service', docker_views.service_detail, 
         name='service-detail'),
     path('api/', include('swarman.api.urls')),
     
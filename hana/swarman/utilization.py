@@ -0,0 +1,157 @@
+"""
+Container utilization math.
+
+Every CPU and memory percentage HANA shows is computed here from Docker
+stats responses, the same way the docker CLI does:
+
+    cpu    = (cpu delta / system cpu delta) * online cpus * 100
+    memory = usage / limit * 100
+
+Stats are turned into NumPy arrays so a node's (or a swarm's) containers are
+computed, totalled, ranked and rounded in one pass instead of one Python loop
+per step. Readings the CLI copes with no longer raise either:
+
+- a reading without a previous sample (no precpu_stats system counter, as in
+  the first reading of a stream or a one-shot reading) has no CPU value (NaN,
+  None in samples). Diffing against zero would not work: the container's
+  counter runs from when it started and the system's from when the host
+  booted.
+- a system cpu delta of zero or less (two readings in the same tick, or a
+  counter reset) gives 0% CPU
+- a memory limit of zero gives 0% memory
+- a missing online_cpus falls back to the number of per CPU counters
+"""
+import numpy
+
+
+def _counter(section, *keys):
+    for key in keys:
+        if not isinstance(section, dict):
+            return 0
+        section = section.get(key)
+    return section or 0
+
+
+def _online_cpus(cpu_stats):
+    return cpu_stats.get('online_cpus') or \
+        len(cpu_stats.get('cpu_usage', {}).get('percpu_usage') or ()) or 1
+
+
+def stats_arrays(stats_list):
+    '''
+    Returns the counters of a list of container stats responses as a
+    dictionary of float arrays, one element per response. A KeyError is
+    raised for responses without cpu_stats or memory_stats (containers that
+    are not running).
+    '''
+    columns = {
+        'cpu_total': [], 'precpu_total': [], 'system': [], 'presystem': [],
+        'online_cpus': [], 'memory_usage': [], 'memory_limit': [],
+    }
+    for stats in stats_list:
+        cpu_stats = stats['cpu_stats']
+        memory_stats = stats['memory_stats']
+        precpu_stats = stats.get('precpu_stats') or {}
+        columns['cpu_total'].append(
+            _counter(cpu_stats, 'cpu_usage', 'total_usage'))
+        columns['precpu_total'].append(
+            _counter(precpu_stats, 'cpu_usage', 'total_usage'))
+        columns['system'].append(_counter(cpu_stats, 'system_cpu_usage'))
+        columns['presystem'].append(
+            _counter(precpu_stats, 'system_cpu_usage'))
+        columns['online_cpus'].append(_online_cpus(cpu_stats))
+        columns['memory_usage'].append(_counter(memory_stats, 'usage'))
+        columns['memory_limit'].append(_counter(memory_stats, 'limit'))
+
+    return {name: numpy.asarray(values, dtype=numpy.float64)
+            for name, values in columns.items()}
+
+
+def percentages(stats_list):
+    '''
+    Calculates the CPU and memory utilization of every container stats
+    response in stats_list. CPU is NaN for responses without a previous
+    sample. Returns a Tuple of arrays: (cpu_utilization, memory_utilization)
+    '''
+    counters = stats_arrays(stats_list)
+
+    cpu_delta = counters['cpu_total'] - counters['precpu_total']
+    system_delta = counters['system'] - counters['presystem']
+    limit = counters['memory_limit']
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cpu = numpy.where(
+            (system_delta > 0) & (cpu_delta > 0),
+            cpu_delta / system_delta * counters['online_cpus'] * 100.0, 0.0)
+        cpu = numpy.where(counters['presystem'] > 0, cpu, numpy.nan)
+        memory = numpy.where(
+            limit > 0, counters['memory_usage'] / limit * 100.0, 0.0)
+
+    return cpu, memory
+
+
+def sample_arrays(samples):
+    '''
+    Returns the cpu and memory of a list of samples as arrays. Samples that
+    errored, and values that are None, are NaN.
+    '''
+    values = numpy.array(
+        [(numpy.nan, numpy.nan) if 'error' in sample
+         else (numpy.nan if sample['cpu'] is None else sample['cpu'],
+               numpy.nan if sample['memory'] is None else sample['memory'])
+         for sample in samples],
+        dtype=numpy.float64).reshape(-1, 2)
+    return values[:, 0], values[:, 1]
+
+
+def totals(samples):
+    '''
+    Sums the CPU and memory utilization of every sample that did not error,
+    leaving out values that are None. Returns a Tuple: (cpu_utilization, memory_utilization)
+    '''
+    cpu, memory = sample_arrays(samples)
+    return float(numpy.nansum(cpu)), float(numpy.nansum(memory))
+
+
+def top_consumers(samples, count=5, key='cpu'):
+    '''
+    Returns the count samples using the most CPU (or memory, with
+    key='memory'), highest first. Samples that errored are left out.
+    '''
+    cpu, memory = sample_arrays(samples)
+    values = numpy.nan_to_num(cpu if key == 'cpu' else memory, nan=-1.0)
+    count = min(count, int((values >= 0).sum()))
+    if count <= 0:
+        return []
+
+    # Only the top count values are sorted
+    top = numpy.argpartition(-values, count - 1)[:count]
+    top = top[numpy.argsort(-values[top], kind='stable')]
+    return [samples[index] for index in top]
+
+
+def round2(value):
+    '''Rounds a percentage (or an array of them) to 2 decimal places'''
+    if isinstance(value, numpy.ndarray):
+        return numpy.round(value, 2).tolist()
+    return round(float(value), 2)
+
+
+def rounded(samples):
+    '''
+    Returns copies of samples with cpu and memory rounded to 2 decimal
+    places. Samples that errored, and values that are None, are copied
+    unchanged.
+    '''
+    cpu, memory = sample_arrays(samples)
+    cpu, memory = numpy.round(cpu, 2).tolist(), numpy.round(memory, 2).tolist()
+
+    result = []
+    for sample, sample_cpu, sample_memory in zip(samples, cpu, memory):
+        sample = dict(sample)
+        if 'error' not in sample:
+            if sample['cpu'] is not None:
+                sample['cpu'] = sample_cpu
+            if sample['memory'] is not None:
+                sample['memory'] = sample_memory
+        result.append(sample)
+    return result
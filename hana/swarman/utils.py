@@ -0,0 +1,369 @@
+"""
+Helper functions shared by the swarman models, views and API
+"""
+import contextvars
+import math
+import threading
+from concurrent.futures import (
+    CancelledError,
+    ThreadPoolExecutor,
+    wait,
+)
+
+from django.conf import settings
+
+from . import (
+    clients,
+    deadlines,
+    stats_store,
+    utilization,
+)
+
+
+# Set by collect_node_utilization: the pool every node of a swarm wide poll
+# reads its container stats with, instead of starting its own
+_stats_executor = contextvars.ContextVar('swarman_stats_executor',
+                                         default=None)
+
+# Swarm wide polls running per node id, so a node is polled once at a time
+_node_polls = {}
+_node_polls_lock = threading.Lock()
+
+
+def stats_max_workers():
+    '''Returns the number of containers that are polled for stats at once'''
+    return max(1, getattr(settings, 'SWARMAN_STATS_MAX_WORKERS', 8))
+
+
+def swarm_utilization_max_workers():
+    '''Returns the number of nodes a swarm wide poll polls at once'''
+    return max(1, getattr(settings,
+                          'SWARMAN_SWARM_UTILIZATION_MAX_WORKERS', 4))
+
+
+def stats_timeout():
+    '''Returns the number of seconds to wait on a single container's stats'''
+    return getattr(settings, 'SWARMAN_STATS_TIMEOUT', 10)
+
+
+def stats_one_shot():
+    '''
+    Returns whether container stats are read with one-shot calls diffed
+    against the container's previous reading
+    '''
+    return getattr(settings, 'SWARMAN_STATS_ONE_SHOT', False)
+
+
+def node_info_ttl():
+    '''Returns the number of seconds node inspect results are reused for'''
+    return getattr(settings, 'SWARMAN_NODE_INFO_TTL', 5)
+
+
+def container_utilization(container_info):
+    '''
+    Calculates the CPU and memory utilization of a single container from a
+    container stats response as a percentage. CPU is None when the response
+    has no previous sample to diff against. Returns a Tuple:
+    (cpu_utilization, memory_utilization)
+    '''
+    cpu_usage, memory_usage = utilization.percentages([container_info])
+    cpu_usage = float(cpu_usage[0])
+
+    return (None if math.isnan(cpu_usage) else cpu_usage,
+            float(memory_usage[0]))
+
+
+def container_name(attrs):
+    '''
+    Returns the name of a container (ex: /web) from its summary listing or
+    inspect data
+    '''
+    if attrs.get('Names'):
+        return attrs['Names'][0]
+    return attrs['Name']
+
+
+def stats_request(container_id, previous=None):
+    '''
+    Returns the Engine API path and query parameters of a single stats
+    reading of a container. When previous holds the cpu_stats of the
+    container's last reading, the reading is one-shot: the daemon answers
+    straight away instead of waiting a second for a second sample.
+    Returns a Tuple: (path, params)
+    '''
+    params = {'stream': 'false'}
+    if previous is not None:
+        params['one-shot'] = 'true'
+
+    return f'/containers/{container_id}/stats', params
+
+
+def stats_result(stats, previous=None):
+    '''
+    Finishes a response to a stats_request: a one-shot reading carries no
+    precpu_stats of its own and is diffed against previous instead
+    '''
+    if previous is not None:
+        stats['precpu_stats'] = previous
+
+    return stats
+
+
+def _container_stats(container, timeout=None, previous=None):
+    '''
+    Pulls a single stats response for a container, one-shot when previous
+    holds the cpu_stats of its last reading (see stats_request). Errors are
+    returned instead of raised so one bad container does not fail the whole
+    node. Returns a Tuple: (stats, error)
+    '''
+    path, params = stats_request(container.id, previous)
+    try:
+        with clients.request_timeout(timeout):
+            stats = container.client.api.get_json(path, params=params)
+    except Exception as err:
+        return None, f'{type(err).__name__}: {err}'
+
+    return stats_result(stats, previous), None
+
+
+def _pooled_container_stats(executor, containers, timeout, previous):
+    '''
+    Reads the stats of containers on executor. Raises TimeoutError when the
+    executor drops them, because the swarm wide poll it belongs to has given
+    up. Returns a list of Tuples: (stats, error)
+    '''
+    futures = []
+    try:
+        for container, cpu_stats in zip(containers, previous):
+            # Each worker runs in a copy of the caller's context so the
+            # request deadline applies to it
+            futures.append(executor.submit(contextvars.copy_context().run,
+                                           _container_stats, container,
+                                           timeout, cpu_stats))
+        return [future.result() for future in futures]
+    except (RuntimeError, CancelledError):
+        # Submitting to a shut down executor raises RuntimeError
+        for future in futures:
+            future.cancel()
+        raise TimeoutError('The utilization poll gave up on the node')
+
+
+def save_previous_stats(container_ids, stats_list, node_id=None):
+    '''
+    Keeps the cpu_stats of every successful stats reading for the next
+    one-shot reading of the container to diff against. container_ids is the
+    node's full listing: when node_id is given, readings of the node's
+    containers that are no longer listed are dropped.
+    '''
+    if node_id is not None:
+        stats_store.forget_vanished(node_id, container_ids)
+    stats_store.save_cpu_stats({
+        container_id: stats['cpu_stats']
+        for container_id, (stats, error) in zip(container_ids, stats_list)
+        if error is None and
+        (stats.get('cpu_stats') or {}).get('system_cpu_usage')})
+
+
+def container_samples(names, stats_list):
+    '''
+    Builds utilization samples from container names and their stats
+    responses (or error strings), computing every percentage in one pass.
+    Returns a list of dictionaries with container name, cpu and memory
+    utilization in the same order as names. Containers that could not be
+    sampled have cpu and memory set to None and an 'error' key, containers
+    without a previous CPU sample (see utilization.py) only have cpu set to
+    None.
+    '''
+    samples = [{'name': name, 'cpu': None, 'memory': None}
+               for name in names]
+    readings = []
+    for sample, (stats, error) in zip(samples, stats_list):
+        if error is not None:
+            sample['error'] = error
+        elif not stats.get('cpu_stats') or not stats.get('memory_stats'):
+            sample['error'] = 'KeyError: container reported no stats'
+        else:
+            readings.append((sample, stats))
+
+    if readings:
+        cpu, memory = utilization.percentages(
+            [stats for _, stats in readings])
+        for (sample, _), cpu_usage, memory_usage in zip(
+                readings, cpu.tolist(), memory.tolist()):
+            sample['cpu'] = None if math.isnan(cpu_usage) else cpu_usage
+            sample['memory'] = memory_usage
+
+    return samples
+
+
+def collect_container_utilization(containers, max_workers=None, timeout=None,
+                                  node_id=None):
+    '''
+    Collects CPU and memory utilization for a list of containers, polling up
+    to max_workers containers at the same time and waiting at most timeout
+    seconds on each container. Inside a swarm wide poll the containers are
+    polled on the poll's shared pool instead (see collect_node_utilization).
+    containers should be every container of the
+    node node_id, whose vanished containers' cached readings are then
+    dropped (see save_previous_stats). Returns a list of
+    dictionaries with container name, cpu and memory utilization in the same
+    order as containers. Containers that could not be sampled have cpu and
+    memory set to None and an 'error' key describing the failure.
+    '''
+    containers = list(containers)
+    if not containers:
+        if node_id is not None and stats_one_shot():
+            stats_store.forget_vanished(node_id, [])
+        return []
+
+    if max_workers is None:
+        max_workers = stats_max_workers()
+    max_workers = max(1, min(max_workers, len(containers)))
+
+    one_shot = stats_one_shot()
+    previous = [None] * len(containers)
+    if one_shot:
+        cached = stats_store.previous_cpu_stats(
+            container.id for container in containers)
+        previous = [cached.get(container.id) for container in containers]
+
+    shared = _stats_executor.get()
+    if shared is not None:
+        stats_list = _pooled_container_stats(shared, containers, timeout,
+                                             previous)
+    elif max_workers == 1:
+        stats_list = [_container_stats(container, timeout, cpu_stats)
+                      for container, cpu_stats in zip(containers, previous)]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            stats_list = _pooled_container_stats(executor, containers,
+                                                 timeout, previous)
+
+    if one_shot:
+        save_previous_stats([container.id for container in containers],
+                            stats_list, node_id)
+
+    return container_samples(
+        [container_name(container.attrs) for container in containers],
+        stats_list)
+
+
+def total_utilization(samples):
+    '''
+    Sums the CPU and memory utilization of every container sample that did
+    not error. Returns a Tuple: (cpu_utilization, memory_utilization)
+    '''
+    return utilization.totals(samples)
+
+
+def swarm_utilization_deadline():
+    '''Returns the number of seconds a swarm wide utilization poll may take'''
+    return getattr(settings, 'SWARMAN_SWARM_UTILIZATION_DEADLINE', 15)
+
+
+def _node_utilization(node, timeout):
+    '''
+    Polls a single node for per container utilization and totals it up
+    '''
+    containers = node.latest_utilization()
+    if containers is None:
+        containers = node.utilization_per_container(timeout=timeout)
+    total_cpu_load, total_memory_load = total_utilization(containers)
+
+    return {
+        'cpu': utilization.round2(total_cpu_load),
+        'memory': utilization.round2(total_memory_load),
+        'containers': containers,
+    }
+
+
+def _forget_node_poll(node_id, future):
+    with _node_polls_lock:
+        if _node_polls.get(node_id) is future:
+            del _node_polls[node_id]
+
+
+def _start_node_poll(executor, node, timeout):
+    '''
+    Submits a poll of node to executor, or returns the poll already running
+    for the node (from an earlier swarm wide poll that gave up on it) so a
+    node that hangs is never polled twice at once
+    '''
+    with _node_polls_lock:
+        future = _node_polls.get(node.id)
+        if future is not None and not future.done():
+            return future
+        future = executor.submit(contextvars.copy_context().run,
+                                 _node_utilization, node, timeout)
+        _node_polls[node.id] = future
+
+    future.add_done_callback(
+        lambda done: _forget_node_poll(node.id, done))
+    return future
+
+
+def collect_node_utilization(nodes, deadline=None):
+    '''
+    Polls up to SWARMAN_SWARM_UTILIZATION_MAX_WORKERS nodes at the same time,
+    reading their container stats on one pool of SWARMAN_STATS_MAX_WORKERS
+    threads, and waits at most deadline seconds for all of them to answer. A
+    node still being polled by an earlier call is not polled again, its
+    running poll is waited on instead. Returns a list of dictionaries in the
+    same order as nodes with the node id, hostname, status, cpu, memory and
+    per container utilization. Nodes that do not answer in time have a
+    status of 'timeout' and nodes that raise an error have a status of
+    'unreachable'; both have cpu and memory set to None.
+    '''
+    nodes = list(nodes)
+    if not nodes:
+        return []
+
+    if deadline is None:
+        deadline = swarm_utilization_deadline()
+    deadline = min(deadline, deadlines.remaining(deadline))
+    # No single stats call should outlive the overall deadline
+    timeout = max(1, min(stats_timeout(), deadline))
+
+    node_executor = ThreadPoolExecutor(
+        max_workers=min(swarm_utilization_max_workers(), len(nodes)))
+    stats_executor = ThreadPoolExecutor(max_workers=stats_max_workers())
+    token = _stats_executor.set(stats_executor)
+    try:
+        futures = [_start_node_poll(node_executor, node, timeout)
+                   for node in nodes]
+    finally:
+        _stats_executor.reset(token)
+    wait(futures, timeout=deadline)
+    # Do not block on nodes that missed the deadline. Queued polls and stats
+    # calls are dropped, running ones finish within timeout in the
+    # background and are reused by the next call.
+    node_executor.shutdown(wait=False, cancel_futures=True)
+    stats_executor.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for node, future in zip(nodes, futures):
+        node_data = {
+            'id': node.id,
+            'hostname': node.hostname,
+            'status': 'ok',
+            'cpu': None,
+            'memory': None,
+            'containers': [],
+        }
+        if future.cancelled() or not future.done():
+            node_data['status'] = 'timeout'
+            node_data['error'] = f'No response within {deadline}s'
+        elif future.exception() is not None:
+            err = future.exception()
+            node_data['status'] = 'unreachable'
+            node_data['error'] = f'{type(err).__name__}: {err}'
+        else:
+            node_data.update(future.result())
+        results.append(node_data)
+
+    return results
+
+
+def services_max_age():
+    '''Returns the number of seconds the Service table is trusted for'''
+    return getattr(settings, 'SWARMAN_SERVICES_MAX_AGE', 30)
@@ -2,14 +2,21 @@ from django.shortcuts import (
     render,
     get_object_or_404
 )
-from django.http import JsonResponse
+from django.http import (
+    HttpResponse,
+    JsonResponse,
+)
 from django.views import View
 from django.utils.html import format_html
 
 import requests
 import json
-import docker
 
+from . import (
+    clients,
+    metrics,
+    snapshots,
+)
 from .models import (
     Swarm,
     Node,
@@ -21,31 +28,57 @@ SWARM_MANAGER_URL = 'http://192.168.1.200:2375'
 # Create your views here.
 
 
+def service_detail_context(service, tasks):
+    """
+    Returns the service_detail template context for a ServiceSnapshot and
+    the TaskSnapshots of its running tasks
+    """
+    context = {}
+    context['running_tasks'] = 0
+    for task in tasks:
+        if task.state == "running":
+            context['running_tasks'] += 1
+
+    context['service_name'] = service.name
+    context['service_id'] = service.id
+    context['replicas'] = service.replicas or 0
+    context['image'] = service.image
+    context['published_port'] = service.published_port
+    context['target_port'] = service.target_port
+    # Calculate Service Status
+    if context['running_tasks'] == 0 and context['replicas'] == 0:
+        context['service_status'] = 'Paused'
+        context['service_status_display'] = format_html('<strong><span style="color: #8B8000;">{}</span></strong>',
+                                                'Paused')
+    elif 0 < context['running_tasks'] < context['replicas']:
+        context['service_status'] = 'Degraded'
+        context['service_status_display'] = format_html('<strong><span style="color: orange;">{}</span></strong>',
+                                                'Degraded')
+    elif 0 == context['running_tasks'] < context['replicas']:
+        context['service_status'] = 'Error'
+        context['service_status_display'] = format_html('<strong><span style="color: red;">{}</span></strong>',
+                                                'Error')
+    else:
+        context['service_status'] = 'Running'
+        context['service_status_display'] = format_html('<strong><span style="color: green;">{}</span></strong>',
+                                                'Running')
+
+    return context
+
+
 def swarm_dashboard(request, swarm_id):
     """
     Display information about a swarm. Includes node and service status
     """
-    swarm = get_object_or_404(Swarm, id=swarm_id)
-    nodes = swarm.nodes.order_by('hostname')
-
-    services = []
-    service_list = swarm.get_services()
-
-    if "Error" not in service_list:
-        for service in swarm.get_services():
-            service_info = {
-                'name': service['Spec']['Name'],
-                'ID': service['ID'],
-                'image': service['Spec']['TaskTemplate']['ContainerSpec']['Image'].split('@')[0],
-                'replicas': service['Spec']['Mode']['Replicated']['Replicas'],
-                'desired_tasks': service['ServiceStatus']['DesiredTasks'],
-                'target_port': service['Endpoint']['Ports'][0]['TargetPort'],
-                'published_port': service['Endpoint']['Ports'][0]['PublishedPort'],
-            }
-            services.append(service_info)
+    swarm = get_object_or_404(Swarm.objects.with_counts(), id=swarm_id)
+    # One node listing covers the status and availability of every node
+    nodes = swarm.nodes_with_state()
 
-    else:
-        services.append('ERROR')
+    # Services are read from the Service table, synced from one listing when
+    # it is older than SWARMAN_SERVICES_MAX_AGE
+    services = swarm.service_summaries()
+    if services == "Error":
+        services = ['ERROR']
 
     context = {
         "swarm": swarm,
@@ -63,13 +96,12 @@ def node_detail(request, node_id):
     # Get Node Object
     node = get_object_or_404(Node, id=node_id)
 
-    # Get Container List
+    # Get Container List. The summary listing has everything the page shows,
+    # so containers are not inspected one by one.
     try:
-        client = docker.DockerClient(
-            base_url=f'tcp://{node.ip_address}:{node.api_port}')
-        containers = []
-        for container in client.containers.list():
-            containers.append(container.attrs)
+        client = clients.get_client(
+            f'tcp://{node.ip_address}:{node.api_port}')
+        containers = snapshots.containers(client.api.containers())
 
     except:
         containers = [{"error": "Error retrieving containers"}]
@@ -77,6 +109,7 @@ def node_detail(request, node_id):
     context = {
         'node': node,
         'containers': containers,
+        'utilization_stream': True,
     }
 
     return render(request, 'swarman/node_detail.html', context)
@@ -134,37 +167,21 @@ def service_detail(request, swarm_id):
         if service_id:
             service = swarm.get_service_data(service_id)
             tasks = swarm.get_service_tasks(service_id)
-            context['running_tasks'] = 0
-            for task in tasks:
-                if task['Status']['State'] == "running":
-                    context['running_tasks'] += 1
-            
-            context['service_name'] = service['Spec']['Name']
-            context['service_id'] = service['ID']
-            context['replicas'] = service['Spec']['Mode']['Replicated']['Replicas']
-            context['image'] = service['Spec']['TaskTemplate']['ContainerSpec']['Image'].split('@')[0]
-            context['published_port'] = service['Spec']['EndpointSpec']['Ports'][0]['PublishedPort']
-            context['target_port'] = service['Spec']['EndpointSpec']['Ports'][0]['TargetPort']
-            # Calculate Service Status
-            if context['running_tasks'] == 0 and context['replicas'] == 0:
-                context['service_status'] = 'Paused'
-                context['service_status_display'] = format_html('<strong><span style="color: #8B8000;">{}</span></strong>',
-                                                        'Paused')  
-            elif 0 < context['running_tasks'] < context['replicas']:
-                context['service_status'] = 'Degraded'
-                context['service_status_display'] = format_html('<strong><span style="color: orange;">{}</span></strong>',
-                                                        'Degraded')
-            elif 0 == context['running_tasks'] < context['replicas']:
-                context['service_status'] = 'Error'
-                context['service_status_display'] = format_html('<strong><span style="color: red;">{}</span></strong>',
-                                                        'Error')
+            if isinstance(service, str) or tasks == "Error":
+                # No manager could be reached
+                context['error'] = 'Error retrieving service information'
             else:
-                context['service_status'] = 'Running'
-                context['service_status_display'] = format_html('<strong><span style="color: green;">{}</span></strong>',
-                                                        'Running')
-            
-            
+                context.update(service_detail_context(service, tasks))
+
         else:
             context['error'] = 'Service ID is a required URL parameter'
 
-        return render(request, 'swarman/service_detail.html', context)
\ No newline at end of file
+        return render(request, 'swarman/service_detail.html', context)
+
+
+def prometheus_metrics(request):
+    """
+    Node, container and service metrics and Docker call latencies in the
+    Prometheus text format, served from cached data (see metrics.py)
+    """
+    return HttpResponse(metrics.collect(), content_type=metrics.CONTENT_TYPE)
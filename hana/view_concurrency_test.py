@@ -0,0 +1,86 @@
+"""
+Script to compare how the WSGI (sync views) and ASGI (async views) deployments
+hold up with many dashboard viewers at once
+
+Start both servers from the hana directory, for example:
+    gunicorn hana.wsgi:application --workers 2 --bind 127.0.0.1:8000
+    SWARMAN_ASYNC_VIEWS=True uvicorn hana.asgi:application --port 8001
+
+Then run:
+    python view_concurrency_test.py /swarman/dashboard/1 --concurrency 50
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def timed_get(session, url):
+    '''Returns the latency of one GET request and whether it succeeded'''
+    start = time.time()
+    try:
+        response = session.get(url, timeout=120)
+        ok = response.status_code == 200
+    except requests.RequestException:
+        ok = False
+
+    return time.time() - start, ok
+
+
+def run(base_url, path, concurrency, requests_per_client):
+    '''Fires concurrency clients at base_url + path and returns a report'''
+    url = f'{base_url}{path}'
+    total = concurrency * requests_per_client
+
+    def client(_):
+        with requests.Session() as session:
+            return [timed_get(session, url)
+                    for _ in range(requests_per_client)]
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [result for client_results in executor.map(
+            client, range(concurrency)) for result in client_results]
+    elapsed = time.time() - start
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    report = {
+        'requests': total,
+        'errors': total - len(latencies),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0,
+    }
+    if latencies:
+        report['median'] = statistics.median(latencies)
+        report['p95'] = latencies[int(len(latencies) * 0.95) - 1]
+        report['max'] = latencies[-1]
+
+    return report
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('path', help='Path to request, ex: /swarman/dashboard/1')
+parser.add_argument('--wsgi', default='http://127.0.0.1:8000',
+                    help='Base URL of the WSGI server')
+parser.add_argument('--asgi', default='http://127.0.0.1:8001',
+                    help='Base URL of the ASGI server')
+parser.add_argument('--concurrency', type=int, default=50)
+parser.add_argument('--requests', type=int, default=4,
+                    help='Requests made by each concurrent client')
+args = parser.parse_args()
+
+print('**********RUN REPORT**********')
+for name, base_url in (('WSGI (sync views)', args.wsgi),
+                       ('ASGI (async views)', args.asgi)):
+    report = run(base_url, args.path, args.concurrency, args.requests)
+    print('\n')
+    print(f'{name} - {base_url}{args.path}:')
+    print(f"{report['requests']} Requests from {args.concurrency} Clients "
+          f"in {report['elapsed']:.2f}s ({report['errors']} Errors)")
+    print(f"Throughput: {report['throughput']:.2f} Requests/s")
+    if 'median' in report:
+        print(f"Latency: median {report['median']:.3f}s, "
+              f"p95 {report['p95']:.3f}s, max {report['max']:.3f}s")